@@ -1,16 +1,169 @@
+import csv
 import getopt
+import json
+import logging
+import os
 import sys
+from dataclasses import asdict, dataclass
+from timeit import default_timer as timer
+from compact_graph import read_binary_graph
+from graph_reduction import ReducedGraph
 from take_grant import *
 
+# set in every batch worker by init_batch_worker
+batch_graph = None
+batch_limits = dict[str, float | int | None]()
+
+# seconds the parent waits for the batch workers to start
+BATCH_START_TIMEOUT = 600
+
+
+def load_graph(filename: str):
+    if filename.endswith('.json'):
+        return read_graph(filename, labels=False)[0]
+    return read_binary_graph(filename)
+
+
+@dataclass
+class BadQuery:
+    # a query line that cannot be parsed, reported in place of its result
+    is_json: bool
+    number: int
+    error: str
+
+
+def parse_query(line: str) -> tuple[bool, str, str, str]:
+    if line.startswith('{'):
+        query = json.loads(line)
+        if not isinstance(query, dict) or not all(isinstance(query.get(k), str) for k in 'axy'):
+            raise ValueError('expected an object with string "a", "x" and "y"')
+        return True, query['a'], query['x'], query['y']
+    fields = next(csv.reader([line]))
+    if len(fields) != 3:
+        raise ValueError(f'expected 3 csv fields a,x,y, got {len(fields)}')
+    return False, *fields
+
+
+def read_queries(lines):
+    # yields (is_json, a, x, y), a line is either csv "a,x,y" or a json
+    # object {"a": ..., "x": ..., "y": ...}, '#' comments and a csv header
+    # line are skipped. A malformed line yields a BadQuery.
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            query = parse_query(line)
+        except (ValueError, csv.Error) as e:
+            yield BadQuery(line.startswith('{'), number, str(e))
+            continue
+        if query == (False, 'a', 'x', 'y'):
+            continue
+        yield query
+
+
+def format_result(query: tuple[bool, str, str, str], result: bool | None | CanShareExceeded) -> str:
+    # an exceeded limit is reported as unknown, json lines keep its counters
+    is_json, a, x, y = query
+    if isinstance(result, CanShareExceeded):
+        if is_json:
+            return json.dumps({'a': a, 'x': x, 'y': y, 'result': 'unknown', 'exceeded': asdict(result)})
+        return f'{a},{x},{y},unknown'
+    if is_json:
+        return json.dumps({'a': a, 'x': x, 'y': y, 'result': result})
+    return f'{a},{x},{y},{result}'
+
+
+def init_batch_worker(filename: str, limits: dict[str, float | int | None], ready=None):
+    # ready is a barrier the parent waits on until every worker has loaded,
+    # a worker that cannot load breaks it instead of being respawned forever
+    global batch_graph
+    try:
+        if batch_graph is None:
+            # forked workers inherit the graph the parent loaded
+            batch_graph = load_graph(filename)
+    except Exception:
+        if ready is not None:
+            ready.abort()
+        raise
+    batch_limits.update(limits)
+    if ready is not None:
+        ready.wait()
+
+
+def batch_query(query: tuple[bool, str, str, str] | BadQuery) -> str:
+    if isinstance(query, BadQuery):
+        if query.is_json:
+            return json.dumps({'line': query.number, 'error': query.error})
+        return f'error: line {query.number}: {query.error}'
+    _, a, x, y = query
+    return format_result(query, can_share(batch_graph, a, x, y, **batch_limits))
+
+
+def run_batch(filename: str, queries_filename: str, processes: int, limits: dict[str, float | int | None]):
+    # one result line per query on stdout, in input order, timings on stderr
+    global batch_graph
+    start = timer()
+    lines = sys.stdin if queries_filename == '-' else open(queries_filename, 'r')
+    n = 0
+    with lines:
+        queries = read_queries(lines)
+        # the graph is loaded here first, a bad file fails before any worker starts
+        try:
+            batch_graph = load_graph(filename)
+        except (OSError, ValueError, KeyError) as e:
+            print(f'cannot load graph {filename}: {e}', file=sys.stderr)
+            sys.exit(1)
+        batch_limits.update(limits)
+        if processes > 1:
+            import multiprocessing as mp
+            from threading import BrokenBarrierError
+            ready = mp.Barrier(processes + 1)
+            with mp.Pool(processes, initializer=init_batch_worker, initargs=(filename, limits, ready)) as pool:
+                try:
+                    ready.wait(BATCH_START_TIMEOUT)
+                except BrokenBarrierError:
+                    print(f'batch workers could not load graph {filename}', file=sys.stderr)
+                    sys.exit(1)
+                load_time = timer() - start
+                for line in pool.imap(batch_query, queries, chunksize=64):
+                    print(line)
+                    n += 1
+        else:
+            load_time = timer() - start
+            for line in map(batch_query, queries):
+                print(line)
+                n += 1
+
+    total_time = timer() - start
+    query_time = total_time - load_time
+    print(f'{n} queries in {query_time:.3f}s ({n / query_time if query_time > 0 else 0:.0f} queries/sec), '
+          f'load {load_time:.3f}s, total {total_time:.3f}s', file=sys.stderr)
+
+
+def positive_arg(arg: str, kind, help_msg: str):
+    try:
+        value = kind(arg)
+    except ValueError:
+        value = None
+    if value is None or value <= 0:
+        print('Unexpected comand line arguments. Use format:')
+        print('\t' + help_msg)
+        sys.exit()
+    return value
+
 
 def main(argv):
-    help_msg = 'can_share.py -f <filename_of_protection_graph.json> -s <source_object> -d <destination_object> -l <rule_label>'
+    help_msg = 'can_share.py -f <filename_of_protection_graph.json> -s <source_object> -d <destination_object> -l <rule_label> [-r] [-t <timeout_seconds>] [-n <max_states>]\n' \
+               '\tcan_share.py -f <filename_of_protection_graph.json> -s <source_object> -d <destination_object> -l <label,label,...|*>\n' \
+               '\tcan_share.py -f <filename_of_protection_graph.json> -q <queries.csv|queries.jsonl|-> [-p <processes>] [-t <timeout_seconds>] [-n <max_states>]'
 
-    src, dst, l, filename = '', '', '', ''
+    src, dst, l, filename, queries_filename, processes, reduce = '', '', '', '', '', 1, False
+    limits = {'timeout': None, 'max_states': None}
     opts = []
 
     try:
-        opts, _ = getopt.getopt(argv, "hf:s:d:l:")
+        opts, _ = getopt.getopt(argv, "hf:s:d:l:q:p:rt:n:")
     except:
         print('Unexpected comand line arguments. Use format:')
         print('\t' + help_msg)
@@ -28,14 +181,57 @@ def main(argv):
             dst = arg
         elif opt == '-l':
             l = arg
+        elif opt == '-q':
+            queries_filename = arg
+        elif opt == '-p':
+            processes = positive_arg(arg, int, help_msg)
+        elif opt == '-r':
+            reduce = True
+        elif opt == '-t':
+            limits['timeout'] = positive_arg(arg, float, help_msg)
+        elif opt == '-n':
+            limits['max_states'] = positive_arg(arg, int, help_msg)
+
+    if filename != '' and queries_filename != '':
+        # queries carry their own rights and nodes, the reduced graph has no batch mode
+        if src != '' or dst != '' or l != '' or reduce:
+            print('Unexpected comand line arguments. Use format:')
+            print('\t' + help_msg)
+            sys.exit()
+        # per query logging would dominate a batch, only warnings are kept
+        logging.basicConfig(format='%(process)d-%(levelname)s-%(message)s', level=logging.WARNING)
+        run_batch(filename, queries_filename, processes, limits)
+        return
 
     if filename == '' or src == '' or dst == '' or l == '':
         print('Unexpected comand line arguments. Use format:')
         print('\t' + help_msg)
         sys.exit()
 
-    graph = read_graph(filename)[0]
-    print(can_share(graph, a=l, x=src, y=dst))
+    logging.basicConfig(format='%(process)d-%(levelname)s-%(message)s', level=logging.INFO,
+                        filename=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log', 'take_grant.log'),
+                        filemode='w')
+
+    if l == '*' or ',' in l:
+        # several rights or every right held over the destination
+        rights = None if l == '*' else set(l.split(','))
+        obtainable = can_share_rights(load_graph(filename), rights, x=src, y=dst)
+        print(obtainable if obtainable is None else sorted(obtainable))
+        return
+
+    if reduce:
+        # answered on the reduced graph, the reduction goes to stderr
+        reduced = ReducedGraph(load_graph(filename))
+        print(' '.join(f'{k}={v:.3g}' for k, v in reduced.stats().items()), file=sys.stderr)
+        print(reduced.can_share(a=l, x=src, y=dst))
+        return
+
+    res = can_share(load_graph(filename), a=l, x=src, y=dst, **limits)
+    if isinstance(res, CanShareExceeded):
+        # the answer is unknown, the counters reached go to stderr
+        print(f'{res.reason} exceeded after {res.states} states in {res.elapsed:.3f}s', file=sys.stderr)
+        res = 'unknown'
+    print(res)
 
 
 if __name__ == "__main__":
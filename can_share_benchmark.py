@@ -1,57 +1,230 @@
+import getopt
+import json
+import os
+import random
+import sys
+import tempfile
 from timeit import default_timer as timer
-from dataclasses import dataclass
-from can_share import *
+from dataclasses import dataclass, field
+from can_share_index import CanShareIndex
+from take_grant import *
+
+# slowdown over the baseline that fails the run, and the absolute noise
+# floor below which time differences are ignored
+DEFAULT_TOLERANCE = 0.5
+NOISE_FLOOR = 0.001
+
+# search states the path enumeration may expand per query, the adversarial
+# graphs have far more paths than any run could enumerate
+ENUMERATE_MAX_STATES = 200_000
 
 
 @dataclass
-class TestCase:
-    n: int
-    graph_name: str
-    a: str
-    x: str
-    y: str
+class Workload:
+    name: str
+    # (a, x, y, expected) queries
+    queries: list[tuple[str, str, str, bool]]
+    filename: str = ''
+    json_graph: dict | None = field(default=None, repr=False)
+    # also time the legacy path enumeration against the bfs
+    enumerate_paths: bool = False
+
+
+def json_graph(name: str, nodes: list[tuple[str, str]], edges: list[tuple[str, str, str]]) -> dict:
+    return {GRAPH: {ID: name, LABEL: name,
+                    NODES: [{ID: v, LABEL: v, NODE_TYPE: t} for v, t in nodes],
+                    EDGES: [{ID: f'{u}_{v}_{k}', SOURCE: u, TARGET: v, EDGE_TYPE: t}
+                            for k, (u, v, t) in enumerate(edges)]}}
+
+
+def chain_workloads() -> list[Workload]:
+    return [Workload(f'chain_{n}', filename=f'./test/chain_{n}_example3-complex-graph.json',
+                     queries=[('A', '0_1', f'{n - 1}_8', True), ('A', f'{n - 1}_8', '0_1', False)])
+            for n in (3, 6, 12, 24, 48, 86)]
+
+
+def random_workload(num_nodes: int, density: float, seed: int) -> Workload:
+    rnd = random.Random(seed)
+    nodes = [(f'n{i}', rnd.choice([SUBJECT, OBJECT])) for i in range(num_nodes)]
+    edges = [(f'n{rnd.randrange(num_nodes)}', f'n{rnd.randrange(num_nodes)}',
+              rnd.choice([TAKE, GRANT, 'A'])) for _ in range(int(num_nodes * density))]
+    name = f'random_{num_nodes}_{density}'
+    graph = json_graph(name, nodes, edges)
+    queries = [('A', f'n{rnd.randrange(num_nodes)}', f'n{rnd.randrange(num_nodes)}', None)
+               for _ in range(50)]
+    return Workload(name, queries=queries, json_graph=graph)
 
 
-test_graphs = dict[str, nx.MultiDiGraph]()
+def islands_workload(num_islands: int, island_size: int) -> Workload:
+    # islands of subjects joined in a row by t→ g→ t← bridges through objects
+    nodes, edges = [], []
+    for i in range(num_islands):
+        for j in range(island_size):
+            nodes.append((f'i{i}_{j}', SUBJECT))
+            if j > 0:
+                edges.append((f'i{i}_{j - 1}', f'i{i}_{j}', TAKE))
+        if i > 0:
+            nodes += [(f'b{i}_0', OBJECT), (f'b{i}_1', OBJECT)]
+            edges += [(f'i{i - 1}_0', f'b{i}_0', TAKE), (f'b{i}_0', f'b{i}_1', GRANT),
+                      (f'i{i}_0', f'b{i}_1', TAKE)]
+    nodes.append(('y', OBJECT))
+    edges.append((f'i{num_islands - 1}_0', 'y', 'A'))
+    name = f'islands_{num_islands}_{island_size}'
+    return Workload(name, json_graph=json_graph(name, nodes, edges),
+                    queries=[('A', 'i0_0', 'y', True), ('B', 'i0_0', 'y', False)])
 
 
-def set_up(tcc: list[TestCase]):
-    for tc in tcc:
-        g, _, _ = read_graph(f'./test/{tc.graph_name}.json')
-        test_graphs[tc.graph_name] = g
+def adversarial_workload(layers: int) -> Workload:
+    # 2^layers distinct t→ paths between two subjects that never form a
+    # bridge, path enumeration explores all of them
+    nodes = [('s', SUBJECT), ('t', SUBJECT), ('y', OBJECT)]
+    edges = [('t', 'y', 'A')]
+    prev = ['s']
+    for i in range(layers):
+        layer = [f'l{i}_0', f'l{i}_1']
+        nodes += [(v, OBJECT) for v in layer]
+        edges += [(u, v, TAKE) for u in prev for v in layer]
+        prev = layer
+    # t← at the end turns every path into t→* t←, which is no bridge
+    edges += [('t', v, TAKE) for v in prev]
+    name = f'adversarial_{layers}'
+    return Workload(name, json_graph=json_graph(name, nodes, edges),
+                    queries=[('A', 's', 'y', False)], enumerate_paths=True)
 
 
-def benchmark_can_share(tc: TestCase):
-    graph = test_graphs[tc.graph_name]
+def default_workloads() -> list[Workload]:
+    return chain_workloads() + [
+        random_workload(200, 1.0, seed=1), random_workload(200, 3.0, seed=2),
+        random_workload(2000, 2.0, seed=3), random_workload(2000, 5.0, seed=4),
+        islands_workload(200, 5), islands_workload(20, 50),
+        adversarial_workload(8), adversarial_workload(16), adversarial_workload(64),
+    ]
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def run_workload(w: Workload, n: int, processes: int = 1) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = w.filename
+        if w.json_graph is not None:
+            filename = os.path.join(tmp, f'{w.name}.json')
+            with open(filename, 'w') as f:
+                json.dump(w.json_graph, f)
+
+        start = timer()
+        graph = read_graph(filename, labels=False)[0]
+        load_time = timer() - start
+
+    start = timer()
+    index = CanShareIndex(graph, processes)
+    index_time = timer() - start
+
+    latencies = []
+    for _ in range(n):
+        for a, x, y, expected in w.queries:
+            start = timer()
+            res = can_share(graph, a, x, y)
+            latencies.append(timer() - start)
+            if expected is not None and res != expected:
+                raise AssertionError(f'{w.name}: can_share({a}, {x}, {y}) = {res}')
+            if res != index.can_share(a, x, y):
+                raise AssertionError(f'{w.name}: index disagrees on ({a}, {x}, {y})')
 
+    batch = [(a, x, y) for a, x, y, _ in w.queries] * max(1, 1000 // len(w.queries))
     start = timer()
-    for _ in range(tc.n):
-        res = can_share(graph, tc.a, tc.x, tc.y)
-        assert (True == res)
-
-    sum_time = timer() - start
-    print(tc.graph_name,
-          f'V+E={len(graph.nodes)}+{len(graph.edges)}={len(graph.nodes)+len(graph.edges)}',
-          f'n={tc.n}',
-          f'sum_time={sum_time}', f'avg_time={sum_time/tc.n}')
-
-
-test_cases = [
-    TestCase(n=100, graph_name='chain_3_example3-complex-graph',
-             x='0_1', y='2_8', a='A'),
-    TestCase(n=100, graph_name='chain_6_example3-complex-graph',
-             x='0_1', y='5_8', a='A'),
-    TestCase(n=100, graph_name='chain_12_example3-complex-graph',
-             x='0_1', y='11_8', a='A'),
-    TestCase(n=100, graph_name='chain_24_example3-complex-graph',
-             x='0_1', y='23_8', a='A'),
-    TestCase(n=100, graph_name='chain_48_example3-complex-graph',
-             x='0_1', y='47_8', a='A'),
-    TestCase(n=100, graph_name='chain_86_example3-complex-graph',
-             x='0_1', y='85_8', a='A'),
-]
-
-set_up(tcc=test_cases)
-
-for tc in test_cases:
-    benchmark_can_share(tc)
+    index.can_share_many(batch)
+    batch_time = timer() - start
+
+    metrics = {'V': graph.number_of_nodes(), 'E': graph.number_of_edges(),
+               'load_s': load_time, 'index_build_s': index_time,
+               'query_p50_s': percentile(latencies, 0.5),
+               'query_p90_s': percentile(latencies, 0.9),
+               'query_p99_s': percentile(latencies, 0.99),
+               'batch_qps': len(batch) / batch_time}
+    if w.enumerate_paths:
+        metrics |= enumerate_metrics(w, graph)
+    return metrics
+
+
+def enumerate_metrics(w: Workload, graph) -> dict[str, float]:
+    # one bounded path enumeration per query, a query that runs out of
+    # states is counted as exceeded and must not contradict the bfs
+    exceeded = 0
+    start = timer()
+    for a, x, y, expected in w.queries:
+        res = can_share(graph, a, x, y, enumerate_paths=True, max_states=ENUMERATE_MAX_STATES)
+        if isinstance(res, CanShareExceeded):
+            exceeded += 1
+        elif res != can_share(graph, a, x, y):
+            raise AssertionError(f'{w.name}: path enumeration disagrees on ({a}, {x}, {y})')
+    return {'enumerate_s': timer() - start, 'enumerate_exceeded': exceeded}
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    failures = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(name, {}).get(metric)
+            if base is None:
+                continue
+            if metric.endswith('_s') and value > base * (1 + tolerance) and value - base > NOISE_FLOOR:
+                failures.append(f'{name} {metric}: {value:.6f}s, baseline {base:.6f}s')
+            elif metric.endswith('_qps') and value < base / (1 + tolerance):
+                failures.append(f'{name} {metric}: {value:.0f}, baseline {base:.0f}')
+    return failures
+
+
+def main(argv):
+    help_msg = 'can_share_benchmark.py [-n <repeats>] [-w <workload_prefix>] [-o <results.json>] ' \
+               '[-b <baseline.json>] [-t <tolerance>] [-p <index_build_processes>]'
+
+    n, prefix, output, baseline, tolerance, processes = 10, '', '', '', DEFAULT_TOLERANCE, 1
+    try:
+        opts, _ = getopt.getopt(argv, "hn:w:o:b:t:p:")
+    except getopt.GetoptError:
+        print('Unexpected comand line arguments. Use format:')
+        print('\t' + help_msg)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_msg)
+            sys.exit()
+        elif opt == '-n':
+            n = int(arg)
+        elif opt == '-w':
+            prefix = arg
+        elif opt == '-o':
+            output = arg
+        elif opt == '-b':
+            baseline = arg
+        elif opt == '-t':
+            tolerance = float(arg)
+        elif opt == '-p':
+            processes = int(arg)
+
+    results = {}
+    for w in default_workloads():
+        if not w.name.startswith(prefix):
+            continue
+        results[w.name] = metrics = run_workload(w, n, processes)
+        print(w.name, ' '.join(f'{k}={v:.6g}' for k, v in metrics.items()))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        with open(baseline, 'r') as f:
+            failures = regressions(results, json.load(f), tolerance)
+        for failure in failures:
+            print('REGRESSION', failure)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
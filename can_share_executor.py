@@ -0,0 +1,188 @@
+import multiprocessing as mp
+import networkx as nx
+
+from array import array
+from collections import deque
+from shared_arrays import attach_shared, close_shared, share_arrays
+from take_grant import *
+
+# tg edge codes in the shared adjacency, bit 0 is GRANT, bit 1 is forward
+TAKE_BWD, GRANT_BWD, TAKE_FWD, GRANT_FWD = 0, 1, 2, 3
+EDGE_CODES = {(TAKE, False): TAKE_BWD, (GRANT, False): GRANT_BWD,
+              (TAKE, True): TAKE_FWD, (GRANT, True): GRANT_FWD}
+
+# (state, edge code) -> next state, same automaton as BRIDGE_TRANSITIONS
+CODE_TRANSITIONS = {(state, EDGE_CODES[(e_type, forward)]): next_state
+                    for (state, e_type, forward), next_state in BRIDGE_TRANSITIONS.items()}
+
+# how often a worker looks at the cancel flag while searching
+CANCEL_CHECK_INTERVAL = 1024
+
+# worker process state, attached once by _attach
+_arrays = dict[str, memoryview]()
+_cancelled = None
+_states = None
+
+
+def build_shared_arrays(graph: nx.MultiDiGraph) -> tuple[list[str], dict[str, array]]:
+    node_ids = list(graph)
+    index = {v: i for i, v in enumerate(node_ids)}
+    island_ids = tg_islands(graph)
+
+    subjects = array('B', bytes(len(node_ids)))
+    islands = array('i', [-1]) * len(node_ids)
+    for v, island in island_ids.items():
+        subjects[index[v]] = 1
+        islands[index[v]] = island
+
+    # undirected tg adjacency in CSR form
+    offsets = array('i', [0]) * (len(node_ids) + 1)
+    neighbours = array('i')
+    codes = array('B')
+    for i, v in enumerate(node_ids):
+        for w, e_type, forward in tg_neighbours(graph, v):
+            neighbours.append(index[w])
+            codes.append(EDGE_CODES[(e_type, forward)])
+        offsets[i + 1] = len(neighbours)
+
+    # island members in CSR form
+    members = island_members(island_ids)
+    member_offsets = array('i', [0]) * (len(members) + 1)
+    member_nodes = array('i')
+    for island in range(len(members)):
+        member_nodes.extend(index[v] for v in members[island])
+        member_offsets[island + 1] = len(member_nodes)
+
+    return node_ids, {'subjects': subjects, 'islands': islands,
+                      'offsets': offsets, 'neighbours': neighbours, 'codes': codes,
+                      'member_offsets': member_offsets, 'member_nodes': member_nodes}
+
+
+def _attach(shm_name: str, layout: dict[str, tuple[int, str, int]], cancelled, states):
+    global _cancelled, _states
+    _arrays.update(attach_shared(shm_name, layout))
+    _cancelled = cancelled
+    _states = states
+
+
+def _bridge_task(args: tuple[int, tuple[int, ...], tuple[int, ...], tuple | None]) -> bool:
+    query_id, xi_islands, si_islands, limits = args
+
+    def cancelled() -> bool:
+        return _cancelled.value >= query_id
+
+    if cancelled():
+        return False
+    # states of a cancelled task are not added to the counter of the next query
+    budget = Budget(*limits, shared=_states, stale=cancelled) if limits is not None else None
+    try:
+        return shared_bridge_search(_arrays, set(xi_islands), set(si_islands), cancelled, budget)
+    finally:
+        if budget is not None:
+            budget.flush()
+
+
+def shared_bridge_search(arrays: dict, xi_islands: set[int], si_islands: set[int],
+                         cancelled=None, budget: Budget | None = None) -> bool:
+    # one bfs from all x' islands at once, stops at the first s' island
+    subjects, islands = arrays['subjects'], arrays['islands']
+    offsets, neighbours, codes = arrays['offsets'], arrays['neighbours'], arrays['codes']
+    member_offsets, member_nodes = arrays['member_offsets'], arrays['member_nodes']
+
+    if not xi_islands.isdisjoint(si_islands):
+        return True
+
+    seen_islands = set(xi_islands)
+    visited = set()
+    to_visit = deque((member_nodes[i], BRIDGE_START) for island in xi_islands
+                     for i in range(member_offsets[island], member_offsets[island + 1]))
+    steps = 0
+    while to_visit:
+        steps += 1
+        if cancelled is not None and steps % CANCEL_CHECK_INTERVAL == 0 and cancelled():
+            return False
+        v, state = to_visit.popleft()
+        if budget is not None:
+            budget.spend()
+        for i in range(offsets[v], offsets[v + 1]):
+            next_state = CODE_TRANSITIONS.get((state, codes[i]))
+            if next_state is None:
+                continue
+            w = neighbours[i]
+            if subjects[w]:
+                island = islands[w]
+                if island in si_islands:
+                    return True
+                if island not in seen_islands:
+                    seen_islands.add(island)
+                    to_visit.extend((member_nodes[j], BRIDGE_START)
+                                    for j in range(member_offsets[island], member_offsets[island + 1]))
+            elif (w, next_state) not in visited:
+                visited.add((w, next_state))
+                to_visit.append((w, next_state))
+    return False
+
+
+class CanShareExecutor:
+    # long-lived pool for condition 4, the graph is put into shared memory
+    # once and workers only receive integer ids. Rebuild it after the graph
+    # is modified.
+
+    def __init__(self, graph: nx.MultiDiGraph, processes: int | None = None):
+        self.graph = graph
+        node_ids, arrays = build_shared_arrays(graph)
+        self.index = {v: i for i, v in enumerate(node_ids)}
+        self.islands = arrays['islands']
+
+        self.shm, layout, views = share_arrays(arrays)
+        for view in views.values():
+            view.release()
+
+        self.processes = processes or mp.cpu_count()
+        self.query_id = 0
+        self.cancelled = mp.Value('q', 0, lock=False)
+        # states expanded by the workers for the current query
+        self.states = mp.Value('q', 0)
+        self.pool = mp.Pool(processes, initializer=_attach,
+                            initargs=(self.shm.name, layout, self.cancelled, self.states))
+
+    def island_bridge_reachable(self, xi_ids: set[str], si_ids: set[str], budget: Budget | None = None) -> bool:
+        self.query_id += 1
+        xi_islands = {self.islands[self.index[x]] for x in xi_ids}
+        si_islands = tuple({self.islands[self.index[s]] for s in si_ids})
+        if not xi_islands.isdisjoint(si_islands):
+            return True
+
+        # x' islands are split into at most one multi-source search per
+        # worker, every search looks for all s' islands
+        xi_islands = list(xi_islands)
+        chunks = min(len(xi_islands), self.processes)
+        limits = None if budget is None else budget.limits()
+        tasks = ((self.query_id, tuple(xi_islands[k::chunks]), si_islands, limits) for k in range(chunks))
+        # tasks of the last query are cancelled, under the lock none of
+        # them adds to the counter after the reset
+        with self.states.get_lock():
+            self.states.value = 0
+        results = self.pool.imap_unordered(_bridge_task, tasks)
+        try:
+            while True:
+                if next_result(results, budget):
+                    return True
+        except StopIteration:
+            return False
+        finally:
+            # outstanding tasks of this query return immediately
+            self.cancelled.value = self.query_id
+            if budget is not None:
+                budget.states += self.states.value
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        close_shared(self.shm, {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,354 @@
+import hashlib
+import os
+import networkx as nx
+
+from array import array
+from compact_graph import *
+
+
+class SparseForest(dict):
+    # union-find parent of the few nodes a task touches, an unset node is
+    # its own root. find and union take it in place of a parent array.
+
+    def __missing__(self, v: int) -> int:
+        return v
+
+
+def find(parent: array | SparseForest, v: int) -> int:
+    while parent[v] != v:
+        parent[v] = parent[parent[v]]
+        v = parent[v]
+    return v
+
+
+def union(parent: array | SparseForest, u: int, v: int):
+    u, v = find(parent, u), find(parent, v)
+    if u != v:
+        parent[max(u, v)] = min(u, v)
+
+
+def bridge_components(graph: CompactTGGraph) -> array:
+    # subjects joined by islands and bridges get the same component id,
+    # objects get -1. Bridges read backwards are bridges again, so this is
+    # plain connectivity over (node, bridge state) pairs where every subject
+    # resets the automaton. States are v * 3 + state.
+    n = len(graph)
+    subjects = array('i', (v for v in range(n) if graph.is_subject(v)))
+
+    # object states reachable from some subject
+    reachable = bytearray(3 * n)
+    frontier = array('i', (3 * v for v in subjects))
+    for sv in frontier:
+        reachable[sv] = 1
+    while frontier:
+        frontier = expand_reachable(graph, reachable, frontier)
+
+    # exit[s] is some subject reachable from object state s, -1 if none
+    exit_subject = array('i', [-1]) * (3 * n)
+    for v in subjects:
+        exit_subject[3 * v] = v
+    frontier = array('i', (3 * v for v in subjects))
+    while frontier:
+        frontier = expand_exits(graph, exit_subject, frontier)
+
+    # every subject reachable from a reachable state shares one component
+    parent = array('i', range(n))
+    bridge_unions(graph, reachable, exit_subject, range(n), parent)
+
+    components = array('i', [-1]) * n
+    for v in subjects:
+        components[v] = find(parent, v)
+    return components
+
+
+def expand_reachable(graph: CompactTGGraph, reachable, frontier: array) -> array:
+    # object states one transition past the frontier, newly marked in reachable
+    transitions = COMPACT_BRIDGE_TRANSITIONS
+    found = array('i')
+    for sv in frontier:
+        v, state = divmod(sv, 3)
+        for w, code, forward in graph._tg_neighbours(v):
+            next_state = transitions.get((state, code, forward))
+            if next_state is None or graph.is_subject(w):
+                continue
+            sw = 3 * w + next_state
+            if not reachable[sw]:
+                reachable[sw] = 1
+                found.append(sw)
+    return found
+
+
+def expand_exits(graph: CompactTGGraph, exit_subject, frontier: array) -> array:
+    # object states one transition before the frontier, they get its exit
+    transitions = COMPACT_BRIDGE_TRANSITIONS
+    found = array('i')
+    for sw in frontier:
+        w, w_state = divmod(sw, 3)
+        for v, code, forward in graph._tg_neighbours(w):
+            if graph.is_subject(v):
+                continue
+            # the edge is walked from v to w in the opposite direction
+            for state in (1, 2):
+                next_state = transitions.get((state, code, not forward))
+                if next_state is None or (w_state != 0 and next_state != w_state):
+                    continue
+                sv = 3 * v + state
+                if exit_subject[sv] == -1:
+                    exit_subject[sv] = exit_subject[sw]
+                    found.append(sv)
+    return found
+
+
+def bridge_unions(graph: CompactTGGraph, reachable, exit_subject, nodes, parent: array | SparseForest):
+    # unions the subjects joined by the transitions leaving the states of nodes
+    transitions = COMPACT_BRIDGE_TRANSITIONS
+    for v in nodes:
+        for state in (0, 1, 2):
+            sv = 3 * v + state
+            if state == 0:
+                if not graph.is_subject(v):
+                    continue
+                source = v
+            elif reachable[sv] and exit_subject[sv] != -1:
+                source = exit_subject[sv]
+            else:
+                continue
+            for w, code, forward in graph._tg_neighbours(v):
+                next_state = transitions.get((state, code, forward))
+                if next_state is None:
+                    continue
+                if graph.is_subject(w):
+                    union(parent, source, w)
+                elif exit_subject[3 * w + next_state] != -1:
+                    union(parent, source, exit_subject[3 * w + next_state])
+
+
+def component_labels(components: array) -> array:
+    # dense bit numbers of the components in order of their first subject
+    numbers = {}
+    labels = array('i', [-1]) * len(components)
+    for v, c in enumerate(components):
+        if c != -1:
+            labels[v] = numbers.setdefault(c, len(numbers))
+    return labels
+
+
+class CanShareIndex:
+    # per-graph precomputation for can_share: islands, bridge components
+    # and the components of the initial and terminal spans of every node,
+    # kept as bitsets over dense component numbers. Queries are a few
+    # bitset ands afterwards.
+
+    def __init__(self, graph: nx.MultiDiGraph | CompactTGGraph, processes: int = 1):
+        if not isinstance(graph, CompactTGGraph):
+            graph = CompactTGGraph.from_graph(graph)
+        self.graph = graph
+        self._component_members = None
+        if processes > 1:
+            # same index, built by a process pool, see parallel_index
+            from parallel_index import parallel_index_parts
+            self.islands, self.components, self.initial_components, self.terminal_components = \
+                parallel_index_parts(graph, processes)
+            return
+
+        self.islands = graph._islands()
+        self.components = bridge_components(graph)
+        # component ids are subject ids, bits are numbered densely
+        labels = component_labels(self.components)
+        self.initial_components, self.terminal_components = graph._bulk_spans(labels)
+
+    @classmethod
+    def from_parts(cls, graph: CompactTGGraph, islands, components, initial_components, terminal_components) -> 'CanShareIndex':
+        index = cls.__new__(cls)
+        index.graph = graph
+        index.islands = graph._island_ids = islands
+        index.components = components
+        index.initial_components = initial_components
+        index.terminal_components = terminal_components
+        index._component_members = None
+        return index
+
+    def component_members(self) -> dict[int, list[int]]:
+        if self._component_members is None:
+            members = dict[int, list[int]]()
+            for v, c in enumerate(self.components):
+                if c != -1:
+                    members.setdefault(c, []).append(v)
+            self._component_members = members
+        return self._component_members
+
+    def _can_share(self, a: int, x: int, y: int) -> bool:
+        s_ids = self.graph._s_y_a_nodes(a, y)
+        # condition 0
+        if x in s_ids:
+            return True
+        # conditions 1-4
+        xi_components = self.initial_components[x]
+        if not xi_components:
+            return False
+        return any(xi_components & self.terminal_components[s] for s in s_ids)
+
+    def can_share(self, a: str, x: str, y: str) -> bool | None:
+        if x == y:
+            return None
+        index = self.graph.index
+        if a not in self.graph.right_codes or x not in index or y not in index:
+            return False
+        return self._can_share(self.graph.right_codes[a], index[x], index[y])
+
+    def can_share_rights(self, rights: set[str] | None, x: str, y: str) -> set[str] | None:
+        # rights over y x can obtain, every right held over y when rights is None
+        if x == y:
+            return None
+        graph, index = self.graph, self.graph.index
+        if x not in index or y not in index:
+            return set()
+        x_id = index[x]
+        xi_components = self.initial_components[x_id]
+        obtainable = set()
+        for a, s_ids in graph._in_rights(index[y]).items():
+            right = graph.rights[a]
+            if rights is not None and right not in rights:
+                continue
+            if x_id in s_ids or (xi_components and any(
+                    xi_components & self.terminal_components[s] for s in s_ids)):
+                obtainable.add(right)
+        return obtainable
+
+    def can_share_many(self, queries) -> list[bool | None]:
+        # queries are (a, x, y) triples
+        return [self.can_share(a, x, y) for a, x, y in queries]
+
+    def who_can_obtain(self, a: str, y: str) -> set[str]:
+        graph = self.graph
+        if a not in graph.right_codes or y not in graph.index:
+            return set()
+        y_id = graph.index[y]
+        s_ids = graph._s_y_a_nodes(graph.right_codes[a], y_id)
+        si_components = 0
+        for s in s_ids:
+            si_components |= self.terminal_components[s]
+        return {graph.node_ids[x] for x in range(len(graph)) if x != y_id and (
+            x in s_ids or si_components & self.initial_components[x])}
+
+    def what_can_x_obtain(self, x: str) -> set[tuple[str, str]]:
+        # (right, node) pairs x can obtain
+        graph = self.graph
+        if x not in graph.index:
+            return set()
+        x_id = graph.index[x]
+        xi_components = self.initial_components[x_id]
+        obtainable = set()
+        for right_group in (
+                ((s, y, TAKE_CODE) for s, y in csr_edges(graph.take_out)),
+                ((s, y, GRANT_CODE) for s, y in csr_edges(graph.grant_out)),
+                csr_edges(graph.other_out)):
+            for s, y, a in right_group:
+                if y != x_id and (s == x_id or xi_components & self.terminal_components[s]):
+                    obtainable.add((graph.rights[a], graph.node_ids[y]))
+        return obtainable
+
+
+def csr_edges(csr: tuple):
+    offsets, adjacent = csr[0], csr[1]
+    for v in range(len(offsets) - 1):
+        for i in range(offsets[v], offsets[v + 1]):
+            if len(csr) == 3:
+                yield v, adjacent[i], csr[2][i]
+            else:
+                yield v, adjacent[i]
+
+
+# index snapshot: the binary graph arrays followed by islands, components
+# and the span bitsets, tied to a checksum of the graph file it was built
+# from. Distinct bitsets are stored once, little-endian, and nodes refer
+# to them by number.
+SNAPSHOT_MAGIC = b'TGS1'
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotSpans:
+    # per-node span bitsets of a snapshot, decoded on first use. Initial and
+    # terminal spans share the decoded ints.
+
+    def __init__(self, ids: memoryview, offsets: memoryview, blob: memoryview, decoded: dict[int, int]):
+        self.ids = ids
+        self.offsets = offsets
+        self.blob = blob
+        self.decoded = decoded
+
+    def __getitem__(self, v: int) -> int:
+        k = self.ids[v]
+        bits = self.decoded.get(k)
+        if bits is None:
+            bits = self.decoded[k] = int.from_bytes(self.blob[self.offsets[k]:self.offsets[k + 1]], 'little')
+        return bits
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def source_checksum(filename: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_snapshot(index: CanShareIndex, filename: str, source: str):
+    numbers = dict[int, int]()
+    span_offsets = array('q', [0])
+    blobs = []
+
+    def span_ids(spans) -> array:
+        ids = array('i')
+        for bits in spans:
+            k = numbers.get(bits)
+            if k is None:
+                k = numbers[bits] = len(blobs)
+                blobs.append(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'))
+                span_offsets.append(span_offsets[-1] + len(blobs[-1]))
+            ids.append(k)
+        return ids
+
+    graph = index.graph
+    arrays = binary_arrays(graph)
+    arrays['islands'] = index.islands
+    arrays['components'] = index.components
+    arrays['initial_ids'] = span_ids(index.initial_components[v] for v in range(len(graph)))
+    arrays['terminal_ids'] = span_ids(index.terminal_components[v] for v in range(len(graph)))
+    arrays['span_offsets'] = span_offsets
+    arrays['span_blob'] = b''.join(blobs)
+    st = os.stat(source)
+    header = {'version': SNAPSHOT_VERSION, 'rights': graph.rights,
+              'source_size': st.st_size, 'source_checksum': source_checksum(source)}
+    # readers never see a partly written snapshot
+    write_arrays(filename + '.tmp', SNAPSHOT_MAGIC, header, arrays)
+    os.replace(filename + '.tmp', filename)
+
+
+def read_snapshot(filename: str, source: str | None = None) -> CanShareIndex:
+    # memory-maps the snapshot, with a source the snapshot is rejected
+    # unless it was built from exactly that file
+    header, arrays = map_arrays(filename, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 'can_share index snapshot')
+    if source is not None and (os.stat(source).st_size != header['source_size'] or
+                               source_checksum(source) != header['source_checksum']):
+        raise ValueError("%s is stale, %s changed" % (filename, source))
+    decoded = {}
+    spans = (arrays['span_offsets'], arrays['span_blob'])
+    return CanShareIndex.from_parts(graph_from_arrays(arrays, header['rights']),
+                                    arrays['islands'], arrays['components'],
+                                    SnapshotSpans(arrays['initial_ids'], *spans, decoded),
+                                    SnapshotSpans(arrays['terminal_ids'], *spans, decoded))
+
+
+def load_or_build_index(source: str, snapshot: str) -> CanShareIndex:
+    # the snapshot if it is fresh, otherwise a new index that replaces it
+    try:
+        return read_snapshot(snapshot, source)
+    except (OSError, ValueError, KeyError):
+        pass
+    index = CanShareIndex(read_any_graph(source))
+    write_snapshot(index, snapshot, source)
+    return index
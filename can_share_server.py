@@ -0,0 +1,296 @@
+import asyncio
+import getopt
+import hashlib
+import json
+import os
+import stat
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from can_share_index import CanShareIndex, SnapshotSpans, load_or_build_index
+from compact_graph import CompactTGGraph, read_any_graph
+from take_grant import *
+
+DEFAULT_MEMORY_CAP = 1 << 30
+
+
+@dataclass
+class CachedGraph:
+    graph: CompactTGGraph
+    index: CanShareIndex
+    # file version the graph was loaded from
+    mtime_ns: int
+    size: int
+    nbytes: int
+
+
+def file_version(filename: str) -> tuple[int, int]:
+    st = os.stat(filename)
+    return st.st_mtime_ns, st.st_size
+
+
+def estimated_nbytes(graph: CompactTGGraph, index: CanShareIndex) -> int:
+    # csr arrays, node ids, the per-node lists of the index and every
+    # distinct span bitset once, equal bitsets are interned
+    nbytes = sum(sys.getsizeof(v) + 8 for v in graph.node_ids)
+    for csr in (graph.take_out, graph.take_in, graph.grant_out, graph.grant_in,
+                graph.other_out, graph.other_in):
+        nbytes += sum(part.nbytes for part in csr)
+    nbytes += index.islands.itemsize * len(index.islands)
+    nbytes += index.components.itemsize * len(index.components)
+    nbytes += 16 * len(graph)
+    if isinstance(index.initial_components, SnapshotSpans):
+        # initial and terminal spans of a snapshot share one blob
+        nbytes += index.initial_components.blob.nbytes
+    else:
+        distinct = {id(bits): bits for spans in (index.initial_components, index.terminal_components)
+                    for bits in spans}
+        nbytes += sum((bits.bit_length() + 7) // 8 for bits in distinct.values())
+    return nbytes
+
+
+def snapshot_path(snapshot_dir: str, filename: str) -> str:
+    # one snapshot per graph path
+    digest = hashlib.blake2b(filename.encode(), digest_size=8).hexdigest()
+    return os.path.join(snapshot_dir, f'{os.path.basename(filename)}.{digest}.tgs')
+
+
+def load_entry(filename: str, snapshot_dir: str = '') -> CachedGraph:
+    mtime_ns, size = file_version(filename)
+    if snapshot_dir:
+        index = load_or_build_index(filename, snapshot_path(snapshot_dir, filename))
+    else:
+        index = CanShareIndex(read_any_graph(filename))
+    return CachedGraph(index.graph, index, mtime_ns, size, estimated_nbytes(index.graph, index))
+
+
+class GraphCache:
+    # parsed graphs and their indexes keyed by file path. Least recently
+    # used entries are dropped once the estimated size exceeds the cap,
+    # the newest entry is always kept. With a snapshot directory indexes
+    # are opened from fresh snapshots and written back after a rebuild.
+
+    def __init__(self, memory_cap: int = DEFAULT_MEMORY_CAP, snapshot_dir: str = ''):
+        self.memory_cap = memory_cap
+        self.snapshot_dir = snapshot_dir
+        self.entries = OrderedDict[str, CachedGraph]()
+        self.nbytes = 0
+        self.loading = dict[str, asyncio.Task]()
+        self.hits = self.misses = self.loads = self.evictions = self.reloads = 0
+
+    async def get(self, filename: str) -> CachedGraph:
+        key = os.path.abspath(filename)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return await self._load(key)
+
+    async def reload(self, filename: str, force: bool = False) -> bool:
+        # loads the file again if it changed on disk, old entry answers
+        # queries until the new one is ready
+        key = os.path.abspath(filename)
+        entry = self.entries.get(key)
+        if entry is not None and not force and file_version(key) == (entry.mtime_ns, entry.size):
+            return False
+        await self._load(key)
+        self.reloads += 1
+        return True
+
+    async def _load(self, key: str) -> CachedGraph:
+        # concurrent requests for one file share a single load
+        task = self.loading.get(key)
+        if task is None:
+            task = self.loading[key] = asyncio.create_task(self._load_and_put(key))
+            task.add_done_callback(lambda _: self.loading.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _load_and_put(self, key: str) -> CachedGraph:
+        entry = await asyncio.to_thread(load_entry, key, self.snapshot_dir)
+        self.loads += 1
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self.entries[key] = entry
+        self.nbytes += entry.nbytes
+        while self.nbytes > self.memory_cap and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+        return entry
+
+    def stats(self) -> dict:
+        return {'graphs': list(self.entries), 'nbytes': self.nbytes, 'memory_cap': self.memory_cap,
+                'hits': self.hits, 'misses': self.misses, 'loads': self.loads,
+                'evictions': self.evictions, 'reloads': self.reloads}
+
+
+def sorted_rights(rights: set[str] | None) -> list[str] | None:
+    return rights if rights is None else sorted(rights)
+
+
+# index lookups are answered on the event loop, traversals in a thread
+FAST_QUERIES = {
+    'can_share': lambda e, r: e.index.can_share(r['a'], r['x'], r['y']),
+    'can_share_rights': lambda e, r: sorted_rights(e.index.can_share_rights(r.get('rights'), r['x'], r['y'])),
+}
+SLOW_QUERIES = {
+    'can_steal': lambda e, r: can_steal(e.graph, r['a'], r['x'], r['y'], e.index),
+    'can_know': lambda e, r: can_know(e.graph, r['x'], r['y'], e.index),
+    'audit': lambda e, r: asdict(audit(e.graph, r['a'], r['x'], r['y'], e.index)),
+}
+
+
+class CanShareServer:
+    # JSON-lines protocol, one request object per line:
+    #   {"id": 1, "op": "can_share", "graph": "g.json", "a": "A", "x": "1", "y": "8"}
+    #   {"id": 2, "op": "can_share_rights", "graph": "g.json", "rights": ["A", "B"], "x": "1", "y": "8"}
+    #   {"id": 3, "op": "reload", "graph": "g.json", "force": false}
+    #   {"id": 4, "op": "stats"}
+    # every response carries the request id, {"id": 1, "result": true} or
+    # {"id": 1, "error": "..."}. Requests on one stream run concurrently
+    # and may be answered out of order.
+
+    def __init__(self, cache: GraphCache):
+        self.cache = cache
+
+    async def handle(self, request: dict) -> dict:
+        if not isinstance(request, dict):
+            return {'id': None, 'error': 'bad request: expected an object, got %s' % type(request).__name__}
+        response = {'id': request.get('id')}
+        op = request.get('op', 'can_share')
+        try:
+            if op == 'reload':
+                response['result'] = await self.cache.reload(request['graph'], request.get('force', False))
+            elif op == 'stats':
+                response['result'] = self.cache.stats()
+            elif op in FAST_QUERIES:
+                entry = await self.cache.get(request['graph'])
+                response['result'] = FAST_QUERIES[op](entry, request)
+            elif op in SLOW_QUERIES:
+                entry = await self.cache.get(request['graph'])
+                response['result'] = await asyncio.to_thread(SLOW_QUERIES[op], entry, request)
+            else:
+                response['error'] = 'unknown op %s' % op
+        except KeyError as e:
+            response['error'] = 'missing field %s' % e
+        except (OSError, ValueError) as e:
+            response['error'] = str(e)
+        except Exception as e:
+            # a bad request must not take the other ones on the stream down
+            response['error'] = '%s: %s' % (type(e).__name__, e)
+        return response
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        lock = asyncio.Lock()
+        tasks = set()
+        while line := await reader.readline():
+            if not line.strip():
+                continue
+            task = asyncio.create_task(self._answer(line, writer, lock))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        writer.close()
+
+    async def _answer(self, line: bytes, writer: asyncio.StreamWriter, lock: asyncio.Lock):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {'id': None, 'error': 'bad request: %s' % e}
+        else:
+            response = await self.handle(request)
+        async with lock:
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+
+
+class FileReader:
+    # readline of a stdin the event loop cannot watch, e.g. a regular file
+    def __init__(self, file):
+        self.file = file
+
+    async def readline(self) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor(None, self.file.readline)
+
+
+class FileWriter:
+    # buffered writes to a stdout the event loop cannot watch
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, data: bytes):
+        self.file.write(data)
+
+    async def drain(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.flush()
+
+
+def is_pipe(file) -> bool:
+    # what connect_read_pipe and connect_write_pipe accept
+    mode = os.fstat(file.fileno()).st_mode
+    return stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or stat.S_ISCHR(mode)
+
+
+async def stdio_streams() -> tuple:
+    loop = asyncio.get_running_loop()
+    if is_pipe(sys.stdin):
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    else:
+        reader = FileReader(sys.stdin.buffer)
+    if is_pipe(sys.stdout):
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+        writer = asyncio.StreamWriter(transport, protocol, None, loop)
+    else:
+        writer = FileWriter(sys.stdout.buffer)
+    return reader, writer
+
+
+async def run(socket_path: str, memory_cap: int, preload: list[str], snapshot_dir: str = ''):
+    server = CanShareServer(GraphCache(memory_cap, snapshot_dir))
+    for filename in preload:
+        await server.cache.get(filename)
+    if socket_path:
+        unix_server = await asyncio.start_unix_server(server.serve, socket_path)
+        async with unix_server:
+            await unix_server.serve_forever()
+    else:
+        await server.serve(*await stdio_streams())
+
+
+def main(argv):
+    help_msg = 'can_share_server.py [-u <socket_path>] [-m <memory_cap_mb>] [-c <snapshot_dir>] [-f <preloaded_graph>]...'
+
+    socket_path, memory_cap, preload, snapshot_dir = '', DEFAULT_MEMORY_CAP, [], ''
+    try:
+        opts, _ = getopt.getopt(argv, "hu:m:f:c:")
+    except getopt.GetoptError:
+        print('Unexpected comand line arguments. Use format:')
+        print('\t' + help_msg)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_msg)
+            sys.exit()
+        elif opt == '-u':
+            socket_path = arg
+        elif opt == '-m':
+            memory_cap = int(float(arg) * (1 << 20))
+        elif opt == '-f':
+            preload.append(arg)
+        elif opt == '-c':
+            snapshot_dir = arg
+
+    asyncio.run(run(socket_path, memory_cap, preload, snapshot_dir))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,9 +1,33 @@
+import hashlib
+import io
+import json
+import random
+import re
+import os
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
-from dataclasses import dataclass
+from contextlib import redirect_stdout, redirect_stderr
+from unittest.mock import patch
+from collections import Counter
+from dataclasses import dataclass, asdict
 from can_share import *
+from can_share_executor import *
+from can_share_index import *
+from take_grant_engine import *
+from graph_generator import *
+from can_share_server import *
+from graph_reduction import *
+
+try:
+    from sparse_graph import SparseTGGraph
+except ImportError:
+    SparseTGGraph = None
 
 test_cases = ['condition_1', 'condition_2', 'condition_3_1', 'condition_3_2', 'condition_4_1', 'condition_4_2',
-              'example1-tg-bridge', 'example2-big-fig', 'example3-complex-graph']
+              'example1-tg-bridge', 'example2-big-fig', 'example3-complex-graph', 'random_graph_30_75']
 
 test_graphs = dict[str, nx.MultiDiGraph]()
 
@@ -15,6 +39,7 @@ def set_up(names: list[str]):
 
 
 def print_test_graphs(names: list[str]):
+    from view import print_graph
     for name in names:
         g, nodes_to_labels, edges_to_labels = read_graph(f'./test/{name}.json')
         print_graph(g, f'./view/{name}_view', nodes_to_labels, edges_to_labels)
@@ -150,7 +175,6 @@ class TestCondition4_1(unittest.TestCase):
             expected: bool
 
         graph = test_graphs['condition_4_1']
-        graph_view = graph.to_undirected(as_view=True)
         testcases = [
             TestCase(xi_si=('1', '4'), expected=True),
             TestCase(xi_si=('5', '6'), expected=True),
@@ -168,7 +192,7 @@ class TestCondition4_1(unittest.TestCase):
         ]
 
         for case in testcases:
-            actual = island_bridge_paths_exist((graph, graph_view, case.xi_si))
+            actual = island_bridge_paths_exist((graph, case.xi_si))
             self.assertEqual(
                 case.expected,
                 actual,
@@ -186,7 +210,6 @@ class TestCondition4_2(unittest.TestCase):
             expected: bool
 
         graph = test_graphs['condition_4_2']
-        graph_view = graph.to_undirected(as_view=True)
         testcases = [
             TestCase(xi_si=('1', '4'), expected=True),
             TestCase(xi_si=('5', '7'), expected=True),
@@ -195,7 +218,7 @@ class TestCondition4_2(unittest.TestCase):
         ]
 
         for case in testcases:
-            actual = island_bridge_paths_exist((graph, graph_view, case.xi_si))
+            actual = island_bridge_paths_exist((graph, case.xi_si))
             self.assertEqual(
                 case.expected,
                 actual,
@@ -234,3 +257,927 @@ class TestArticlesExamples(unittest.TestCase):
                     case, case.expected, actual
                 ),
             )
+
+
+class TestIslandBridgeReachable(unittest.TestCase):
+    def test_islands(self):
+        graph = test_graphs['condition_4_1']
+        island_ids = tg_islands(graph)
+        self.assertEqual(island_ids['5'], island_ids['6'])
+        self.assertNotEqual(island_ids['1'], island_ids['4'])
+        self.assertNotIn('2', island_ids)
+
+    def test_edge_lookup(self):
+        graph = test_graphs['condition_4_1']
+        table = edge_table(graph)
+        for u, v, key, d in graph.edges(keys=True, data=True):
+            self.assertEqual((u, v, d[EDGE_TYPE]), table[key])
+            self.assertIs(d, get_edge_data(graph, u, v, key))
+            self.assertIs(d, get_edge_data(graph, v, u, key))
+        self.assertIsNone(get_edge_data(graph, '1', '6', 'missing'))
+
+    def test_matches_path_enumeration(self):
+        for name in ['condition_4_1', 'condition_4_2']:
+            graph = test_graphs[name]
+            island_ids = tg_islands(graph)
+            subjects = sorted(island_ids)
+            for xi, si in product(subjects, subjects):
+                if xi == si:
+                    continue
+                expected = island_bridge_paths_exist((graph, (xi, si)))
+                actual = island_bridge_reachable(
+                    graph, {xi}, {si}, island_ids)
+                self.assertEqual(
+                    expected,
+                    actual,
+                    "failed test {} {} expected {}, actual {}".format(
+                        name, (xi, si), expected, actual
+                    ),
+                )
+
+    def test_pinned_path_enumeration(self):
+        # every path enumerated between two subjects, as sorted edge ids
+        expected = {'condition_4_1': (16, 'b3a339a789e2794c'), 'condition_4_2': (36, 'bb7aff4914fed4cb'),
+                    'example1-tg-bridge': (3, 'a0842682a4a404e2'),
+                    'example3-complex-graph': (343, 'eb92f999343cd513')}
+        for name, (count, digest) in expected.items():
+            graph = test_graphs[name]
+            table = edge_table(graph)
+            subjects = sorted(v for v in graph if graph.nodes[v][NODE_TYPE] == SUBJECT)
+            paths = sorted(tuple(key for _, _, key in path) for xi, si in product(subjects, subjects) if xi != si
+                           for path in island_bridge_paths_search(graph, xi, si, table))
+            self.assertEqual(count, len(paths), name)
+            self.assertEqual(digest, hashlib.blake2b(repr(paths).encode(), digest_size=8).hexdigest(), name)
+
+    def test_path_enumeration_self_loop(self):
+        # g→ t→ g→ is no bridge when the t→ is a loop on the object, the
+        # enumerator before the transition table accepted it
+        graph = small_graph({'1': SUBJECT, '2': SUBJECT, '3': OBJECT},
+                            [('1', '3', GRANT), ('3', '3', TAKE), ('3', '2', GRANT)])
+        self.assertEqual([], list(island_bridge_paths_search(graph, '1', '2')))
+        self.assertFalse(island_bridge_reachable(graph, {'1'}, {'2'}))
+        graph.remove_edge('3', '2')
+        graph.add_edge('2', '3', key='t', **{EDGE_TYPE: TAKE})
+        self.assertEqual([[('1', '3', '1_3_GRANT'), ('3', '2', 't')]],
+                         list(island_bridge_paths_search(graph, '1', '2')))
+
+    def test_can_share_matches_path_enumeration(self):
+        graph = test_graphs['random_graph_30_75']
+        nodes = sorted(graph.nodes)
+        for x, y in product(nodes[:6], nodes):
+            for a in ['A', 'TAKE', 'GRANT']:
+                expected = can_share(graph, a, x, y, enumerate_paths=True)
+                actual = can_share(graph, a, x, y)
+                self.assertEqual(
+                    expected,
+                    actual,
+                    "failed test {} expected {}, actual {}".format(
+                        (a, x, y), expected, actual
+                    ),
+                )
+
+
+class TestCanShareExecutor(unittest.TestCase):
+    def test_matches_in_process_search(self):
+        for name in ['condition_4_1', 'random_graph_30_75']:
+            graph = test_graphs[name]
+            nodes = sorted(graph.nodes)
+            with CanShareExecutor(graph, processes=2) as executor:
+                for x, y in product(nodes, nodes):
+                    expected = can_share(graph, 'TAKE', x, y)
+                    actual = can_share(graph, 'TAKE', x, y, executor=executor)
+                    self.assertEqual(
+                        expected,
+                        actual,
+                        "failed test {} {} expected {}, actual {}".format(
+                            name, (x, y), expected, actual
+                        ),
+                    )
+
+
+class InlinePool:
+    # mp.Pool stand-in running every task in the calling process, records
+    # the task arguments
+    def __init__(self, *args, initializer=None, initargs=()):
+        self.tasks = []
+        InlinePool.last = self
+        if initializer is not None:
+            initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def imap_unordered(self, func, tasks):
+        self.tasks = list(tasks)
+        results = map(func, self.tasks)
+
+        class Results:
+            def next(self, timeout=None):
+                return next(results)
+        return Results()
+
+
+class TestIslandPairs(unittest.TestCase):
+    def setUp(self):
+        # islands {x1, x2}, {y}, {s1, s2} and {t}, s2 is only reached from
+        # x2 through the object o, y and t are isolated
+        self.graph = small_graph({'y': SUBJECT, 'x1': SUBJECT, 'x2': SUBJECT, 's1': SUBJECT, 's2': SUBJECT,
+                                  't': SUBJECT, 'o': OBJECT},
+                                 [('x1', 'x2', TAKE), ('s1', 's2', GRANT), ('x2', 'o', TAKE), ('o', 's2', TAKE)])
+
+    def test_same_island(self):
+        with patch('multiprocessing.Pool') as pool:
+            self.assertTrue(condition_4_pool(self.graph, {'x1', 'y'}, {'x2'}, True, None))
+        pool.assert_not_called()
+        with CanShareExecutor(self.graph, processes=2) as executor:
+            with patch.object(executor.pool, 'imap_unordered') as imap:
+                self.assertTrue(executor.island_bridge_reachable({'x1', 'y'}, {'x2'}))
+            imap.assert_not_called()
+
+    def test_one_pair_per_island_pair(self):
+        island_ids = tg_islands(self.graph)
+        with patch('multiprocessing.Pool', InlinePool):
+            self.assertFalse(condition_4_pool(self.graph, {'x1', 'x2', 'y'}, {'t'}, True, None))
+            tasks = InlinePool.last.tasks
+            self.assertEqual(2, len(tasks))
+            self.assertEqual({(island_ids['x1'], island_ids['t']), (island_ids['y'], island_ids['t'])},
+                             {(island_ids[xi], island_ids[si]) for _, (xi, si), *_ in tasks})
+            self.assertTrue(condition_4_pool(self.graph, {'x1', 'x2', 'y'}, {'s1', 's2', 't'}, True, None))
+            self.assertEqual(4, len(InlinePool.last.tasks))
+
+    def test_second_chunk(self):
+        with CanShareExecutor(self.graph, processes=2) as executor:
+            islands = {v: executor.islands[executor.index[v]] for v in self.graph}
+            imap = executor.pool.imap_unordered
+            recorded = []
+
+            def recording_imap(func, tasks):
+                recorded.append(list(tasks))
+                return imap(func, recorded[-1])
+
+            with patch.object(executor.pool, 'imap_unordered', recording_imap):
+                self.assertTrue(executor.island_bridge_reachable({'y', 'x1'}, {'s1'}))
+                self.assertFalse(executor.island_bridge_reachable({'y', 'x1'}, {'t'}))
+            tasks = recorded[0]
+        # one multi-source search per worker, the x' island reaching s' is
+        # not in the first one
+        self.assertEqual(2, len(tasks))
+        self.assertEqual((islands['y'],), tasks[0][1])
+        self.assertEqual((islands['x1'],), tasks[1][1])
+        _, arrays = build_shared_arrays(self.graph)
+        self.assertFalse(shared_bridge_search(arrays, set(tasks[0][1]), set(tasks[0][2])))
+        self.assertTrue(shared_bridge_search(arrays, set(tasks[1][1]), set(tasks[1][2])))
+
+
+class TestCanShareBudget(unittest.TestCase):
+    def setUp(self):
+        from can_share_benchmark import adversarial_workload
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(f'{tmp}/adversarial.json', 'w') as f:
+                json.dump(adversarial_workload(24).json_graph, f)
+            self.graph, _, _ = read_graph(f'{tmp}/adversarial.json')
+
+    def test_exceeded(self):
+        compact = CompactTGGraph.from_graph(self.graph)
+        for graph, enumerate_paths in [(self.graph, False), (self.graph, True), (compact, False)]:
+            res = can_share(graph, 'A', 's', 'y', enumerate_paths=enumerate_paths, max_states=20)
+            self.assertIsInstance(res, CanShareExceeded)
+            self.assertEqual('max_states', res.reason)
+            self.assertGreater(res.states, 20)
+            with self.assertRaises(TypeError):
+                bool(res)
+        res = can_share(self.graph, 'A', 's', 'y', enumerate_paths=True, timeout=0.5)
+        self.assertEqual('deadline', res.reason)
+        with CanShareExecutor(self.graph, processes=2) as executor:
+            res = can_share(self.graph, 'A', 's', 'y', executor=executor, max_states=20)
+            self.assertEqual('max_states', res.reason)
+            self.assertIs(False, can_share(self.graph, 'A', 's', 'y', executor=executor, max_states=10 ** 6))
+
+    def test_check_interval(self):
+        for limits in [(monotonic() + 60, None), (None, 10 ** 6), (monotonic() + 60, 10 ** 6)]:
+            budget = Budget(*limits)
+            with patch.object(budget, 'check', wraps=budget.check) as check:
+                for _ in range(10000):
+                    budget.spend()
+            self.assertEqual(10000 // BUDGET_CHECK_INTERVAL, check.call_count)
+
+    def test_stale_flush(self):
+        # a task of a finished query adds nothing to the shared counter
+        states = mp.Value('q', 0)
+        query_id = [1]
+        budget = Budget(None, 10 ** 6, shared=states, stale=lambda: query_id[0] > 1)
+        budget.spend(10)
+        self.assertEqual(10, budget.flush())
+        query_id[0] = 2
+        budget.spend(5)
+        budget.flush()
+        self.assertEqual(10, states.value)
+
+    def test_large_budget(self):
+        for name in ['condition_4_1', 'condition_4_2', 'random_graph_30_75']:
+            graph = test_graphs[name]
+            for x, y in product(sorted(graph), sorted(graph)):
+                self.assertEqual(can_share(graph, 'TAKE', x, y),
+                                 can_share(graph, 'TAKE', x, y, timeout=60, max_states=10 ** 6))
+
+
+class TestCompactTGGraph(unittest.TestCase):
+    def test_matches_networkx(self):
+        for name in test_cases:
+            graph = test_graphs[name]
+            compact = CompactTGGraph.from_graph(graph)
+            self.assertEqual(len(graph), len(compact))
+            self.assertEqual(graph.number_of_edges(), compact.number_of_edges())
+            self.assertEqual(tg_islands(graph), tg_islands(compact))
+            nodes = sorted(graph.nodes)
+            for x in nodes:
+                self.assertSetEqual(initially_spans(graph, x),
+                                    initially_spans(compact, x))
+                self.assertSetEqual(terminally_spans(graph, {x}),
+                                    terminally_spans(compact, {x}))
+            for x, y in product(nodes[:12], nodes):
+                for a in ['A', 'READ', 'TAKE', 'GRANT']:
+                    self.assertEqual(x_y_a_edge_exist(graph, a, x, y),
+                                     x_y_a_edge_exist(compact, a, x, y))
+                    self.assertSetEqual(s_y_a_nodes(graph, a, y),
+                                        s_y_a_nodes(compact, a, y))
+                    expected = can_share(graph, a, x, y)
+                    actual = can_share(compact, a, x, y)
+                    self.assertEqual(
+                        expected,
+                        actual,
+                        "failed test {} {} expected {}, actual {}".format(
+                            name, (a, x, y), expected, actual
+                        ),
+                    )
+
+    def test_island_members(self):
+        for name in test_cases:
+            compact = CompactTGGraph.from_graph(test_graphs[name])
+            island_ids = compact._islands()
+            offsets, nodes = compact._island_members()
+            self.assertIs(nodes, compact._island_members()[1])
+            for island in range(len(offsets) - 1):
+                self.assertEqual([v for v in range(len(compact)) if island_ids[v] == island],
+                                 list(nodes[offsets[island]:offsets[island + 1]]))
+            # new island ids, e.g. from an index, rebuild the members
+            compact._island_ids = array('i', island_ids)
+            self.assertIsNot(nodes, compact._island_members()[1])
+
+    def test_bulk_spans(self):
+        graphs = [test_graphs[name] for name in test_cases]
+        # take cycles and chains through subjects and objects
+        graphs.append(small_graph({'1': SUBJECT, '2': OBJECT, '3': SUBJECT, '4': OBJECT, '5': SUBJECT},
+                                  [('1', '2', TAKE), ('2', '3', TAKE), ('3', '1', TAKE), ('3', '4', TAKE),
+                                   ('4', '4', TAKE), ('5', '4', GRANT), ('2', '5', GRANT)]))
+        for graph in graphs:
+            initial, terminal = bulk_spans(graph)
+            for v in graph:
+                self.assertSetEqual(initially_spans(graph, v), initial[v], v)
+                self.assertSetEqual(terminally_spans(graph, {v}), terminal[v], v)
+
+
+@unittest.skipIf(SparseTGGraph is None, 'scipy is not installed')
+class TestSparseTGGraph(unittest.TestCase):
+    def test_matches_compact(self):
+        for name in test_cases:
+            graph = test_graphs[name]
+            compact = CompactTGGraph.from_graph(graph)
+            sparse = SparseTGGraph.from_compact(compact)
+            for v in graph:
+                self.assertSetEqual(initially_spans(graph, v), initially_spans(sparse, v), (name, v))
+                self.assertSetEqual(initially_spans(compact, v, READ), initially_spans(sparse, v, READ), (name, v))
+                self.assertSetEqual(terminally_spans(graph, {v}), terminally_spans(sparse, {v}), (name, v))
+
+            islands, sparse_islands = tg_islands(graph), tg_islands(sparse)
+            self.assertSetEqual(set(islands), set(sparse_islands))
+            for u in islands:
+                for v in islands:
+                    self.assertEqual(islands[u] == islands[v], sparse_islands[u] == sparse_islands[v])
+
+            nodes = list(graph)[:15]
+            for x in nodes:
+                for y in nodes:
+                    self.assertEqual(can_share(graph, 'A', x, y), can_share(sparse, 'A', x, y), (name, x, y))
+
+
+class TestCanShareIndex(unittest.TestCase):
+    def test_matches_can_share(self):
+        for name in test_cases:
+            graph = test_graphs[name]
+            index = CanShareIndex(graph)
+            nodes = sorted(graph.nodes)
+            queries = [(a, x, y) for x, y in product(nodes, nodes)
+                       for a in ['A', 'READ', 'TAKE', 'GRANT']]
+            for (a, x, y), actual in zip(queries, index.can_share_many(queries)):
+                expected = can_share(graph, a, x, y)
+                self.assertEqual(
+                    expected,
+                    actual,
+                    "failed test {} {} expected {}, actual {}".format(
+                        name, (a, x, y), expected, actual
+                    ),
+                )
+
+    def test_audits(self):
+        graph = test_graphs['random_graph_30_75']
+        index = CanShareIndex(graph)
+        nodes = sorted(graph.nodes)
+        for y in nodes:
+            expected = {x for x in nodes if index.can_share('A', x, y)}
+            self.assertSetEqual(expected, index.who_can_obtain('A', y))
+        for x in nodes:
+            expected = {(a, y) for y in nodes for a in ['A', 'TAKE', 'GRANT']
+                        if index.can_share(a, x, y)}
+            self.assertSetEqual(expected, index.what_can_x_obtain(x))
+
+
+    def test_parallel_build(self):
+        # every bfs level goes through the pool
+        with patch('parallel_index.MIN_PARALLEL_FRONTIER', 1):
+            for name, processes in product(['example2-big-fig', 'example3-complex-graph', 'random_graph_30_75'], [2, 3]):
+                # three node ranges leave one forest out of the first merge round
+                expected = CanShareIndex(test_graphs[name])
+                actual = CanShareIndex(test_graphs[name], processes=processes)
+                self.assertEqual(expected.islands, actual.islands, name)
+                self.assertEqual(expected.components, actual.components, name)
+                self.assertEqual(expected.initial_components, actual.initial_components, name)
+                self.assertEqual(expected.terminal_components, actual.terminal_components, name)
+
+
+class TestIndexSnapshot(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in test_cases:
+                source = f'./test/{name}.json'
+                snapshot = f'{tmp}/{name}.tgs'
+                graph = test_graphs[name]
+                write_snapshot(CanShareIndex(graph), snapshot, source)
+                index = read_snapshot(snapshot, source)
+                nodes = sorted(graph.nodes)
+                for a, x, y in product(['A', TAKE], nodes, nodes):
+                    self.assertEqual(can_share(graph, a, x, y), index.can_share(a, x, y), (name, a, x, y))
+
+    def test_stale(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source, snapshot = f'{tmp}/g.json', f'{tmp}/g.tgs'
+            with open('./test/example3-complex-graph.json', 'r') as src, open(source, 'w') as dst:
+                dst.write(src.read())
+            index = load_or_build_index(source, snapshot)
+            self.assertTrue(os.path.exists(snapshot))
+            self.assertIsInstance(index.initial_components, list)
+            self.assertIsInstance(load_or_build_index(source, snapshot).initial_components, SnapshotSpans)
+
+            with open(source, 'a') as f:
+                f.write('\n')
+            with self.assertRaises(ValueError):
+                read_snapshot(snapshot, source)
+            # rebuilt and written again
+            self.assertIsInstance(load_or_build_index(source, snapshot).initial_components, list)
+            read_snapshot(snapshot, source)
+            with self.assertRaises(ValueError):
+                read_snapshot(source)
+
+
+class TestCanShareRights(unittest.TestCase):
+    def test_matches_can_share(self):
+        for name in test_cases:
+            graph = test_graphs[name]
+            compact = CompactTGGraph.from_graph(graph)
+            index = CanShareIndex(compact)
+            nodes = sorted(graph.nodes)
+            for x, y in product(nodes, nodes):
+                held = in_rights(graph, y)
+                expected = None if x == y else {a for a in held if can_share(graph, a, x, y)}
+                self.assertEqual(expected, can_share_rights(graph, None, x, y), (name, x, y))
+                # a compact graph answers from its cached island array
+                with patch.object(CompactTGGraph, 'tg_islands', side_effect=AssertionError):
+                    self.assertEqual(expected, can_share_rights(compact, None, x, y), (name, x, y))
+                self.assertEqual(expected, can_share_rights(graph, None, x, y, index), (name, x, y))
+                if expected is not None:
+                    expected &= {'A', TAKE}
+                self.assertEqual(expected, can_share_rights(graph, {'A', TAKE, 'unknown'}, x, y), (name, x, y))
+                self.assertEqual(expected, index.can_share_rights({'A', TAKE, 'unknown'}, x, y), (name, x, y))
+
+
+class TestGraphReduction(unittest.TestCase):
+    def test_matches_can_share(self):
+        for name in test_cases:
+            graph = test_graphs[name]
+            for g in [graph, CompactTGGraph.from_graph(graph)]:
+                reduced = ReducedGraph(g)
+                for x, y in product(sorted(graph.nodes), sorted(graph.nodes)):
+                    for a in ['A', TAKE, GRANT]:
+                        self.assertEqual(can_share(graph, a, x, y), reduced.can_share(a, x, y), (name, a, x, y))
+
+    def test_reduction(self):
+        # island {s1, s2}, chain s1 t→ o1 t→ o2 t→ o3, o4 without tg edges
+        graph = small_graph({'s1': SUBJECT, 's2': SUBJECT, 'o1': OBJECT, 'o2': OBJECT, 'o3': OBJECT,
+                             'o4': OBJECT, 'y': OBJECT},
+                            [('s1', 's2', TAKE), ('s1', 'o1', TAKE), ('o1', 'o2', TAKE), ('o2', 'o3', TAKE),
+                             ('o2', 'y', 'A'), ('o4', 'y', 'B'), ('o3', 'y', 'READ')])
+        reduced = ReducedGraph(graph)
+        self.assertEqual({'s1', 'o3'}, set(reduced.graph))
+        self.assertEqual(['s1', 's2'], reduced.members['s1'])
+        self.assertEqual({'s1': 's1', 's2': 's1', 'o1': None, 'o2': None, 'o3': 'o3', 'o4': None, 'y': None},
+                         reduced.mapping)
+        self.assertEqual(1, reduced.graph.number_of_edges())
+        self.assertEqual(2 / 7, reduced.stats()['node_ratio'])
+        self.assertTrue(reduced.can_share('A', 's2', 'y'))
+        self.assertTrue(reduced.can_share('READ', 's2', 'y'))
+        self.assertFalse(reduced.can_share('B', 's2', 'y'))
+        self.assertFalse(reduced.can_share('A', 'o1', 'y'))
+
+
+class TestTakeGrantEngine(unittest.TestCase):
+    def test_rules(self):
+        graph = test_graphs['condition_4_1'].copy()
+        engine = TakeGrantEngine(graph)
+        # 4 -t-> 3 -t-> 2 -t-> 1
+        self.assertFalse(engine.can_share('A', '4', '1'))
+        engine.take('4', '3', '2', {TAKE})
+        self.assertTrue(x_y_a_edge_exist(graph, TAKE, '4', '2'))
+        engine.create('4', 'new', OBJECT, {'A', GRANT})
+        self.assertTrue(engine.can_share('A', '1', 'new'))
+        engine.remove('4', '2', {TAKE})
+        self.assertEqual(can_share(graph, 'A', '1', 'new'),
+                         engine.can_share('A', '1', 'new'))
+        with self.assertRaises(ValueError):
+            engine.grant('4', '3', '2', {TAKE})
+
+    def test_matches_can_share_after_edits(self):
+        graph = test_graphs['random_graph_30_75'].copy()
+        engine = TakeGrantEngine(graph)
+        nodes = sorted(graph.nodes)
+        rnd = random.Random(7)
+        for _ in range(20):
+            if rnd.random() < 0.5:
+                engine.add_edge(rnd.choice(nodes), rnd.choice(nodes),
+                                rnd.choice([TAKE, GRANT, 'A']))
+            else:
+                src, dst, d = rnd.choice(list(graph.edges(data=True)))
+                engine.remove_edge(src, dst, d[EDGE_TYPE])
+            for x, y in product(nodes[:8], nodes):
+                expected = can_share(graph, 'A', x, y)
+                actual = engine.can_share('A', x, y)
+                self.assertEqual(
+                    expected,
+                    actual,
+                    "failed test {} expected {}, actual {}".format(
+                        (x, y), expected, actual
+                    ),
+                )
+
+    def test_cache(self):
+        graph = test_graphs['random_graph_30_75'].copy()
+        engine = TakeGrantEngine(graph)
+        nodes = sorted(graph.nodes)
+        queries = list(product(nodes[:10], nodes))
+        for x, y in queries:
+            engine.can_share('A', x, y)
+        for x, y in queries:
+            engine.can_share('A', x, y)
+        stats = engine.cache.stats()
+        self.assertEqual(len(queries), stats['misses'])
+        self.assertEqual(len(queries), stats['hits'])
+
+        # a new a-edge only touches the queries about its target
+        engine.add_edge(nodes[0], nodes[1], 'A')
+        self.assertEqual(sum(1 for _, y in queries if y == nodes[1]), engine.cache.stats()['invalidations'])
+        engine.add_edge(nodes[2], nodes[3], TAKE)
+        for x, y in queries:
+            self.assertEqual(can_share(graph, 'A', x, y), engine.can_share('A', x, y), (x, y))
+
+        engine = TakeGrantEngine(graph, cache_size=10)
+        for x, y in queries:
+            engine.can_share('A', x, y)
+        self.assertEqual(10, engine.cache.stats()['size'])
+        self.assertEqual(len(queries) - 10, engine.cache.stats()['evictions'])
+
+
+class TestGraphLoading(unittest.TestCase):
+    def test_streaming_matches_json_load(self):
+        for name in test_cases:
+            filename = f'./test/{name}.json'
+            with open(filename, 'r') as file:
+                json_graph = json.load(file)[GRAPH]
+            expected = [(NODES, node) for node in json_graph[NODES]] + \
+                [(EDGES, edge) for edge in json_graph[EDGES]]
+            self.assertEqual(expected, list(iter_graph(filename)))
+            self.assertEqual(expected, list(iter_graph(filename, chunk_size=5, stream_min_size=0)))
+
+    def test_streaming_errors(self):
+        # a number cut by a chunk boundary is read whole
+        stream = JSONStream(io.StringIO('[1.5e3, 2]'), 2)
+        self.assertEqual([1500.0, 2], list(stream.array_items()))
+        # malformed input fails in the chunk it is in
+        file = io.StringIO('[{"id": 1}, }' + ' ' * 10000 + ']')
+        with self.assertRaises(ValueError):
+            list(JSONStream(file, 16).array_items())
+        self.assertLess(file.tell(), 64)
+
+    def test_binary_round_trip(self):
+        for name in test_cases:
+            graph = test_graphs[name]
+            compact = CompactTGGraph.from_json(f'./test/{name}.json')
+            with tempfile.TemporaryDirectory() as tmp:
+                write_binary_graph(compact, f'{tmp}/{name}.tgb')
+                loaded = read_binary_graph(f'{tmp}/{name}.tgb')
+                self.assertEqual(sorted(graph.nodes), sorted(loaded))
+                self.assertEqual(graph.number_of_edges(), loaded.number_of_edges())
+                self.assertNotIn('missing', loaded)
+                nodes = sorted(graph.nodes)
+                for x, y in product(nodes[:5], nodes):
+                    self.assertEqual(can_share(graph, 'A', x, y),
+                                     can_share(loaded, 'A', x, y))
+                del loaded
+
+
+class TestImportSideEffects(unittest.TestCase):
+    def test_core_import_is_light(self):
+        code = ('import logging, sys, take_grant; '
+                'print("matplotlib" in sys.modules, "multiprocessing" in sys.modules, '
+                'bool(logging.getLogger().handlers))')
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                             text=True, check=True, cwd=tempfile.gettempdir(),
+                             env={**os.environ, 'PYTHONPATH': os.getcwd()})
+        self.assertEqual('False False False', out.stdout.strip())
+
+
+class TestCanShareTrace(unittest.TestCase):
+    def test_trace(self):
+        for graph in [test_graphs['example3-complex-graph'],
+                      CompactTGGraph.from_graph(test_graphs['example3-complex-graph'])]:
+            trace = CanShareTrace()
+            self.assertTrue(can_share(graph, 'A', '1', '8', trace=trace))
+            self.assertTrue(trace.result)
+            self.assertEqual(4, trace.condition)
+            self.assertEqual({f'condition_{i}' for i in range(5)}, set(trace.timings))
+            self.assertGreater(trace.nodes_visited, 0)
+            self.assertGreaterEqual(trace.edges_visited, trace.pruned)
+
+            island_ids = tg_islands(graph)
+            witness = trace.witness
+            self.assertIn(witness[0], trace.xi_ids)
+            self.assertIn(witness[-1], trace.si_ids)
+            for u, v in zip(witness, witness[1:]):
+                adjacent = any(w == v for w, _, _ in tg_neighbours(graph, u))
+                same_island = u in island_ids and island_ids[u] == island_ids.get(v)
+                self.assertTrue(adjacent or same_island, (u, v))
+
+    def test_trace_needs_the_serial_search(self):
+        graph = test_graphs['example3-complex-graph']
+        with self.assertRaises(ValueError):
+            can_share(graph, 'A', '1', '8', enumerate_paths=True, trace=CanShareTrace())
+        with CanShareExecutor(graph, processes=1) as executor:
+            with self.assertRaises(ValueError):
+                can_share(graph, 'A', '1', '8', executor=executor, trace=lambda trace: None)
+
+    def test_certificate(self):
+        for name in ['example2-big-fig', 'example3-complex-graph', 'random_graph_30_75']:
+            graph = test_graphs[name]
+            compact = CompactTGGraph.from_graph(graph)
+            nodes = list(graph)[:20]
+            for x in nodes:
+                for y in nodes:
+                    for g in [graph, compact]:
+                        certificate = can_share_certificate(g, 'A', x, y)
+                        self.assertEqual(bool(can_share(graph, 'A', x, y)), certificate is not None, (name, x, y))
+                        if certificate is None:
+                            continue
+                        self.assertTrue(verify_certificate(graph, certificate), certificate)
+                        # survives a json round trip
+                        restored = CanShareCertificate(**json.loads(json.dumps(asdict(certificate))))
+                        self.assertTrue(verify_certificate(compact, restored), certificate)
+                        if certificate.path:
+                            broken = CanShareCertificate(**{**asdict(certificate), 'path': certificate.path[1:]})
+                            self.assertFalse(verify_certificate(graph, broken), certificate)
+
+        certificate = can_share_certificate(test_graphs['example3-complex-graph'], 'A', '1', '8')
+        self.assertEqual(4, certificate.condition)
+        self.assertEqual(len(certificate.islands), len(certificate.bridges) + 1)
+        self.assertFalse(verify_certificate(test_graphs['example3-complex-graph'],
+                                            CanShareCertificate(**{**asdict(certificate), 'y': '9'})))
+        # islands and bridges have to match the path
+        for field_name, value in [('islands', certificate.islands[:-1]), ('islands', [['8']] + certificate.islands[1:]),
+                                  ('bridges', []), ('bridges', [['1', '2']] + certificate.bridges[1:])]:
+            tampered = CanShareCertificate(**{**asdict(certificate), field_name: value})
+            self.assertFalse(verify_certificate(test_graphs['example3-complex-graph'], tampered), tampered)
+
+    def test_hook(self):
+        traces = []
+        graph = test_graphs['condition_1']
+        self.assertTrue(can_share(graph, 'A', '1', '2', trace=traces.append))
+        self.assertEqual(1, len(traces))
+        self.assertEqual(0, traces[0].condition)
+        self.assertIsNone(traces[0].witness)
+
+
+def small_graph(nodes: dict[str, str], edges: list[tuple[str, str, str]]) -> nx.MultiDiGraph:
+    graph = nx.MultiDiGraph()
+    for v, node_type in nodes.items():
+        graph.add_node(v, **{ID: v, LABEL: v, NODE_TYPE: node_type})
+    for u, v, e_type in edges:
+        graph.add_edge(u, v, key=f'{u}_{v}_{e_type}', **{EDGE_TYPE: e_type})
+    return graph
+
+
+class TestCanStealCanKnow(unittest.TestCase):
+    def test_can_steal(self):
+        @dataclass
+        class TestCase:
+            graph: nx.MultiDiGraph
+            x: str
+            y: str
+            can_share: bool
+            can_steal: bool
+
+        testcases = [
+            # x takes the right from its owner
+            TestCase(graph=small_graph({'x': SUBJECT, 's': OBJECT, 'y': OBJECT},
+                                       [('x', 's', TAKE), ('s', 'y', 'A')]),
+                     x='x', y='y', can_share=True, can_steal=True),
+            # the owner has to grant it
+            TestCase(graph=small_graph({'x': SUBJECT, 's': SUBJECT, 'y': OBJECT},
+                                       [('s', 'x', GRANT), ('s', 'y', 'A')]),
+                     x='x', y='y', can_share=True, can_steal=False),
+            # x' takes from the owner and grants to x
+            TestCase(graph=small_graph({'x': OBJECT, 'xi': SUBJECT, 's': SUBJECT, 'y': OBJECT},
+                                       [('xi', 'x', GRANT), ('xi', 's', TAKE), ('s', 'y', 'A')]),
+                     x='x', y='y', can_share=True, can_steal=True),
+            # x already has the right
+            TestCase(graph=small_graph({'x': SUBJECT, 'y': OBJECT}, [('x', 'y', 'A')]),
+                     x='x', y='y', can_share=True, can_steal=False),
+        ]
+
+        for case in testcases:
+            index = CanShareIndex(case.graph)
+            for graph in [case.graph, CompactTGGraph.from_graph(case.graph)]:
+                actual = can_steal(graph, 'A', case.x, case.y)
+                self.assertEqual(case.can_steal, actual, case)
+                self.assertEqual(case.can_steal, can_steal(graph, 'A', case.x, case.y, index), case)
+                self.assertEqual(case.can_share, audit(graph, 'A', case.x, case.y).can_share, case)
+
+    def test_can_know(self):
+        @dataclass
+        class TestCase:
+            edges: list[tuple[str, str, str]]
+            x: str
+            y: str
+            expected: bool
+
+        nodes = {'x': SUBJECT, 'z': SUBJECT, 'o': OBJECT, 'y': OBJECT, 'b': OBJECT, 'c': OBJECT}
+        testcases = [
+            # z reads y and writes o, x reads o
+            TestCase(edges=[('x', 'o', READ), ('z', 'o', WRITE), ('z', 'y', READ)], x='x', y='y', expected=True),
+            TestCase(edges=[('x', 'o', READ), ('z', 'o', WRITE)], x='x', y='y', expected=False),
+            # information does not flow back into y
+            TestCase(edges=[('x', 'o', READ), ('z', 'o', WRITE), ('z', 'y', READ)], x='y', y='x', expected=False),
+            # x and z joined by the t→ g→ t← bridge
+            TestCase(edges=[('x', 'b', TAKE), ('b', 'c', GRANT), ('z', 'c', TAKE), ('z', 'y', READ)],
+                     x='x', y='y', expected=True),
+            # z writes to x
+            TestCase(edges=[('z', 'o', TAKE), ('o', 'x', WRITE), ('z', 'y', READ)], x='x', y='y', expected=True),
+            # o is written, not read by x
+            TestCase(edges=[('x', 'o', WRITE), ('z', 'o', WRITE), ('z', 'y', READ)], x='x', y='y', expected=False),
+        ]
+
+        for case in testcases:
+            graph = small_graph(nodes, case.edges)
+            index = CanShareIndex(graph)
+            for g in [graph, CompactTGGraph.from_graph(graph)]:
+                self.assertEqual(case.expected, can_know(g, case.x, case.y), case)
+                self.assertEqual(case.expected, can_know(g, case.x, case.y, index), case)
+                self.assertEqual(case.expected, audit(g, 'A', case.x, case.y, index).can_know, case)
+
+    def test_audit_matches_predicates(self):
+        for name in ['example1-tg-bridge', 'example2-big-fig', 'random_graph_30_75']:
+            graph = test_graphs[name]
+            index = CanShareIndex(graph)
+            nodes = list(graph)[:15]
+            for x in nodes:
+                for y in nodes:
+                    expected = AuditResult(can_share(graph, 'READ', x, y),
+                                           can_steal(graph, 'READ', x, y),
+                                           can_know(graph, x, y))
+                    self.assertEqual(expected, audit(graph, 'READ', x, y), (name, x, y))
+                    self.assertEqual(expected, audit(graph, 'READ', x, y, index), (name, x, y))
+
+
+class TestCanShareServer(unittest.TestCase):
+    def test_queries_cache_and_reload(self):
+        async def session(tmp: str):
+            server = CanShareServer(GraphCache())
+            graph = test_graphs['example3-complex-graph']
+            requests = [{'id': k, 'graph': './test/example3-complex-graph.json', 'a': 'A', 'x': x, 'y': y}
+                        for k, (x, y) in enumerate((x, y) for x in graph for y in graph)]
+            responses = await asyncio.gather(*(server.handle(r) for r in requests))
+            for r, response in zip(requests, responses):
+                self.assertEqual(r['id'], response['id'])
+                self.assertEqual(can_share(graph, 'A', r['x'], r['y']), response['result'], r)
+            # one load for all concurrent requests
+            self.assertEqual(1, server.cache.loads)
+            self.assertEqual(len(requests), server.cache.hits + server.cache.misses)
+
+            response = await server.handle({'id': 0, 'op': 'can_know', 'graph': './test/example1-tg-bridge.json',
+                                            'x': '1', 'y': '4'})
+            self.assertEqual(can_know(test_graphs['example1-tg-bridge'], '1', '4'), response['result'])
+            response = await server.handle({'id': 0, 'op': 'can_share_rights', 'graph': './test/example3-complex-graph.json',
+                                            'x': '1', 'y': '8'})
+            self.assertEqual(sorted(can_share_rights(graph, None, '1', '8')), response['result'])
+            self.assertIn('error', await server.handle({'id': 0, 'graph': f'{tmp}/missing.json'}))
+            self.assertIn('error', await server.handle({'id': 0, 'graph': './test/condition_1.json'}))
+            self.assertEqual({'id': None, 'error': 'bad request: expected an object, got list'},
+                             await server.handle([1]))
+            response = await server.handle({'id': 7, 'graph': './test/condition_1.json', 'a': 'A', 'x': ['1'], 'y': '2'})
+            self.assertEqual(7, response['id'])
+            self.assertIn('error', response)
+
+            filename = f'{tmp}/g.json'
+            with open(filename, 'w') as f:
+                json.dump({GRAPH: {NODES: [{ID: '1', NODE_TYPE: SUBJECT}, {ID: '2', NODE_TYPE: OBJECT}],
+                                   EDGES: []}}, f)
+            query = {'id': 0, 'graph': filename, 'a': 'A', 'x': '1', 'y': '2'}
+            self.assertFalse((await server.handle(query))['result'])
+            self.assertFalse((await server.handle({'op': 'reload', 'graph': filename}))['result'])
+            with open(filename, 'w') as f:
+                json.dump({GRAPH: {NODES: [{ID: '1', NODE_TYPE: SUBJECT}, {ID: '2', NODE_TYPE: OBJECT}],
+                                   EDGES: [{ID: 'e', SOURCE: '1', TARGET: '2', EDGE_TYPE: 'A'}]}}, f)
+            self.assertTrue((await server.handle({'op': 'reload', 'graph': filename}))['result'])
+            self.assertTrue((await server.handle(query))['result'])
+
+            # a tiny cap keeps only the most recent graph
+            server.cache.memory_cap = 1
+            await server.handle({'id': 0, 'graph': './test/condition_2.json', 'a': 'A', 'x': '1', 'y': '2'})
+            stats = (await server.handle({'op': 'stats'}))['result']
+            self.assertEqual([os.path.abspath('./test/condition_2.json')], stats['graphs'])
+            self.assertGreater(stats['evictions'], 0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(session(tmp))
+
+    def test_span_bytes_count_against_the_cap(self):
+        async def session(tmp: str):
+            # isolated subjects, every node spans a bitset of its own
+            filename = f'{tmp}/spans.json'
+            with open(filename, 'w') as f:
+                json.dump({GRAPH: {NODES: [{ID: str(v), NODE_TYPE: SUBJECT} for v in range(5000)],
+                                   EDGES: []}}, f)
+            spans = sum((bit + 8) // 8 for bit in range(5000))
+            small = load_entry('./test/condition_2.json')
+            large = load_entry(filename)
+            self.assertGreater(large.nbytes, spans)
+
+            # both fit when the spans are left out
+            cache = GraphCache(memory_cap=small.nbytes + large.nbytes - spans // 2)
+            await cache.get('./test/condition_2.json')
+            await cache.get(filename)
+            self.assertEqual([os.path.abspath(filename)], cache.stats()['graphs'])
+            self.assertGreater(cache.stats()['evictions'], 0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(session(tmp))
+
+    def test_stdio(self):
+        requests = [[1],
+                    {'id': 1, 'graph': './test/example3-complex-graph.json', 'a': 'A', 'x': '1', 'y': '8'},
+                    {'id': 2, 'op': 'audit', 'graph': './test/example3-complex-graph.json',
+                     'a': 'A', 'x': '8', 'y': '1'}]
+        out = subprocess.run([sys.executable, 'can_share_server.py'], capture_output=True, check=True, text=True,
+                             input=''.join(json.dumps(r) + '\n' for r in requests)).stdout
+        responses = {r['id']: r for r in map(json.loads, out.splitlines())}
+        self.assertIn('error', responses[None])
+        self.assertTrue(responses[1]['result'])
+        self.assertEqual({'can_share': False, 'can_steal': False, 'can_know': False}, responses[2]['result'])
+
+        # regular files are no pipes, the server reads and writes them directly
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(f'{tmp}/in.jsonl', 'w') as f:
+                f.write(''.join(json.dumps(r) + '\n' for r in requests))
+            with open(f'{tmp}/in.jsonl') as stdin, open(f'{tmp}/out.jsonl', 'w') as stdout:
+                subprocess.run([sys.executable, 'can_share_server.py'], stdin=stdin, stdout=stdout, check=True)
+            with open(f'{tmp}/out.jsonl') as f:
+                self.assertEqual(responses, {r['id']: r for r in map(json.loads, f.read().splitlines())})
+
+
+class TestBatchMode(unittest.TestCase):
+    def test_batch(self):
+        graph = test_graphs['example3-complex-graph']
+        pairs = [(x, y) for x in graph for y in graph]
+        csv_input = 'a,x,y\n' + ''.join(f'A,{x},{y}\n' for x, y in pairs)
+        for processes in ['1', '2']:
+            out = subprocess.run([sys.executable, 'can_share.py', '-f', './test/example3-complex-graph.json',
+                                  '-q', '-', '-p', processes], input=csv_input,
+                                 capture_output=True, text=True, check=True)
+            lines = out.stdout.splitlines()
+            self.assertEqual([f'A,{x},{y},{can_share(graph, "A", x, y)}' for x, y in pairs], lines)
+            self.assertIn(f'{len(pairs)} queries in', out.stderr)
+            self.assertIn('queries/sec', out.stderr)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(f'{tmp}/queries.jsonl', 'w') as f:
+                f.write(json.dumps({'a': 'A', 'x': '1', 'y': '8'}) + '\n# comment\nA,8,1\n')
+            out = subprocess.run([sys.executable, 'can_share.py', '-f', './test/example3-complex-graph.json',
+                                  '-q', f'{tmp}/queries.jsonl'], capture_output=True, text=True, check=True)
+            first, second = out.stdout.splitlines()
+            self.assertEqual({'a': 'A', 'x': '1', 'y': '8', 'result': True}, json.loads(first))
+            self.assertEqual('A,8,1,False', second)
+
+    def test_bad_graph_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(f'{tmp}/bad.json', 'w') as f:
+                f.write('{"nodes": ')
+            for filename in [f'{tmp}/missing.json', f'{tmp}/bad.json']:
+                for processes in ['1', '2']:
+                    # fails instead of waiting for workers that never load
+                    out = subprocess.run([sys.executable, 'can_share.py', '-f', filename, '-q', '-', '-p', processes],
+                                         input='A,1,8\n', capture_output=True, text=True, timeout=60)
+                    self.assertEqual(1, out.returncode)
+                    self.assertIn(f'cannot load graph {filename}', out.stderr)
+                    self.assertEqual('', out.stdout)
+
+    def test_bad_query_lines(self):
+        lines = 'A,1,8\nA,1\n{"a": "A"}\n{bad\n{"a": "A", "x": "8", "y": "1"}\n'
+        for processes in ['1', '2']:
+            out = subprocess.run([sys.executable, 'can_share.py', '-f', './test/example3-complex-graph.json',
+                                  '-q', '-', '-p', processes], input=lines,
+                                 capture_output=True, text=True, check=True)
+            # every line gets a result line, the batch goes on after a bad one
+            results = out.stdout.splitlines()
+            self.assertEqual(5, len(results))
+            self.assertEqual('A,1,8,True', results[0])
+            self.assertTrue(results[1].startswith('error: line 2:'))
+            self.assertEqual(3, json.loads(results[2])['line'])
+            self.assertEqual(4, json.loads(results[3])['line'])
+            self.assertEqual({'a': 'A', 'x': '8', 'y': '1', 'result': False}, json.loads(results[4]))
+
+    def test_bad_arguments(self):
+        for args in [['-p', 'two'], ['-p', '0'], ['-t', '-1'], ['-n', 'x'], ['-r'], ['-l', 'A,B']]:
+            out = subprocess.run([sys.executable, 'can_share.py', '-f', './test/example3-complex-graph.json',
+                                  '-q', '-', *args], input='A,1,8\n', capture_output=True, text=True, check=True)
+            self.assertTrue(out.stdout.startswith('Unexpected comand line arguments'), args)
+            self.assertEqual('', out.stderr, args)
+
+    def test_load_time(self):
+        def slow_load(filename: str):
+            time.sleep(0.5)
+            return read_graph(filename, labels=False)[0]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(f'{tmp}/queries.csv', 'w') as f:
+                f.write('A,1,8\n' * 10)
+            for processes in [1, 2]:
+                stdout, stderr = io.StringIO(), io.StringIO()
+                with patch('can_share.load_graph', slow_load), redirect_stdout(stdout), redirect_stderr(stderr):
+                    run_batch('./test/example3-complex-graph.json', f'{tmp}/queries.csv', processes, {})
+                self.assertEqual(['A,1,8,True'] * 10, stdout.getvalue().splitlines())
+                # workers load in parallel, the load is not counted as query time
+                load_time = float(re.search(r'load ([0-9.]+)s', stderr.getvalue()).group(1))
+                query_time = float(re.search(r'queries in ([0-9.]+)s', stderr.getvalue()).group(1))
+                self.assertGreaterEqual(load_time, 0.5)
+                self.assertLess(query_time, 0.5)
+
+
+class TestGraphGenerator(unittest.TestCase):
+    def test_json_and_binary_agree(self):
+        config = GeneratorConfig(num_nodes=60, num_edges=150, seed=5, subject_ratio=0.4,
+                                 island_size='uniform:1:4', bridge_density=0.5)
+        with tempfile.TemporaryDirectory() as tmp:
+            write_json_graph(config, f'{tmp}/g.json')
+            write_json_graph(config, f'{tmp}/g2.json')
+            write_binary_generated_graph(config, f'{tmp}/g.tgb')
+            with open(f'{tmp}/g.json') as f1, open(f'{tmp}/g2.json') as f2:
+                self.assertEqual(f1.read(), f2.read())
+            graph = read_graph(f'{tmp}/g.json')[0]
+            loaded = read_binary_graph(f'{tmp}/g.tgb')
+            self.assertEqual(graph.number_of_edges(), loaded.number_of_edges())
+            nodes = sorted(graph.nodes)
+            for x, y in product(nodes[:10], nodes):
+                self.assertEqual(can_share(graph, 'A', x, y),
+                                 can_share(loaded, 'A', x, y))
+            del loaded
+
+    def test_islands(self):
+        config = GeneratorConfig(num_nodes=30, num_edges=0, subject_ratio=0.5,
+                                 island_size='fixed:3', bridge_density=1.0)
+        nodes = [{ID: v, LABEL: v, NODE_TYPE: t} for v, t in generate_nodes(config)]
+        graph = nx.MultiDiGraph()
+        graph.add_nodes_from((node[ID], node) for node in nodes)
+        for k, (src, dst, e_type) in enumerate(generate_edges(config)):
+            graph.add_edge(node_id(src), node_id(dst), key=k, **{EDGE_TYPE: e_type})
+        island_ids = tg_islands(graph)
+        self.assertEqual(5, len(set(island_ids.values())))
+        self.assertEqual(1, len(set(CanShareIndex(graph).components) - {-1}))
+
+    def test_island_sizes_with_random_edges(self):
+        for num_edges in [0, 1000, 3000]:
+            config = GeneratorConfig(num_nodes=2000, num_edges=num_edges, seed=1, island_size='fixed:5')
+            with tempfile.TemporaryDirectory() as tmp:
+                write_json_graph(config, f'{tmp}/g.json')
+                graph = read_graph(f'{tmp}/g.json')[0]
+            sizes = Counter(tg_islands(graph).values())
+            self.assertEqual(200, len(sizes))
+            self.assertEqual({5}, set(sizes.values()))
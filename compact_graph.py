@@ -0,0 +1,755 @@
+import getopt
+import json
+import mmap
+import sys
+import networkx as nx
+
+from array import array
+from bisect import bisect_left
+from collections import deque
+from utils import *
+
+# TAKE and GRANT always get the first right codes
+TAKE_CODE = 0
+GRANT_CODE = 1
+
+# (state, right code, edge traversed forward) -> next state, same
+# automaton as BRIDGE_TRANSITIONS
+COMPACT_BRIDGE_TRANSITIONS = {(state, {TAKE: TAKE_CODE, GRANT: GRANT_CODE}[e_type], forward): next_state
+                              for (state, e_type, forward), next_state in BRIDGE_TRANSITIONS.items()}
+
+
+def build_csr(n: int, sources: array, targets: array, rights: array | None = None) -> tuple:
+    offsets = array('q', [0]) * (n + 1)
+    for u in sources:
+        offsets[u + 1] += 1
+    for i in range(n):
+        offsets[i + 1] += offsets[i]
+
+    position = array('q', offsets[:-1])
+    adjacent = array('i', [0]) * len(sources)
+    adjacent_rights = array('i', [0]) * len(sources) if rights is not None else None
+    for k, u in enumerate(sources):
+        p = position[u]
+        adjacent[p] = targets[k]
+        if rights is not None:
+            adjacent_rights[p] = rights[k]
+        position[u] = p + 1
+
+    if rights is None:
+        return readonly(offsets), readonly(adjacent)
+    return readonly(offsets), readonly(adjacent), readonly(adjacent_rights)
+
+
+def readonly(arr) -> memoryview:
+    return memoryview(arr).toreadonly()
+
+
+def bit_ids(bits: int):
+    # positions of the set bits
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def trace_path(parents: dict, found: tuple, xi_ids: set, si_ids: set, island_ids) -> list[tuple]:
+    # parents map (node, state) to (previous state, edge type, traversed
+    # forward), moves inside an island have no edge type. Returns the
+    # (u, v, edge type, forward) steps from x' to s'.
+    steps = []
+    state = found
+    while parents[state] is not None:
+        prev, e_type, forward = parents[state]
+        steps.append((prev[0], state[0], e_type, forward))
+        state = prev
+    steps.reverse()
+    # the search starts from and stops at whole islands, step to x' and s'
+    start, end = state[0], found[0]
+    if start not in xi_ids:
+        steps.insert(0, (next(x for x in xi_ids if island_ids[x] == island_ids[start]), start, None, None))
+    if end not in si_ids:
+        steps.append((end, next(s for s in si_ids if island_ids[s] == island_ids[end]), None, None))
+    return steps
+
+
+def witness_nodes(steps: list[tuple], start) -> list:
+    path = [steps[0][0]] if steps else [start]
+    for _, v, _, _ in steps:
+        if path[-1] != v:
+            path.append(v)
+    return path
+
+
+class SparseArray(dict):
+    # int array of which only a few indices are used, the others read as default
+
+    def __init__(self, default: int):
+        super().__init__()
+        self.default = default
+
+    def __missing__(self, i: int) -> int:
+        return self.default
+
+
+class CompactTGGraph:
+    # frozen protection graph, nodes and rights are interned as ints and
+    # every right group (TAKE, GRANT, others) has its own CSR in/out
+    # adjacency. The take_grant functions accept it in place of nx.MultiDiGraph.
+
+    __slots__ = ('node_ids', '_index', 'rights', 'right_codes', 'subjects',
+                 'take_out', 'take_in', 'grant_out', 'grant_in',
+                 'other_out', 'other_in', '_island_ids', '_island_csr')
+
+    def __init__(self, node_ids: list[str], rights: list[str], subjects: bytes,
+                 take_out: tuple, take_in: tuple, grant_out: tuple, grant_in: tuple,
+                 other_out: tuple, other_in: tuple, index=None):
+        self.node_ids = node_ids
+        self._index = index
+        self.rights = rights
+        self.right_codes = {r: i for i, r in enumerate(rights)}
+        self.subjects = subjects
+        self.take_out, self.take_in = take_out, take_in
+        self.grant_out, self.grant_in = grant_out, grant_in
+        self.other_out, self.other_in = other_out, other_in
+        self._island_ids = None
+        self._island_csr = None
+
+    @property
+    def index(self):
+        # node id -> int, built on first use
+        if self._index is None:
+            self._index = {v: i for i, v in enumerate(self.node_ids)}
+        return self._index
+
+    @classmethod
+    def from_edges(cls, node_ids: list[str], subjects: bytes, rights: list[str],
+                   sources: array, targets: array, edge_rights: array, index=None) -> 'CompactTGGraph':
+        # rights must start with TAKE and GRANT
+        n = len(node_ids)
+        groups = {TAKE_CODE: (array('i'), array('i')),
+                  GRANT_CODE: (array('i'), array('i'))}
+        others = (array('i'), array('i'), array('i'))
+        for u, v, r in zip(sources, targets, edge_rights):
+            if r in groups:
+                groups[r][0].append(u)
+                groups[r][1].append(v)
+            else:
+                others[0].append(u)
+                others[1].append(v)
+                others[2].append(r)
+
+        take, grant = groups[TAKE_CODE], groups[GRANT_CODE]
+        return cls(node_ids, rights, readonly(bytes(subjects)),
+                   build_csr(n, take[0], take[1]), build_csr(n, take[1], take[0]),
+                   build_csr(n, grant[0], grant[1]), build_csr(n, grant[1], grant[0]),
+                   build_csr(n, others[0], others[1], others[2]),
+                   build_csr(n, others[1], others[0], others[2]), index=index)
+
+    @classmethod
+    def from_graph(cls, graph: nx.MultiDiGraph) -> 'CompactTGGraph':
+        node_ids = list(graph.nodes)
+        index = {v: i for i, v in enumerate(node_ids)}
+        subjects = bytearray((len(node_ids) + 7) // 8)
+        for i, v in enumerate(node_ids):
+            if graph.nodes[v][NODE_TYPE] == SUBJECT:
+                subjects[i >> 3] |= 1 << (i & 7)
+
+        rights = [TAKE, GRANT]
+        right_codes = {TAKE: TAKE_CODE, GRANT: GRANT_CODE}
+        sources, targets, edge_rights = array('i'), array('i'), array('i')
+        for u, v, d in graph.edges(data=True):
+            r = right_codes.get(d[EDGE_TYPE])
+            if r is None:
+                r = right_codes[d[EDGE_TYPE]] = len(rights)
+                rights.append(d[EDGE_TYPE])
+            sources.append(index[u])
+            targets.append(index[v])
+            edge_rights.append(r)
+
+        return cls.from_edges(node_ids, subjects, rights, sources, targets, edge_rights, index)
+
+    @classmethod
+    def from_json(cls, filename: str) -> 'CompactTGGraph':
+        # streams the json file, no nx.MultiDiGraph and no label maps
+        node_ids, index = [], dict[str, int]()
+        subjects = bytearray()
+        rights = [TAKE, GRANT]
+        right_codes = {TAKE: TAKE_CODE, GRANT: GRANT_CODE}
+        sources, targets, edge_rights = array('i'), array('i'), array('i')
+
+        def intern(v: str) -> int:
+            i = index.get(v)
+            if i is None:
+                i = index[v] = len(node_ids)
+                node_ids.append(v)
+                if i % 8 == 0:
+                    subjects.append(0)
+            return i
+
+        for kind, element in iter_graph(filename):
+            if kind == NODES:
+                i = intern(element[ID])
+                if element[NODE_TYPE] == SUBJECT:
+                    subjects[i >> 3] |= 1 << (i & 7)
+                continue
+            r = right_codes.get(element[EDGE_TYPE])
+            if r is None:
+                r = right_codes[element[EDGE_TYPE]] = len(rights)
+                rights.append(element[EDGE_TYPE])
+            sources.append(intern(element[SOURCE]))
+            targets.append(intern(element[TARGET]))
+            edge_rights.append(r)
+
+        return cls.from_edges(node_ids, subjects, rights, sources, targets, edge_rights, index)
+
+    def __contains__(self, v: str) -> bool:
+        return v in self.index
+
+    def __iter__(self):
+        return iter(self.node_ids)
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def number_of_edges(self) -> int:
+        return len(self.take_out[1]) + len(self.grant_out[1]) + len(self.other_out[1])
+
+    def is_subject(self, i: int) -> bool:
+        return self.subjects[i >> 3] >> (i & 7) & 1 == 1
+
+    def _span_dfs(self, ids: set[int], visited: set[int], to_visit: list[int]):
+        offsets, sources = self.take_in
+        while to_visit:
+            v = to_visit.pop()
+            if v not in visited:
+                visited.add(v)
+                if self.is_subject(v):
+                    ids.add(v)
+                to_visit.extend(sources[offsets[v]:offsets[v + 1]])
+
+    def _initially_spans(self, x: int, a: int = GRANT_CODE) -> set[int]:
+        x_ids = set()
+        if self.is_subject(x):
+            x_ids.add(x)
+        self._span_dfs(x_ids, set(), list(self._s_y_a_nodes(a, x)))
+        return x_ids
+
+    def _terminally_spans(self, s_ids: set[int]) -> set[int]:
+        si_ids = set()
+        offsets, sources = self.take_in
+        to_visit = []
+        for s in s_ids:
+            if self.is_subject(s):
+                si_ids.add(s)
+            to_visit.extend(sources[offsets[s]:offsets[s + 1]])
+        self._span_dfs(si_ids, set(), to_visit)
+        return si_ids
+
+    def _take_sccs(self, roots=None) -> tuple[array | SparseArray, int]:
+        # strongly connected components over take edges (iterative tarjan).
+        # A take edge u→v between components has scc[u] > scc[v]. With roots
+        # only the nodes reachable from them over t→ get a component, they
+        # are kept in sparse arrays.
+        n = len(self)
+        offsets, adjacent = self.take_out
+        if roots is None:
+            order = array('i', [-1]) * n
+            low = array('i', [0]) * n
+            on_stack = bytearray(n)
+            scc = array('i', [-1]) * n
+        else:
+            order, low, on_stack, scc = SparseArray(-1), SparseArray(0), SparseArray(0), SparseArray(-1)
+        stack = []
+        counter = count = 0
+        for root in range(n) if roots is None else roots:
+            if order[root] != -1:
+                continue
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [(root, offsets[root])]
+            while work:
+                v, i = work[-1]
+                if i < offsets[v + 1]:
+                    work[-1] = (v, i + 1)
+                    w = adjacent[i]
+                    if order[w] == -1:
+                        order[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = 1
+                        work.append((w, offsets[w]))
+                    elif on_stack[w] and order[w] < low[v]:
+                        low[v] = order[w]
+                    continue
+                work.pop()
+                if work and low[v] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[v]
+                if low[v] == order[v]:
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        scc[w] = count
+                        if w == v:
+                            break
+                    count += 1
+        return scc, count
+
+    def _bulk_spans(self, labels: array | None = None) -> tuple[list[int], list[int]]:
+        # initial and terminal spans of every node as bitsets, bit labels[v]
+        # is set for subject v (bit v without labels). Terminal spans are
+        # t→* ancestors, one pass over the take sccs in topological order,
+        # initial spans are one pass over the grant edges on top of them.
+        # Equal bitsets are shared.
+        interned = {0: 0}
+        scc, reach = self._take_reach(labels, interned)
+        terminal = [reach[scc[v]] for v in range(len(self))]
+        return self._grant_spans(terminal, labels, interned), terminal
+
+    def _grant_spans(self, terminal: list[int], labels: array | None, interned: dict[int, int]) -> list[int]:
+        # initial spans are x itself and the terminal spans of its granters
+        offsets, granters = self.grant_in
+        initial = []
+        for x in range(len(self)):
+            bits = 1 << (x if labels is None else labels[x]) if self.is_subject(x) else 0
+            for i in range(offsets[x], offsets[x + 1]):
+                bits |= terminal[granters[i]]
+            initial.append(interned.setdefault(bits, bits))
+        return initial
+
+    def _take_reach(self, labels: array | None, interned: dict[int, int], nodes=None) -> tuple[array | SparseArray, list[int]]:
+        # terminal span bitsets per take scc, restricted to nodes when given.
+        # nodes must be closed under take edges in both directions.
+        scc, count = self._take_sccs(nodes)
+        members = [[] for _ in range(count)]
+        for v in range(len(self)) if nodes is None else nodes:
+            members[scc[v]].append(v)
+
+        offsets, takers = self.take_in
+        reach = [0] * count
+        for c in range(count - 1, -1, -1):
+            bits = 0
+            for v in members[c]:
+                if self.is_subject(v):
+                    bits |= 1 << (v if labels is None else labels[v])
+                for i in range(offsets[v], offsets[v + 1]):
+                    if scc[takers[i]] != c:
+                        bits |= reach[scc[takers[i]]]
+            reach[c] = interned.setdefault(bits, bits)
+        return scc, reach
+
+    def bulk_spans(self) -> tuple[dict[str, set[str]], dict[str, set[str]]]:
+        # initially_spans and terminally_spans of every node
+        names = self.node_ids
+        decoded = dict[int, set[str]]()
+
+        def decode(bits: int) -> set[str]:
+            if bits not in decoded:
+                decoded[bits] = {names[i] for i in bit_ids(bits)}
+            return decoded[bits]
+
+        initial, terminal = self._bulk_spans()
+        return ({names[v]: decode(bits) for v, bits in enumerate(initial)},
+                {names[v]: decode(bits) for v, bits in enumerate(terminal)})
+
+    def _s_y_a_nodes(self, a: int, y: int) -> set[int]:
+        if a == TAKE_CODE or a == GRANT_CODE:
+            offsets, sources = self.take_in if a == TAKE_CODE else self.grant_in
+            return set(sources[offsets[y]:offsets[y + 1]])
+        offsets, sources, rights = self.other_in
+        return {sources[i] for i in range(offsets[y], offsets[y + 1]) if rights[i] == a}
+
+    def _in_rights(self, y: int) -> dict[int, set[int]]:
+        # right -> sources of the in-edges of y with that right
+        s_by_right = dict[int, set[int]]()
+        for code, (offsets, sources) in ((TAKE_CODE, self.take_in), (GRANT_CODE, self.grant_in)):
+            if offsets[y] < offsets[y + 1]:
+                s_by_right[code] = set(sources[offsets[y]:offsets[y + 1]])
+        offsets, sources, rights = self.other_in
+        for i in range(offsets[y], offsets[y + 1]):
+            s_by_right.setdefault(rights[i], set()).add(sources[i])
+        return s_by_right
+
+    def in_rights(self, y: str) -> dict[str, set[str]]:
+        if y not in self.index:
+            return {}
+        return {self.rights[a]: {self.node_ids[s] for s in s_ids}
+                for a, s_ids in self._in_rights(self.index[y]).items()}
+
+    def initially_spans(self, x: str, right: str = GRANT) -> set[str]:
+        if x not in self.index:
+            return set()
+        if right not in self.right_codes:
+            return {x} if self.is_subject(self.index[x]) else set()
+        return {self.node_ids[i] for i in self._initially_spans(self.index[x], self.right_codes[right])}
+
+    def terminally_spans(self, s_ids: set[str]) -> set[str]:
+        ids = {self.index[s] for s in s_ids if s in self.index}
+        return {self.node_ids[i] for i in self._terminally_spans(ids)}
+
+    def s_y_a_nodes(self, a: str, y: str) -> set[str]:
+        if a not in self.right_codes or y not in self.index:
+            return set()
+        return {self.node_ids[i] for i in self._s_y_a_nodes(self.right_codes[a], self.index[y])}
+
+    def x_y_a_edge_exist(self, a: str, x: str, y: str) -> bool:
+        if a not in self.right_codes or x not in self.index or y not in self.index:
+            return False
+        return self.index[x] in self._s_y_a_nodes(self.right_codes[a], self.index[y])
+
+    def _tg_neighbours(self, v: int):
+        for code, forward, (offsets, adjacent) in (
+                (TAKE_CODE, True, self.take_out), (TAKE_CODE, False, self.take_in),
+                (GRANT_CODE, True, self.grant_out), (GRANT_CODE, False, self.grant_in)):
+            for i in range(offsets[v], offsets[v + 1]):
+                yield adjacent[i], code, forward
+
+    def tg_neighbours(self, v: str):
+        for w, code, forward in self._tg_neighbours(self.index[v]):
+            yield self.node_ids[w], self.rights[code], forward
+
+    def rwtg_neighbours(self, v: str):
+        yield from self.tg_neighbours(v)
+        i = self.index[v]
+        for forward, (offsets, adjacent, rights) in ((True, self.other_out), (False, self.other_in)):
+            for k in range(offsets[i], offsets[i + 1]):
+                right = self.rights[rights[k]]
+                if right == READ or right == WRITE:
+                    yield self.node_ids[adjacent[k]], right, forward
+
+    def is_subject_node(self, v: str) -> bool:
+        return self.is_subject(self.index[v])
+
+    def _islands(self) -> array:
+        if self._island_ids is not None:
+            return self._island_ids
+        island_ids = array('i', [-1]) * len(self.node_ids)
+        island = -1
+        for v in range(len(self.node_ids)):
+            if not self.is_subject(v) or island_ids[v] != -1:
+                continue
+            island += 1
+            island_ids[v] = island
+            to_visit = [v]
+            while to_visit:
+                u = to_visit.pop()
+                for w, _, _ in self._tg_neighbours(u):
+                    if island_ids[w] == -1 and self.is_subject(w):
+                        island_ids[w] = island
+                        to_visit.append(w)
+        self._island_ids = island_ids
+        return island_ids
+
+    def tg_islands(self) -> dict[str, int]:
+        island_ids = self._islands()
+        return {self.node_ids[v]: island for v, island in enumerate(island_ids) if island != -1}
+
+    def island_of(self, v: str) -> int:
+        return self._islands()[self.index[v]]
+
+    def _island_members(self) -> tuple[array, array]:
+        # members of every island in csr form, cached for the island ids
+        # they were built from
+        island_ids = self._islands()
+        if self._island_csr is None or self._island_csr[0] is not island_ids:
+            count = max(island_ids, default=-1) + 1
+            offsets = array('q', [0]) * (count + 1)
+            for i in island_ids:
+                if i != -1:
+                    offsets[i + 1] += 1
+            for i in range(count):
+                offsets[i + 1] += offsets[i]
+            position = array('q', offsets[:-1])
+            nodes = array('i', [0]) * offsets[count]
+            for u, i in enumerate(island_ids):
+                if i != -1:
+                    nodes[position[i]] = u
+                    position[i] += 1
+            self._island_csr = (island_ids, offsets, nodes)
+        return self._island_csr[1], self._island_csr[2]
+
+    def _reachable_islands(self, xi_islands: set[int], parents: dict | None = None, trace=None, budget=None):
+        # islands joined to the x' islands by bridges, yielded in bfs order
+        # with the subject each is entered at, so that the caller can stop
+        # early. Predecessors go to parents and the search counters to trace
+        # when given.
+        island_ids = self._islands()
+        offsets, nodes = self._island_members()
+
+        def members(island: int) -> array:
+            return nodes[offsets[island]:offsets[island + 1]]
+
+        seen_islands = set(xi_islands)
+        visited = set()
+        to_visit = deque((v, 0) for island in xi_islands for v in members(island))
+        if parents is not None:
+            parents.update(dict.fromkeys(to_visit))
+        nodes_visited = edges_visited = pruned = 0
+        try:
+            while to_visit:
+                v, state = to_visit.popleft()
+                nodes_visited += 1
+                if budget is not None:
+                    budget.spend()
+                for w, code, forward in self._tg_neighbours(v):
+                    edges_visited += 1
+                    next_state = COMPACT_BRIDGE_TRANSITIONS.get((state, code, forward))
+                    if next_state is None:
+                        pruned += 1
+                        continue
+                    if self.is_subject(w):
+                        island = island_ids[w]
+                        if island in seen_islands:
+                            pruned += 1
+                            continue
+                        seen_islands.add(island)
+                        if parents is not None:
+                            parents[(w, 0)] = ((v, state), code, forward)
+                        yield island, w
+                        to_visit.extend((u, 0) for u in members(island))
+                        if parents is not None:
+                            for u in members(island):
+                                parents.setdefault((u, 0), ((w, 0), None, None))
+                    elif (w, next_state) not in visited:
+                        visited.add((w, next_state))
+                        to_visit.append((w, next_state))
+                        if parents is not None:
+                            parents[(w, next_state)] = ((v, state), code, forward)
+                    else:
+                        pruned += 1
+        finally:
+            if trace is not None:
+                trace.nodes_visited += nodes_visited
+                trace.edges_visited += edges_visited
+                trace.pruned += pruned
+
+    def _island_bridge_reachable(self, xi_ids: set[int], si_ids: set[int], trace=None, budget=None) -> bool:
+        island_ids = self._islands()
+        si_islands = {island_ids[s] for s in si_ids}
+        xi_islands = {island_ids[x] for x in xi_ids}
+        if not xi_islands.isdisjoint(si_islands):
+            if trace is not None:
+                x = next(x for x in xi_ids if island_ids[x] in si_islands)
+                self._trace_steps(trace, trace_path({(x, 0): None}, (x, 0), xi_ids, si_ids, island_ids), x)
+            return True
+
+        parents = None if trace is None else {}
+        islands = self._reachable_islands(xi_islands, parents, trace, budget)
+        found = next((w for island, w in islands if island in si_islands), None)
+        islands.close()
+        if trace is not None and found is not None:
+            self._trace_steps(trace, trace_path(parents, (found, 0), xi_ids, si_ids, island_ids), found)
+        return found is not None
+
+    def _trace_steps(self, trace, steps: list[tuple], start: int):
+        names, rights = self.node_ids, self.rights
+        trace.steps = [(names[u], names[v], None if code is None else rights[code], forward)
+                       for u, v, code, forward in steps]
+        trace.witness = witness_nodes(trace.steps, names[start])
+
+    def island_bridge_reachable(self, xi_ids: set[str], si_ids: set[str], trace=None, budget=None) -> bool:
+        return self._island_bridge_reachable({self.index[x] for x in xi_ids},
+                                             {self.index[s] for s in si_ids}, trace, budget)
+
+
+# binary graph file: magic, header length, json header, then the arrays of
+# a CompactTGGraph aligned to 8 bytes. Arrays are native-endian and laid out
+# exactly as in memory, so numpy.frombuffer can read them as well.
+BINARY_MAGIC = b'TGB1'
+BINARY_VERSION = 1
+
+
+class StringTable:
+    # node ids stored as one utf-8 blob plus offsets, decoded on access
+
+    def __init__(self, offsets: memoryview, blob: memoryview):
+        self.offsets = offsets
+        self.blob = blob
+
+    def encoded(self, i: int) -> bytes:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    def __getitem__(self, i: int) -> str:
+        return self.encoded(i).decode()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class SortedIndex:
+    # node id -> int lookup by binary search over ids in sorted order, it
+    # needs no hashing at load time
+
+    def __init__(self, table: StringTable, order: memoryview):
+        self.table = table
+        self.order = order
+
+    def get(self, v: str, default=None):
+        key = v.encode()
+        keys = _SortedKeys(self.table, self.order)
+        i = bisect_left(keys, key)
+        if i < len(self.order) and keys[i] == key:
+            return self.order[i]
+        return default
+
+    def __contains__(self, v: str) -> bool:
+        return self.get(v) is not None
+
+    def __getitem__(self, v: str) -> int:
+        i = self.get(v)
+        if i is None:
+            raise KeyError(v)
+        return i
+
+
+class _SortedKeys:
+    def __init__(self, table: StringTable, order: memoryview):
+        self.table = table
+        self.order = order
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.table.encoded(self.order[i])
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+
+def binary_arrays(graph: CompactTGGraph) -> dict[str, memoryview | array | bytes]:
+    encoded = [v.encode() for v in graph.node_ids]
+    id_offsets = array('q', [0]) * (len(encoded) + 1)
+    for i, v in enumerate(encoded):
+        id_offsets[i + 1] = id_offsets[i] + len(v)
+    order = array('i', sorted(range(len(encoded)), key=encoded.__getitem__))
+
+    return {'id_offsets': id_offsets, 'id_blob': b''.join(encoded),
+            'id_order': order} | csr_arrays(graph)
+
+
+def csr_arrays(graph: CompactTGGraph) -> dict[str, memoryview | array | bytes]:
+    # subjects and every csr part by name, graph_from_arrays reads them back
+    arrays = {'subjects': graph.subjects}
+    for name in ('take_out', 'take_in', 'grant_out', 'grant_in', 'other_out', 'other_in'):
+        for part, arr in zip(('offsets', 'adjacent', 'rights'), getattr(graph, name)):
+            arrays[f'{name}_{part}'] = arr
+    return arrays
+
+
+def array_layout(arrays: dict) -> tuple[dict[str, tuple[int, str, int]], int]:
+    # name -> (offset, format, nbytes) of the arrays packed into one
+    # buffer with 8 byte alignment, and the size of the buffer
+    layout = {}
+    size = 0
+    for name, arr in arrays.items():
+        view = memoryview(arr)
+        layout[name] = (size, view.format, view.nbytes)
+        size += (view.nbytes + 7) // 8 * 8
+    return layout, size
+
+
+def view_arrays(buf: memoryview, layout: dict[str, tuple[int, str, int]]) -> dict[str, memoryview]:
+    # the arrays of array_layout inside buf, nothing is copied
+    return {name: buf[offset:offset + nbytes].cast('B').cast(fmt)
+            for name, (offset, fmt, nbytes) in layout.items()}
+
+
+def write_arrays(filename: str, magic: bytes, header: dict, arrays: dict):
+    # magic, header length, json header with the array layout, then the
+    # arrays aligned to 8 bytes
+    layout, _ = array_layout(arrays)
+    header = json.dumps(header | {'byteorder': sys.byteorder, 'arrays': layout}).encode()
+    start = (len(magic) + 4 + len(header) + 7) // 8 * 8
+
+    with open(filename, 'wb') as file:
+        file.write(magic)
+        file.write(len(header).to_bytes(4, 'little'))
+        file.write(header)
+        for name, arr in arrays.items():
+            file.write(bytes(start + layout[name][0] - file.tell()))
+            file.write(memoryview(arr).cast('B'))
+
+
+def map_arrays(filename: str, magic: bytes, version: int, kind: str) -> tuple[dict, dict[str, memoryview]]:
+    # memory-maps a file of write_arrays, nothing is copied or decoded up front
+    with open(filename, 'rb') as file:
+        buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buf)
+    if bytes(view[:len(magic)]) != magic:
+        raise ValueError("%s is not a %s" % (filename, kind))
+    header_length = int.from_bytes(view[4:8], 'little')
+    header = json.loads(bytes(view[8:8 + header_length]))
+    if header['version'] != version or header['byteorder'] != sys.byteorder:
+        raise ValueError("%s has an unsupported binary format" % filename)
+    start = (8 + header_length + 7) // 8 * 8
+
+    return header, view_arrays(view[start:], header['arrays'])
+
+
+def write_binary_graph(graph: CompactTGGraph, filename: str):
+    write_arrays(filename, BINARY_MAGIC, {'version': BINARY_VERSION, 'rights': graph.rights},
+                 binary_arrays(graph))
+
+
+def graph_from_arrays(arrays: dict[str, memoryview], rights: list[str]) -> CompactTGGraph:
+    # arrays of binary_arrays, or of csr_arrays with the node numbers as ids
+    if 'id_offsets' in arrays:
+        node_ids = StringTable(arrays['id_offsets'], arrays['id_blob'])
+        index = SortedIndex(node_ids, arrays['id_order'])
+    else:
+        node_ids, index = range(len(arrays['take_out_offsets']) - 1), None
+
+    def csr(name: str) -> tuple:
+        parts = [arrays[f'{name}_{part}'] for part in ('offsets', 'adjacent', 'rights')
+                 if f'{name}_{part}' in arrays]
+        return tuple(parts)
+
+    return CompactTGGraph(node_ids, rights, arrays['subjects'],
+                          csr('take_out'), csr('take_in'), csr('grant_out'), csr('grant_in'),
+                          csr('other_out'), csr('other_in'), index=index)
+
+
+def read_binary_graph(filename: str) -> CompactTGGraph:
+    header, arrays = map_arrays(filename, BINARY_MAGIC, BINARY_VERSION, 'binary take-grant graph')
+    return graph_from_arrays(arrays, header['rights'])
+
+
+def read_any_graph(filename: str) -> CompactTGGraph:
+    if filename.endswith('.json'):
+        return CompactTGGraph.from_json(filename)
+    return read_binary_graph(filename)
+
+
+def main(argv):
+    help_msg = 'compact_graph.py -i <protection_graph.json> -o <protection_graph.tgb>'
+
+    src, dst = '', ''
+    try:
+        opts, _ = getopt.getopt(argv, "hi:o:")
+    except getopt.GetoptError:
+        print('Unexpected comand line arguments. Use format:')
+        print('\t' + help_msg)
+        sys.exit()
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_msg)
+            sys.exit()
+        elif opt == '-i':
+            src = arg
+        elif opt == '-o':
+            dst = arg
+
+    if src == '' or dst == '':
+        print('Unexpected comand line arguments. Use format:')
+        print('\t' + help_msg)
+        sys.exit()
+
+    write_binary_graph(CompactTGGraph.from_json(src), dst)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,31 +1,150 @@
+import getopt
 import json
-import uuid
 import random
+import sys
+from array import array
+from dataclasses import dataclass, field
 from utils import *
 
 
-def generate_random_graphs():
-    num_nodes = 30
-    num_edges = 75
-    node_types = ["TAKE", "GRANT", "A"]
-
-    node_labels = [f"node{i}" for i in range(1, num_nodes+1)]
-
-    nodes = [{"label": l, "id": l, "active": random.choice(
-        ["SUBJECT", "OBJECT"])} for l in node_labels]
-
-    edges = [{"id": str(uuid.uuid4()), "cclabel": random.choice(node_types),
-              "source": random.choice(nodes)["id"],
-              "target": random.choice(nodes)["id"]} for _ in range(num_edges)]
-
-    graph = {"graph": {"id": f"{num_nodes}_{num_edges}",
-                       "nodes": nodes, "edges": edges}}
-
-    with open(f"./test/random_graph_{num_nodes}_{num_edges}.json", "w") as f:
-        json.dump(graph, f, indent=2)
-
-
-def generate_chain(input_graph: str, chain_length: int) -> str:
+@dataclass
+class GeneratorConfig:
+    num_nodes: int
+    # random edges, island and bridge edges are generated on top of them.
+    # Random take and grant edges always have an object end, islands keep
+    # their island_size.
+    num_edges: int
+    seed: int = 0
+    subject_ratio: float = 0.5
+    # 'fixed:<k>', 'uniform:<min>:<max>' or 'geometric:<mean>' subjects per island
+    island_size: str = 'fixed:1'
+    # relative weights of the labels of random edges
+    rights: dict[str, float] = field(default_factory=lambda: {TAKE: 0.4, GRANT: 0.2, 'A': 0.4})
+    # share of neighbouring islands joined by a t→ g→ t← bridge
+    bridge_density: float = 0.0
+    label: str = ''
+
+
+def island_sizes(rnd: random.Random, spec: str):
+    kind, *params = spec.split(':')
+    if kind == 'fixed':
+        size = int(params[0])
+        while True:
+            yield size
+    elif kind == 'uniform':
+        low, high = int(params[0]), int(params[1])
+        while True:
+            yield rnd.randint(low, high)
+    elif kind == 'geometric':
+        p = 1 / float(params[0])
+        while True:
+            size = 1
+            while rnd.random() > p:
+                size += 1
+            yield size
+    else:
+        raise ValueError("unknown island size distribution %s" % spec)
+
+
+def node_id(i: int) -> str:
+    return f'node{i}'
+
+
+def generate_nodes(config: GeneratorConfig):
+    num_subjects = round(config.num_nodes * config.subject_ratio)
+    for i in range(config.num_nodes):
+        yield node_id(i), SUBJECT if i < num_subjects else OBJECT
+
+
+def generate_edges(config: GeneratorConfig):
+    # yields (source, target, label) with int node ids, subjects come first
+    rnd = random.Random(config.seed)
+    num_subjects = round(config.num_nodes * config.subject_ratio)
+    num_objects = config.num_nodes - num_subjects
+
+    # islands are runs of consecutive subjects joined by tg edges
+    island_starts = array('i')
+    sizes = island_sizes(rnd, config.island_size)
+    start = 0
+    while start < num_subjects:
+        island_starts.append(start)
+        end = min(num_subjects, start + next(sizes))
+        for v in range(start + 1, end):
+            yield v - 1, v, rnd.choice(TG_PATH_TYPES)
+        start = end
+
+    if num_objects > 0:
+        for i in range(1, len(island_starts)):
+            if rnd.random() < config.bridge_density:
+                o1 = num_subjects + rnd.randrange(num_objects)
+                o2 = num_subjects + rnd.randrange(num_objects)
+                yield island_starts[i - 1], o1, TAKE
+                yield o1, o2, GRANT
+                yield island_starts[i], o2, TAKE
+
+    labels = list(config.rights)
+    weights = list(config.rights.values())
+    for _ in range(config.num_edges):
+        src, dst, label = rnd.randrange(config.num_nodes), rnd.randrange(config.num_nodes), rnd.choices(labels, weights)[0]
+        if label in TG_PATH_TYPES and src < num_subjects and dst < num_subjects:
+            # a tg edge between two subjects would merge their islands,
+            # the target is an object instead
+            if num_objects == 0:
+                continue
+            dst = num_subjects + rnd.randrange(num_objects)
+        yield src, dst, label
+
+
+def write_json_graph(config: GeneratorConfig, filename: str):
+    # streamed element by element, the document never exists in memory
+    label = config.label or f'generated_{config.num_nodes}_{config.num_edges}_{config.seed}'
+    with open(filename, 'w', buffering=1 << 20) as f:
+        f.write('{"%s": {"%s": %s, "%s": %s, "%s": [' % (
+            GRAPH, ID, json.dumps(label), LABEL, json.dumps(label), NODES))
+        # generated ids need no escaping, labels are encoded once
+        node_fmt = '{"%s": "%%s", "%s": "%%s", "%s": "%%s"}' % (LABEL, ID, NODE_TYPE)
+        sep = '\n'
+        for v, node_type in generate_nodes(config):
+            f.write(sep + node_fmt % (v, v, node_type))
+            sep = ',\n'
+        f.write('\n], "%s": [' % EDGES)
+        edge_fmt = '{"%s": "e%%d", "%s": %%s, "%s": "node%%d", "%s": "node%%d"}' % (
+            ID, EDGE_TYPE, SOURCE, TARGET)
+        encoded = {e_type: json.dumps(e_type) for e_type in [*TG_PATH_TYPES, *config.rights]}
+        sep = '\n'
+        for k, (src, dst, e_type) in enumerate(generate_edges(config)):
+            f.write(sep + edge_fmt % (k, encoded[e_type], src, dst))
+            sep = ',\n'
+        f.write('\n]}}\n')
+
+
+def write_binary_generated_graph(config: GeneratorConfig, filename: str):
+    # only int arrays are kept before the csr is written
+    from compact_graph import CompactTGGraph, write_binary_graph, TAKE_CODE, GRANT_CODE
+
+    num_subjects = round(config.num_nodes * config.subject_ratio)
+    subjects = bytearray((config.num_nodes + 7) // 8)
+    for i in range(num_subjects):
+        subjects[i >> 3] |= 1 << (i & 7)
+
+    rights = [TAKE, GRANT]
+    right_codes = {TAKE: TAKE_CODE, GRANT: GRANT_CODE}
+    sources, targets, edge_rights = array('i'), array('i'), array('i')
+    for src, dst, e_type in generate_edges(config):
+        r = right_codes.get(e_type)
+        if r is None:
+            r = right_codes[e_type] = len(rights)
+            rights.append(e_type)
+        sources.append(src)
+        targets.append(dst)
+        edge_rights.append(r)
+
+    node_ids = [node_id(i) for i in range(config.num_nodes)]
+    graph = CompactTGGraph.from_edges(node_ids, subjects, rights, sources, targets, edge_rights)
+    write_binary_graph(graph, filename)
+
+
+def generate_chain(input_graph: dict, chain_length: int) -> dict:
     output_graph = {
         "graph": {
             "label": f"chain_{chain_length}_" + input_graph["graph"]["label"],
@@ -59,11 +178,65 @@ def generate_chain(input_graph: str, chain_length: int) -> str:
     return output_graph
 
 
-graph_name = 'example3-complex-graph'
-with open(f"./test/{graph_name}.json", "r") as f:
-    input_graph = json.load(f)
-
-chain_length = 86
-output_graph = generate_chain(input_graph, chain_length)
-with open(f"./test/chain_{chain_length}_{graph_name}.json", "w") as f:
-    json.dump(output_graph, f, indent=2)
+def parse_rights(spec: str) -> dict[str, float]:
+    # TAKE:0.4,GRANT:0.2,A:0.4
+    return {label: float(weight) for label, weight in (item.split(':') for item in spec.split(','))}
+
+
+def main(argv):
+    help_msg = 'graph_generator.py -o <output.json|output.tgb> -n <nodes> -e <edges> [-s <seed>] ' \
+               '[-r <subject_ratio>] [-i <island_size>] [-l <TAKE:0.4,GRANT:0.2,A:0.4>] [-b <bridge_density>]\n' \
+               '\tgraph_generator.py -o <output.json> -c <chain_length> -g <input_graph.json>'
+
+    config = GeneratorConfig(num_nodes=30, num_edges=75)
+    output, chain_length, chain_input = '', 0, ''
+    try:
+        opts, _ = getopt.getopt(argv, "ho:n:e:s:r:i:l:b:c:g:")
+    except getopt.GetoptError:
+        print('Unexpected comand line arguments. Use format:')
+        print('\t' + help_msg)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_msg)
+            sys.exit()
+        elif opt == '-o':
+            output = arg
+        elif opt == '-n':
+            config.num_nodes = int(arg)
+        elif opt == '-e':
+            config.num_edges = int(arg)
+        elif opt == '-s':
+            config.seed = int(arg)
+        elif opt == '-r':
+            config.subject_ratio = float(arg)
+        elif opt == '-i':
+            config.island_size = arg
+        elif opt == '-l':
+            config.rights = parse_rights(arg)
+        elif opt == '-b':
+            config.bridge_density = float(arg)
+        elif opt == '-c':
+            chain_length = int(arg)
+        elif opt == '-g':
+            chain_input = arg
+
+    if output == '':
+        print('Unexpected comand line arguments. Use format:')
+        print('\t' + help_msg)
+        sys.exit(2)
+
+    if chain_length:
+        with open(chain_input, 'r') as f:
+            input_graph = json.load(f)
+        with open(output, 'w') as f:
+            json.dump(generate_chain(input_graph, chain_length), f, indent=2)
+    elif output.endswith('.json'):
+        write_json_graph(config, output)
+    else:
+        write_binary_generated_graph(config, output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
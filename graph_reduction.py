@@ -0,0 +1,140 @@
+import logging
+import networkx as nx
+
+from take_grant import *
+
+
+class ReducedGraph:
+    # smaller take/grant graph answering can_share like the original one.
+    # Islands are contracted to their first subject, chains of objects
+    # with a single take edge in and out are replaced by one take edge,
+    # objects without take/grant edges and all other rights are left out.
+    # Conditions 0 and 1 read the a edges of the original graph, spans and
+    # condition 4 run on the reduced one. Extra spans that contraction
+    # adds are always island/bridge-connected to real ones.
+
+    def __init__(self, graph: nx.MultiDiGraph):
+        self.original = graph
+        self.graph = nx.MultiDiGraph()
+        # original node -> reduced node, None for removed and chain objects
+        self.mapping = dict[str, str | None]()
+        # reduced node -> original nodes it stands for
+        self.members = dict[str, list[str]]()
+        # chain object -> reduced node of the take predecessor of the chain,
+        # every chain object is terminally spanned like it
+        self.chain_heads = dict[str, str]()
+
+        island_ids = tg_islands(graph)
+        island_nodes = dict[int, str]()
+        neighbours = dict[str, list[tuple[str, str, bool]]]()
+        for v in graph:
+            if v in island_ids:
+                rep = island_nodes.setdefault(island_ids[v], v)
+                if rep == v:
+                    self.graph.add_node(v, **{NODE_TYPE: SUBJECT})
+                self.mapping[v] = rep
+                self.members.setdefault(rep, []).append(v)
+                continue
+            neighbours[v] = list(tg_neighbours(graph, v))
+            if not neighbours[v]:
+                self.mapping[v] = None
+                continue
+            self.mapping[v] = v
+            self.members[v] = [v]
+            self.graph.add_node(v, **{NODE_TYPE: OBJECT})
+
+        # objects that only pass a single take edge on
+        def take_link(v: str) -> tuple[str, str] | None:
+            edges = neighbours.get(v)
+            if edges is None or len(edges) != 2:
+                return None
+            (p, p_type, p_forward), (q, q_type, q_forward) = sorted(edges, key=lambda e: e[2])
+            if p_type != TAKE or q_type != TAKE or p_forward or not q_forward or v in (p, q):
+                return None
+            return p, q
+
+        links = {v: link for v in neighbours if (link := take_link(v)) is not None}
+        for v, (p, _) in links.items():
+            if p in links:
+                continue
+            # v starts a chain, walk it to its first node that is kept
+            chain = [v]
+            q = links[v][1]
+            while q in links:
+                chain.append(q)
+                q = links[q][1]
+            head = self.mapping[p]
+            for o in chain:
+                self.mapping[o] = None
+                self.members.pop(o)
+                self.graph.remove_node(o)
+                self.chain_heads[o] = head
+            self._add_edge(head, self.mapping[q], TAKE)
+        # objects on closed take cycles reach and span nothing
+        for v in links:
+            if v not in self.chain_heads and self.mapping[v] is not None:
+                self.mapping[v] = None
+                self.members.pop(v)
+                self.graph.remove_node(v)
+
+        for v in graph:
+            u = self.mapping[v]
+            if u is None:
+                continue
+            for w, e_type, forward in tg_neighbours(graph, v):
+                if forward and self.mapping[w] is not None:
+                    self._add_edge(u, self.mapping[w], e_type)
+
+        if log.isEnabledFor(logging.INFO):
+            log.info('[reduce_graph] %s', self.stats())
+
+    def _add_edge(self, u: str, v: str, e_type: str):
+        # parallel edges add nothing, neither do loops on subjects
+        if u == v and self.graph.nodes[u][NODE_TYPE] == SUBJECT:
+            return
+        key = f'{e_type}:{u}:{v}'
+        if not self.graph.has_edge(u, v, key):
+            self.graph.add_edge(u, v, key=key, **{EDGE_TYPE: e_type})
+
+    def s_node(self, s: str) -> str | None:
+        # reduced node whose terminal span is the one of s
+        node = self.mapping.get(s)
+        return node if node is not None else self.chain_heads.get(s)
+
+    def can_share(self, a: str, x: str, y: str) -> bool | None:
+        if x == y:
+            return None
+
+        # conditions 0 and 1
+        s_ids = s_y_a_nodes(self.original, a, y)
+        if x in s_ids:
+            return True
+        if not s_ids:
+            return False
+
+        # condition 2, an island is spanned by itself
+        x_node = self.mapping.get(x)
+        if x_node is None:
+            return False
+        if self.graph.nodes[x_node][NODE_TYPE] == SUBJECT:
+            xi_ids = {x_node}
+        else:
+            xi_ids = initially_spans(self.graph, x_node)
+        if not xi_ids:
+            return False
+
+        # condition 3
+        si_ids = terminally_spans(self.graph, {node for s in s_ids if (node := self.s_node(s)) is not None})
+        if not si_ids:
+            return False
+
+        # condition 4
+        return island_bridge_reachable(self.graph, xi_ids, si_ids)
+
+    def stats(self) -> dict[str, int | float]:
+        nodes, edges = len(self.original), self.original.number_of_edges()
+        reduced_nodes, reduced_edges = self.graph.number_of_nodes(), self.graph.number_of_edges()
+        return {'nodes': nodes, 'edges': edges,
+                'reduced_nodes': reduced_nodes, 'reduced_edges': reduced_edges,
+                'node_ratio': reduced_nodes / nodes if nodes else 1.0,
+                'edge_ratio': reduced_edges / edges if edges else 1.0}
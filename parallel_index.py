@@ -0,0 +1,302 @@
+import multiprocessing as mp
+import pickle
+
+from array import array
+from can_share_index import *
+from shared_arrays import attach_shared, close_shared, share_arrays
+
+# frontiers smaller than this are expanded in the parent process, a pool
+# round trip costs more than the work
+MIN_PARALLEL_FRONTIER = 4096
+
+# take components per worker in the span phase, more parts balance better
+SPAN_PARTS_PER_PROCESS = 4
+
+# worker process state, attached once by _attach
+_graph = None
+_arrays = dict[str, memoryview]()
+
+# union-find roots of the three forests, -1 for a node that is its own root
+ROOT_ARRAYS = ('island_roots', 'bridge_roots', 'take_roots')
+
+
+def index_arrays(graph: CompactTGGraph) -> dict:
+    # the csr arrays the workers read and the state arrays all processes write
+    n = len(graph)
+    arrays = csr_arrays(graph)
+    arrays['reachable'] = bytearray(3 * n)
+    arrays['exit_subject'] = array('i', [-1]) * (3 * n)
+    for name in ROOT_ARRAYS + ('islands', 'components', 'labels', 'terminal_index'):
+        arrays[name] = array('i', [-1]) * n
+    return arrays
+
+
+def copy_array(view: memoryview) -> array:
+    arr = array('i')
+    arr.frombytes(view.cast('B'))
+    return arr
+
+
+def _attach(shm_name: str, layout: dict[str, tuple[int, str, int]], rights: list[str]):
+    global _graph
+    _arrays.update(attach_shared(shm_name, layout))
+    _graph = graph_from_arrays(_arrays, rights)
+
+
+def forest_pairs(parent: SparseForest) -> array:
+    # (v, root) of every node that is not its own root, flattened
+    pairs = array('i')
+    for v in list(parent):
+        pairs.append(v)
+        pairs.append(find(parent, v))
+    return pairs
+
+
+def range_unions(graph: CompactTGGraph, kind: str, start: int, stop: int) -> array:
+    # union-find over the out-edges of one node range: tg edges between
+    # subjects for 'islands', take edges between any nodes for 'take'
+    parent = SparseForest()
+    csrs = (graph.take_out, graph.grant_out) if kind == 'islands' else (graph.take_out,)
+    for v in range(start, stop):
+        if kind == 'islands' and not graph.is_subject(v):
+            continue
+        for offsets, adjacent in csrs:
+            for i in range(offsets[v], offsets[v + 1]):
+                w = adjacent[i]
+                if kind == 'take' or graph.is_subject(w):
+                    union(parent, v, w)
+    return forest_pairs(parent)
+
+
+def _range_unions_task(args: tuple[str, int, int]) -> array:
+    return range_unions(_graph, *args)
+
+
+def _merge_task(forests: list[array]) -> array:
+    # the larger forest is already flat and is taken as it is
+    first, *rest = sorted(forests, key=len, reverse=True)
+    parent = SparseForest(zip(first[0::2], first[1::2]))
+    for pairs in rest:
+        for i in range(0, len(pairs), 2):
+            union(parent, pairs[i], pairs[i + 1])
+    return forest_pairs(parent)
+
+
+def _store_task(args: tuple[str, array]):
+    name, pairs = args
+    roots = _arrays[name]
+    for i in range(0, len(pairs), 2):
+        roots[pairs[i]] = pairs[i + 1]
+
+
+def _count_roots_task(args: tuple[str, int, int]) -> int:
+    name, start, stop = args
+    roots = _arrays[name]
+    return sum(1 for v in range(start, stop) if roots[v] == -1 and _graph.is_subject(v))
+
+
+def _number_roots_task(args: tuple[str, str, int, int, int]):
+    # subjects that are roots get consecutive numbers from first
+    name, target, start, stop, first = args
+    roots, numbers = _arrays[name], _arrays[target]
+    for v in range(start, stop):
+        if roots[v] == -1 and _graph.is_subject(v):
+            numbers[v] = first
+            first += 1
+
+
+def _number_members_task(args: tuple[str, str, int, int]):
+    name, target, start, stop = args
+    roots, numbers = _arrays[name], _arrays[target]
+    for v in range(start, stop):
+        if roots[v] != -1 and _graph.is_subject(v):
+            numbers[v] = numbers[roots[v]]
+
+
+def _components_task(args: tuple[int, int]):
+    roots, components = _arrays['bridge_roots'], _arrays['components']
+    for v in range(*args):
+        if _graph.is_subject(v):
+            components[v] = v if roots[v] == -1 else roots[v]
+
+
+def _seed_task(args: tuple[int, int]) -> array:
+    # the subject states every bfs starts from
+    reachable, exit_subject = _arrays['reachable'], _arrays['exit_subject']
+    frontier = array('i')
+    for v in range(*args):
+        if _graph.is_subject(v):
+            reachable[3 * v] = 1
+            exit_subject[3 * v] = v
+            frontier.append(3 * v)
+    return frontier
+
+
+def _reachable_task(frontier: array) -> array:
+    return expand_reachable(_graph, _arrays['reachable'], frontier)
+
+
+def _exits_task(frontier: array) -> array:
+    return expand_exits(_graph, _arrays['exit_subject'], frontier)
+
+
+def _bridge_unions_task(args: tuple[int, int]) -> array:
+    parent = SparseForest()
+    bridge_unions(_graph, _arrays['reachable'], _arrays['exit_subject'], range(*args), parent)
+    return forest_pairs(parent)
+
+
+def _take_parts_task(args: tuple[int, int, int]) -> list[array]:
+    # nodes with take edges of a range, split by the root of their take
+    # component, so every part holds whole components
+    start, stop, parts = args
+    roots = _arrays['take_roots']
+    offsets_out, offsets_in = _graph.take_out[0], _graph.take_in[0]
+    found = [array('i') for _ in range(parts)]
+    for v in range(start, stop):
+        if offsets_out[v] != offsets_out[v + 1] or offsets_in[v] != offsets_in[v + 1]:
+            found[(v if roots[v] == -1 else roots[v]) % parts].append(v)
+    return found
+
+
+def _terminal_task(args: tuple[array, int]) -> list[int]:
+    # terminal spans of the take sccs of one part, the scc of node v is
+    # table slot terminal_index[v]
+    nodes, first = args
+    scc, reach = _graph._take_reach(_arrays['labels'], {0: 0}, nodes)
+    terminal_index = _arrays['terminal_index']
+    for v in nodes:
+        terminal_index[v] = first + scc[v]
+    return reach
+
+
+def _spans_task(args: tuple[int, int, bytes]) -> tuple[list[int], array, array]:
+    # initial and terminal spans of a range as numbers into a list of the
+    # distinct bitsets, nodes without take edges span only themselves
+    start, stop, table = args
+    table = pickle.loads(table)
+    labels, terminal_index = _arrays['labels'], _arrays['terminal_index']
+    offsets, granters = _graph.grant_in
+
+    def terminal(v: int) -> int:
+        if terminal_index[v] != -1:
+            return table[terminal_index[v]]
+        return 1 << labels[v] if _graph.is_subject(v) else 0
+
+    distinct = {}
+    initial, terminal_ids = array('i'), array('i')
+    for x in range(start, stop):
+        bits = 1 << labels[x] if _graph.is_subject(x) else 0
+        for i in range(offsets[x], offsets[x + 1]):
+            bits |= terminal(granters[i])
+        initial.append(distinct.setdefault(bits, len(distinct)))
+        terminal_ids.append(distinct.setdefault(terminal(x), len(distinct)))
+    return list(distinct), initial, terminal_ids
+
+
+def node_ranges(n: int, parts: int) -> list[tuple[int, int]]:
+    step = max(1, -(-n // parts))
+    return [(start, min(n, start + step)) for start in range(0, n, step)]
+
+
+def merge_forests(pool, forests: list[array], name: str, processes: int):
+    # pairwise merges in the workers until one forest is left, its roots go
+    # to the shared array name
+    while len(forests) > 1:
+        merged = pool.map(_merge_task, [forests[k:k + 2] for k in range(0, len(forests) - 1, 2)])
+        if len(forests) % 2:
+            merged.append(forests[-1])
+        forests = merged
+    pairs = forests[0] if forests else array('i')
+    pool.map(_store_task, [(name, pairs[2 * start:2 * stop])
+                           for start, stop in node_ranges(len(pairs) // 2, processes)])
+
+
+def number_roots(pool, name: str, target: str, ranges: list[tuple[int, int]]):
+    # dense numbers of the sets of forest name in order of their first
+    # subject, written to target for every subject
+    counts = pool.map(_count_roots_task, [(name, start, stop) for start, stop in ranges])
+    firsts = [sum(counts[:k]) for k in range(len(counts))]
+    pool.map(_number_roots_task, [(name, target, start, stop, first)
+                                  for (start, stop), first in zip(ranges, firsts)])
+    pool.map(_number_members_task, [(name, target, start, stop) for start, stop in ranges])
+
+
+def parallel_frontier(pool, task, expand, frontier: array, processes: int):
+    # level by level bfs, large levels are split between the workers. The
+    # state arrays are shared, a state marked by two workers at once is
+    # only expanded twice.
+    while frontier:
+        if len(frontier) < MIN_PARALLEL_FRONTIER:
+            frontier = expand(frontier)
+            continue
+        parts = [frontier[k::processes] for k in range(processes)]
+        frontier = array('i')
+        for found in pool.map(task, parts):
+            frontier.extend(found)
+
+
+def parallel_index_parts(graph: CompactTGGraph, processes: int) -> tuple[array, array, list[int], list[int]]:
+    # islands, bridge components and the initial and terminal span bitsets
+    # of CanShareIndex, equal to the single process build. The csr arrays
+    # are copied once into shared memory and the workers build a
+    # CompactTGGraph over them. Every step is split by node range: union-find
+    # tasks keep only the nodes they touch and their forests are merged
+    # pairwise, sets are numbered from a prefix sum of per range counts,
+    # reachable and exit states are level by level bfs over shared state
+    # arrays and terminal spans are split by take component. The parent only
+    # joins the per range results.
+    n = len(graph)
+    shm, layout, shared = share_arrays(index_arrays(graph))
+    try:
+        with mp.Pool(processes, initializer=_attach, initargs=(shm.name, layout, graph.rights)) as pool:
+            ranges = node_ranges(n, processes)
+
+            # islands
+            merge_forests(pool, pool.map(_range_unions_task, [('islands', start, stop) for start, stop in ranges]),
+                          'island_roots', processes)
+            number_roots(pool, 'island_roots', 'islands', ranges)
+            islands = copy_array(shared['islands'])
+            graph._island_ids = islands
+
+            # bridge components
+            frontier = array('i')
+            for found in pool.map(_seed_task, ranges):
+                frontier.extend(found)
+            reachable, exit_subject = shared['reachable'], shared['exit_subject']
+            parallel_frontier(pool, _reachable_task, lambda f: expand_reachable(graph, reachable, f),
+                              frontier, processes)
+            parallel_frontier(pool, _exits_task, lambda f: expand_exits(graph, exit_subject, f),
+                              frontier, processes)
+            merge_forests(pool, pool.map(_bridge_unions_task, ranges), 'bridge_roots', processes)
+            pool.map(_components_task, ranges)
+            components = copy_array(shared['components'])
+            number_roots(pool, 'bridge_roots', 'labels', ranges)
+
+            # terminal spans per take component, initial spans from them
+            merge_forests(pool, pool.map(_range_unions_task, [('take', start, stop) for start, stop in ranges]),
+                          'take_roots', processes)
+            count = processes * SPAN_PARTS_PER_PROCESS
+            parts = [array('i') for _ in range(count)]
+            for found in pool.map(_take_parts_task, [(start, stop, count) for start, stop in ranges]):
+                for nodes, part in zip(parts, found):
+                    nodes.extend(part)
+            parts = [nodes for nodes in parts if nodes]
+            firsts = [sum(len(nodes) for nodes in parts[:k]) for k in range(len(parts))]
+            table = []
+            for nodes, reach in zip(parts, pool.map(_terminal_task, list(zip(parts, firsts)))):
+                # a part has at most one scc per node
+                table.extend(reach)
+                table.extend([0] * (len(nodes) - len(reach)))
+            table = pickle.dumps(table)
+
+            interned = {0: 0}
+            initial, terminal = [], []
+            for distinct, initial_ids, terminal_ids in pool.imap(
+                    _spans_task, [(start, stop, table) for start, stop in ranges]):
+                distinct = [interned.setdefault(bits, bits) for bits in distinct]
+                initial.extend([distinct[i] for i in initial_ids])
+                terminal.extend([distinct[i] for i in terminal_ids])
+        return islands, components, initial, terminal
+    finally:
+        close_shared(shm, shared)
@@ -0,0 +1,34 @@
+from multiprocessing import shared_memory
+from compact_graph import array_layout, view_arrays
+
+# kept out of compact_graph, take_grant imports it and must not load
+# multiprocessing
+
+
+def share_arrays(arrays: dict) -> tuple[shared_memory.SharedMemory, dict, dict[str, memoryview]]:
+    # copies the arrays into a new shared memory block, workers open it
+    # with attach_shared. The views have to be released before close_shared.
+    layout, size = array_layout(arrays)
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    views = view_arrays(shm.buf, layout)
+    for name, arr in arrays.items():
+        views[name].cast('B')[:] = memoryview(arr).cast('B')
+    return shm, layout, views
+
+
+def close_shared(shm: shared_memory.SharedMemory, views: dict[str, memoryview]):
+    for view in views.values():
+        view.release()
+    shm.close()
+    shm.unlink()
+
+
+# shared memory blocks opened by this worker process, kept open for its lifetime
+_attached = dict[str, shared_memory.SharedMemory]()
+
+
+def attach_shared(shm_name: str, layout: dict[str, tuple[int, str, int]]) -> dict[str, memoryview]:
+    shm = _attached.get(shm_name)
+    if shm is None:
+        shm = _attached[shm_name] = shared_memory.SharedMemory(name=shm_name)
+    return view_arrays(shm.buf, layout)
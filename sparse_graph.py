@@ -0,0 +1,86 @@
+import numpy as np
+
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from compact_graph import *
+
+
+def csr_matrix_of(n: int, csr: tuple) -> csr_matrix:
+    # boolean adjacency over the compact graph arrays, sums are ors
+    offsets, adjacent = csr[0], csr[1]
+    indices = np.frombuffer(adjacent, dtype=np.int32) if len(adjacent) else np.zeros(0, np.int32)
+    return csr_matrix((np.ones(len(adjacent), dtype=bool), indices,
+                       np.frombuffer(offsets, dtype=np.int64)), shape=(n, n))
+
+
+class SparseTGGraph(CompactTGGraph):
+    # CompactTGGraph whose spans and islands are computed with scipy.sparse.
+    # Spans are frontier propagation with sparse matrix-vector products over
+    # the take matrix, islands are connected components of the subject-only
+    # tg subgraph. Selected by building this class in place of CompactTGGraph.
+
+    __slots__ = ('_take', '_subject_mask')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._take = None
+        self._subject_mask = None
+
+    @classmethod
+    def from_compact(cls, graph: CompactTGGraph) -> 'SparseTGGraph':
+        # shares the arrays, memory-mapped graphs stay mapped
+        return cls(graph.node_ids, graph.rights, graph.subjects,
+                   graph.take_out, graph.take_in, graph.grant_out, graph.grant_in,
+                   graph.other_out, graph.other_in, index=graph._index)
+
+    @property
+    def take_matrix(self) -> csr_matrix:
+        # take_matrix[u, v] for u t→ v, so take_matrix @ frontier are the takers
+        if self._take is None:
+            self._take = csr_matrix_of(len(self), self.take_out)
+        return self._take
+
+    @property
+    def subject_mask(self) -> np.ndarray:
+        if self._subject_mask is None:
+            bits = np.unpackbits(np.frombuffer(self.subjects, dtype=np.uint8), bitorder='little')
+            self._subject_mask = bits[:len(self)].astype(bool)
+        return self._subject_mask
+
+    def _take_closure(self, frontier: np.ndarray) -> np.ndarray:
+        # frontier and every node with a t→* path into it
+        reached = frontier.copy()
+        take = self.take_matrix
+        while frontier.any():
+            frontier = take @ frontier
+            frontier &= ~reached
+            reached |= frontier
+        return reached
+
+    def _spans_from(self, starts, subjects) -> set[int]:
+        frontier = np.zeros(len(self), dtype=bool)
+        frontier[list(starts)] = True
+        reached = self._take_closure(frontier) & self.subject_mask
+        return set(np.flatnonzero(reached).tolist()) | subjects
+
+    def _initially_spans(self, x: int, a: int = GRANT_CODE) -> set[int]:
+        return self._spans_from(self._s_y_a_nodes(a, x), {x} if self.is_subject(x) else set())
+
+    def _terminally_spans(self, s_ids: set[int]) -> set[int]:
+        starts = set()
+        for s in s_ids:
+            starts |= self._s_y_a_nodes(TAKE_CODE, s)
+        return self._spans_from(starts, {s for s in s_ids if self.is_subject(s)})
+
+    def _islands(self) -> array:
+        if self._island_ids is not None:
+            return self._island_ids
+        n = len(self)
+        tg = csr_matrix_of(n, self.take_out) + csr_matrix_of(n, self.grant_out)
+        subjects = np.flatnonzero(self.subject_mask)
+        _, labels = connected_components(tg[subjects][:, subjects], directed=True, connection='weak')
+        island_ids = array('i', [-1]) * n
+        for v, island in zip(subjects.tolist(), labels.tolist()):
+            island_ids[v] = island
+        self._island_ids = island_ids
+        return island_ids
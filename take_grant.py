@@ -1,13 +1,108 @@
-import logging as log
-import multiprocessing as mp
+import logging
 import networkx as nx
 
-from itertools import product
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import chain, product
+from time import monotonic, perf_counter
+from compact_graph import CompactTGGraph, trace_path, witness_nodes
 from utils import *
 
-log.basicConfig(format='%(process)d-%(levelname)s-%(message)s',
-                level=log.INFO, filename='./log/take_grant.log', filemode='w')
-# log.disable()
+# configured by the caller, see can_share.main
+log = logging.getLogger('take_grant')
+
+# states counter shared by the condition 4 pool workers, see init_pool_budget
+_pool_states = None
+
+# de facto flows add the connections { t→* r→, w← t←*, t→* r→ w← t←* },
+# information moves from the end of the path to its start
+FLOW_READ = 3
+FLOW_TRANSITIONS = BRIDGE_TRANSITIONS | {
+    (BRIDGE_START, READ, True): FLOW_READ,
+    (BRIDGE_TAKE_FWD, READ, True): FLOW_READ,
+    (BRIDGE_START, WRITE, False): BRIDGE_TAKE_BWD,
+    (FLOW_READ, WRITE, False): BRIDGE_TAKE_BWD,
+}
+
+# how many states a budget spends between two looks at the clock and the
+# shared counter of the other processes
+BUDGET_CHECK_INTERVAL = 256
+
+
+class BudgetExceeded(Exception):
+    # raised inside the searches, can_share turns it into CanShareExceeded
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Budget:
+    # cooperative limits of one can_share call, spent once per expanded
+    # state. deadline is time.monotonic() based, so it holds across the
+    # processes of one machine. shared is an mp.Value counting the states
+    # of every process working on the call, stale() tells under its lock
+    # that the call is over and shared may already count another one.
+
+    def __init__(self, deadline: float | None = None, max_states: int | None = None, shared=None, stale=None):
+        self.deadline = deadline
+        self.max_states = max_states
+        self.shared = shared
+        self.stale = stale
+        self.states = 0
+        self._flushed = 0
+        self._checked = 0
+        self.start = monotonic()
+
+    def spend(self, n: int = 1):
+        self.states += n
+        if self.max_states is not None and self.states > self.max_states:
+            self.flush()
+            raise BudgetExceeded('max_states')
+        if self.states - self._checked >= BUDGET_CHECK_INTERVAL:
+            self.check()
+
+    def flush(self) -> int:
+        # adds the states since the last flush to shared, returns the total
+        if self.shared is None:
+            self._flushed = self.states
+            return self.states
+        with self.shared.get_lock():
+            if self.stale is None or not self.stale():
+                self.shared.value += self.states - self._flushed
+            total = self.shared.value
+        self._flushed = self.states
+        return total
+
+    def check(self):
+        self._checked = self.states
+        if self.max_states is not None and self.flush() > self.max_states:
+            raise BudgetExceeded('max_states')
+        if self.deadline is not None and monotonic() > self.deadline:
+            raise BudgetExceeded('deadline')
+
+    def remaining_time(self) -> float | None:
+        return None if self.deadline is None else max(0.0, self.deadline - monotonic())
+
+    def limits(self) -> tuple[float | None, int | None]:
+        # what a worker needs to build its own budget
+        return self.deadline, self.max_states
+
+    def exceeded(self, reason: str) -> 'CanShareExceeded':
+        return CanShareExceeded(reason, self.states, monotonic() - self.start)
+
+
+@dataclass
+class CanShareExceeded:
+    # can_share result when a limit ran out before an answer was found,
+    # with the counters reached so far. It has no truth value, callers
+    # have to tell it apart from True and False.
+    reason: str
+    # states expanded by all processes, seconds since can_share started
+    states: int
+    elapsed: float
+
+    def __bool__(self):
+        raise TypeError('can_share gave up (%s), the answer is unknown' % self.reason)
 
 
 def dfs_for_spans(
@@ -15,17 +110,22 @@ def dfs_for_spans(
         visited: set[str], to_visit: list[tuple[str, str]]):
 
     while to_visit:
-        v, parent = to_visit.pop()
+        v, _ = to_visit.pop()
         if v not in visited:
             visited.add(v)
             if graph.nodes[v][NODE_TYPE] == SUBJECT:
                 ids.add(v)
             for src, _, d in graph.in_edges(nbunch=v, data=True):
-                if src != parent and d[EDGE_TYPE] == TAKE:
+                if d[EDGE_TYPE] == TAKE:
                     to_visit.append((src, v))
 
 
-def initially_spans(graph: nx.MultiDiGraph, x: str) -> set[str]:
+def initially_spans(graph: nx.MultiDiGraph, x: str, right: str = GRANT) -> set[str]:
+    # t→* g→ spans by default, t→* w→ (rw-initial) and t→* r→ (rw-terminal)
+    # spans only differ in the last edge
+    if isinstance(graph, CompactTGGraph):
+        return graph.initially_spans(x, right)
+
     x_ids = set()
     # add x == x'
     x_node = graph.nodes.get(x)
@@ -35,7 +135,7 @@ def initially_spans(graph: nx.MultiDiGraph, x: str) -> set[str]:
     # if x' initially spans to x
     # get nodes that grant to x
     g_to_x = {src for src, _, d in graph.in_edges(
-        nbunch=x, data=True) if d[EDGE_TYPE] == GRANT}
+        nbunch=x, data=True) if d[EDGE_TYPE] == right}
 
     # t->* paths from subjects to grant nodes
     visited = set()
@@ -45,6 +145,9 @@ def initially_spans(graph: nx.MultiDiGraph, x: str) -> set[str]:
 
 
 def terminally_spans(graph: nx.MultiDiGraph, s_ids: set[str]) -> set[str]:
+    if isinstance(graph, CompactTGGraph):
+        return graph.terminally_spans(s_ids)
+
     si_ids = set()
     # add s == s', get nodes that take to s
     to_visit = []
@@ -62,34 +165,43 @@ def terminally_spans(graph: nx.MultiDiGraph, s_ids: set[str]) -> set[str]:
     return si_ids
 
 
+def bulk_spans(graph: nx.MultiDiGraph) -> tuple[dict[str, set[str]], dict[str, set[str]]]:
+    # initially_spans(v) and terminally_spans({v}) of every node in two passes
+    if not isinstance(graph, CompactTGGraph):
+        graph = CompactTGGraph.from_graph(graph)
+    return graph.bulk_spans()
+
+
 def get_edge_data(graph: nx.MultiDiGraph, u: str, v: str, key: str) -> dict[str, str] | None:
-    try:
-        return graph[u][v][key]
-    except KeyError:
-        try:
-            return graph[v][u][key]
-        except [KeyError]:
-            return None
+    # the undirected view yields edges in either direction
+    data = graph.get_edge_data(u, v, key)
+    if data is None:
+        data = graph.get_edge_data(v, u, key)
+    return data
+
+
+def edge_table(graph: nx.MultiDiGraph) -> dict[str, tuple[str, str, str]]:
+    # edge id -> (source, target, edge type), the undirected view keeps
+    # the ids but not the orientation
+    return {key: (u, v, d[EDGE_TYPE]) for u, v, key, d in graph.edges(keys=True, data=True)}
 
 
 def is_island_bridge_subpath(
-        graph: nx.MultiDiGraph, edge: dict[str, str], node: str,
-        prev_edge: dict[str, str] | None, prev_node: str) -> bool:
+        graph: nx.MultiDiGraph, edge: tuple[str, str, str], node: str,
+        prev_edge: tuple[str, str, str] | None, prev_node: str) -> bool:
 
-    if edge is None:
-        return False
-    _, e_tgt, e_data = edge[SOURCE], edge[TARGET], edge
+    _, e_tgt, e_type = edge
 
     # only tg-paths allowed
-    if e_data.get(EDGE_TYPE) not in TG_PATH_TYPES:
+    if e_type not in TG_PATH_TYPES:
         return False
 
     if prev_edge is None:
         return True
-    pe_src, pe_tgt, pe_data = prev_edge[SOURCE], prev_edge[TARGET], prev_edge
+    pe_src, pe_tgt, pe_type = prev_edge
 
     # only tg-paths allowed
-    if pe_data.get(EDGE_TYPE) not in TG_PATH_TYPES:
+    if pe_type not in TG_PATH_TYPES:
         return False
 
     # island
@@ -99,64 +211,158 @@ def is_island_bridge_subpath(
     # bridge paths are { t→* , t←*, t→* g→ t←*, t→* g← t←* }
     #
     # t→* path can be extended by GRANT edge or other t→* path
-    if pe_tgt == prev_node and pe_data[EDGE_TYPE] == TAKE:
-        if e_data[EDGE_TYPE] == GRANT:
+    if pe_tgt == prev_node and pe_type == TAKE:
+        if e_type == GRANT:
             return True
-        elif e_data[EDGE_TYPE] == TAKE and e_tgt == node:
+        elif e_type == TAKE and e_tgt == node:
             return True
         return False
     # t←* paths can be extended only by themselves
-    elif pe_src == prev_node and pe_data[EDGE_TYPE] == TAKE:
-        if e_tgt == prev_node and e_data[EDGE_TYPE] == TAKE:
+    elif pe_src == prev_node and pe_type == TAKE:
+        if e_tgt == prev_node and e_type == TAKE:
             return True
         return False
     # only t←* paths allowed after GRANT edge
-    elif pe_data[EDGE_TYPE] == GRANT:
-        if e_tgt == prev_node and e_data[EDGE_TYPE] == TAKE:
+    elif pe_type == GRANT:
+        if e_tgt == prev_node and e_type == TAKE:
             return True
         return False
 
     return False
 
 
-def is_island_bridge_path(graph: nx.MultiDiGraph, path: tuple[str, str, any], xi: str, si: str, strict: bool = True) -> bool:
+def is_island_bridge_path(graph: nx.MultiDiGraph, path: tuple[str, str, any], xi: str, si: str,
+                          strict: bool = True, table: dict[str, tuple[str, str, str]] | None = None) -> bool:
     if strict:
         src, trgt = path[0], path[-1]
         if graph.nodes[src[0]][NODE_TYPE] != SUBJECT or graph.nodes[trgt[1]][NODE_TYPE] != SUBJECT:
             return False
+    if table is None:
+        table = edge_table(graph)
 
-    ok_path = True
     prev_edge = None
     for prev_node, curr_node, edge_id in path:
-        edge = get_edge_data(graph, prev_node, curr_node, edge_id)
-        ok = is_island_bridge_subpath(
-            graph, edge, curr_node, prev_edge, prev_node)
-        log.debug('[is_island_bridge_path:xi=%s, si=%s] prev_node=%s, curr_node=%s, ok=%s',
-                  xi, si, prev_node, curr_node, ok)
-        if not ok:
-            ok_path = False
-            break
+        edge = table[edge_id]
+        if not is_island_bridge_subpath(graph, edge, curr_node, prev_edge, prev_node):
+            return False
         prev_edge = edge
+    return True
 
-    log.debug('[is_island_bridge_path:xi=%s, si=%s] ok_path=%s',
-              xi, si, ok_path)
-    return ok_path
 
-
-def island_bridge_paths_exist(args: tuple[nx.MultiDiGraph, nx.MultiGraph, tuple[str, str]]) -> bool:
-    graph, graph_view, xi_si = args
+def island_bridge_paths_exist(args: tuple) -> bool:
+    # (graph, (xi, si)) with an optional edge_table and the budget limits
+    # at the end
+    graph, xi_si = args[:2]
+    table = args[2] if len(args) > 2 and args[2] is not None else edge_table(graph)
+    budget = Budget(*args[3], shared=_pool_states) if len(args) > 3 and args[3] is not None else None
     xi, si = xi_si
-    log.info('[is_island_bridge_path: xi=%s, si=%s]', xi, si)
 
-    paths = island_bridge_paths_search(graph, graph_view, xi, si)
-    for path in paths:
-        log.info('[is_island_bridge_path:xi=%s, si=%s] path=%s', xi, si, path)
-        if is_island_bridge_path(graph, path, xi, si):
-            return True
-    return False
+    paths = island_bridge_paths_search(graph, xi, si, table, budget)
+    try:
+        for path in paths:
+            if is_island_bridge_path(graph, path, xi, si, table=table):
+                return True
+        return False
+    finally:
+        if budget is not None:
+            budget.flush()
+
+
+def tg_neighbours(graph: nx.MultiDiGraph, v: str):
+    # undirected walk over tg edges, yields (neighbour, edge type, traversed forward)
+    if isinstance(graph, CompactTGGraph):
+        yield from graph.tg_neighbours(v)
+        return
+    for _, w, d in graph.out_edges(nbunch=v, data=True):
+        if d[EDGE_TYPE] in TG_PATH_TYPES:
+            yield w, d[EDGE_TYPE], True
+    for w, _, d in graph.in_edges(nbunch=v, data=True):
+        if d[EDGE_TYPE] in TG_PATH_TYPES:
+            yield w, d[EDGE_TYPE], False
+
+
+def rwtg_neighbours(graph: nx.MultiDiGraph, v: str):
+    # same as tg_neighbours, READ and WRITE edges included
+    if isinstance(graph, CompactTGGraph):
+        yield from graph.rwtg_neighbours(v)
+        return
+    for _, w, d in graph.out_edges(nbunch=v, data=True):
+        if d[EDGE_TYPE] in RWTG_PATH_TYPES:
+            yield w, d[EDGE_TYPE], True
+    for w, _, d in graph.in_edges(nbunch=v, data=True):
+        if d[EDGE_TYPE] in RWTG_PATH_TYPES:
+            yield w, d[EDGE_TYPE], False
+
+
+def is_subject_node(graph: nx.MultiDiGraph, v: str) -> bool:
+    if isinstance(graph, CompactTGGraph):
+        return graph.is_subject_node(v)
+    return graph.nodes[v][NODE_TYPE] == SUBJECT
+
+
+def tg_islands(graph: nx.MultiDiGraph) -> dict[str, int]:
+    # islands are maximal subject-only subgraphs connected by tg edges
+    if isinstance(graph, CompactTGGraph):
+        return graph.tg_islands()
+
+    island_ids = dict[str, int]()
+    island = -1
+    for v, d in graph.nodes(data=True):
+        if d[NODE_TYPE] != SUBJECT or v in island_ids:
+            continue
+        island += 1
+        island_ids[v] = island
+        to_visit = [v]
+        while to_visit:
+            u = to_visit.pop()
+            for w, _, _ in tg_neighbours(graph, u):
+                if w not in island_ids and graph.nodes[w][NODE_TYPE] == SUBJECT:
+                    island_ids[w] = island
+                    to_visit.append(w)
+    return island_ids
+
+
+def island_members(island_ids: dict[str, int]) -> dict[int, list[str]]:
+    members = dict[int, list[str]]()
+    for v, island in island_ids.items():
+        members.setdefault(island, []).append(v)
+    return members
+
+
+def island_bridge_reachable(
+        graph: nx.MultiDiGraph, xi_ids: set[str], si_ids: set[str],
+        island_ids: dict[str, int] | None = None, trace: 'CanShareTrace | None' = None,
+        budget: Budget | None = None) -> bool:
+
+    if isinstance(graph, CompactTGGraph):
+        return graph.island_bridge_reachable(xi_ids, si_ids, trace, budget)
+    if island_ids is None:
+        island_ids = tg_islands(graph)
+
+    # x' and s' in the same island
+    si_islands = {island_ids[s] for s in si_ids}
+    xi_islands = {island_ids[x] for x in xi_ids}
+    if not xi_islands.isdisjoint(si_islands):
+        if trace is not None:
+            x = next(x for x in xi_ids if island_ids[x] in si_islands)
+            trace.steps = trace_path({(x, BRIDGE_START): None}, (x, BRIDGE_START), xi_ids, si_ids, island_ids)
+            trace.witness = witness_nodes(trace.steps, x)
+        return True
+
+    parents = None if trace is None else {}
+    islands = reachable_islands(graph, xi_islands, island_ids, parents, trace, budget)
+    found = next((w for island, w in islands if island in si_islands), None)
+    islands.close()
+    if trace is not None and found is not None:
+        trace.steps = trace_path(parents, (found, BRIDGE_START), xi_ids, si_ids, island_ids)
+        trace.witness = witness_nodes(trace.steps, found)
+    return found is not None
 
 
 def x_y_a_edge_exist(graph: nx.MultiDiGraph, a: str, x: str, y: str) -> bool:
+    if isinstance(graph, CompactTGGraph):
+        return graph.x_y_a_edge_exist(a, x, y)
+
     x_y_edge = graph.get_edge_data(x, y)
     if x_y_edge is not None and any(edge_data[EDGE_TYPE] == a for edge_data in x_y_edge.values()):
         return True
@@ -164,6 +370,9 @@ def x_y_a_edge_exist(graph: nx.MultiDiGraph, a: str, x: str, y: str) -> bool:
 
 
 def s_y_a_nodes(graph: nx.MultiDiGraph, a: str, y: str) -> set[str]:
+    if isinstance(graph, CompactTGGraph):
+        return graph.s_y_a_nodes(a, y)
+
     s_ids = set()
     for src, _, d in graph.in_edges(nbunch=y, data=True):
         if d[EDGE_TYPE] == a:
@@ -171,7 +380,19 @@ def s_y_a_nodes(graph: nx.MultiDiGraph, a: str, y: str) -> set[str]:
     return s_ids
 
 
-def island_bridge_paths_search(graph: nx.MultiDiGraph, graph_view: nx.MultiGraph, src: str, trgt: str):
+def in_rights(graph: nx.MultiDiGraph, y: str) -> dict[str, set[str]]:
+    # right -> nodes with an edge to y labeled with it
+    if isinstance(graph, CompactTGGraph):
+        return graph.in_rights(y)
+
+    s_by_right = dict[str, set[str]]()
+    for src, _, d in graph.in_edges(nbunch=y, data=True):
+        s_by_right.setdefault(d[EDGE_TYPE], set()).add(src)
+    return s_by_right
+
+
+def island_bridge_paths_search(graph: nx.MultiDiGraph, src: str, trgt: str,
+                               table: dict[str, tuple[str, str, str]] | None = None, budget: Budget | None = None):
     if src not in graph:
         raise nx.NodeNotFound("source node %s not in graph" % src)
     if trgt not in graph:
@@ -179,76 +400,624 @@ def island_bridge_paths_search(graph: nx.MultiDiGraph, graph_view: nx.MultiGraph
     if src == trgt:
         return []
 
-    for path in dfs_for_paths_with_pruning(graph, graph_view, src, trgt):
+    if table is None:
+        table = edge_table(graph)
+    for path in dfs_for_paths_with_pruning(graph, src, trgt, table, budget):
         yield path
 
 
-def dfs_for_paths_with_pruning(graph: nx.MultiDiGraph, graph_view: nx.MultiGraph, src: str, trgt: str):
-    visited = []
-    edges = graph_view.edges(src, keys=True)
-    stack = [(iter(edges), len(edges))]
+def dfs_for_paths_with_pruning(graph: nx.MultiDiGraph, src: str, trgt: str,
+                               table: dict[str, tuple[str, str, str]], budget: Budget | None = None):
+    # dfs over the undirected graph. states[i] is the bridge automaton state
+    # after path[:i], so every step is one transition lookup. An edge id
+    # stays visited while the frame that first saw it is on the stack.
+    # Which paths that pruning keeps depends on the order of the edges,
+    # they are taken from graph in insertion order, out-edges first, so the
+    # paths do not depend on hash order.
+    nodes = graph.nodes
+    ends_are_subjects = nodes[src][NODE_TYPE] == SUBJECT and nodes[trgt][NODE_TYPE] == SUBJECT
+    visited = set()
     path = []
+    states = [BRIDGE_START]
+    stack = [(undirected_edges(graph, src), [])]
 
     while stack:
-        children = stack[-1]
-        child = next(children[0], None)
+        children, added = stack[-1]
+        child = next(children, None)
         if child is None:
-            if stack:
-                stack.pop()
-            for _ in range(children[1]):
-                if visited:
-                    visited.pop()
+            stack.pop()
+            visited.difference_update(added)
             if path:
                 path.pop()
-        else:
-            if child[1] == trgt and is_island_bridge_path(graph, path + [child], src, trgt):
-                yield path + [child]
-            elif child[2] not in visited:
-                if is_island_bridge_path(graph, path[-3:] + [child], src, trgt, strict=False):
-                    edges = graph_view.edges(child[1], keys=True)
-                    stack.append((iter(edges), len(edges)))
-                    path.append(child)
-            visited.append(child[2])
+                states.pop()
+            continue
+
+        if budget is not None:
+            budget.spend()
+        v, w, key = child
+        source, _, e_type = table[key]
+        state = BRIDGE_START if nodes[v][NODE_TYPE] == SUBJECT else states[-1]
+        next_state = BRIDGE_TRANSITIONS.get((state, e_type, source == v))
+        if next_state is not None and w == trgt and ends_are_subjects:
+            yield path + [child]
+        elif next_state is not None and key not in visited:
+            path.append(child)
+            states.append(next_state)
+            stack.append((undirected_edges(graph, w), []))
+        if key not in visited:
+            visited.add(key)
+            added.append(key)
+
+
+def undirected_edges(graph: nx.MultiDiGraph, v: str):
+    # (v, neighbour, key) of every edge at v in a fixed order, loops once
+    yield from graph.out_edges(v, keys=True)
+    for u, _, key in graph.in_edges(v, keys=True):
+        if u != v:
+            yield v, u, key
+
+
+@dataclass
+class CanShareTrace:
+    # filled by can_share(..., trace=...) when instrumentation is wanted
+    result: bool | None = None
+    condition: int | None = None
+    timings: dict[str, float] = field(default_factory=dict)
+    s_ids: set[str] = field(default_factory=set)
+    xi_ids: set[str] = field(default_factory=set)
+    si_ids: set[str] = field(default_factory=set)
+    nodes_visited: int = 0
+    edges_visited: int = 0
+    pruned: int = 0
+    # nodes from x' to s', consecutive nodes share a tg edge or an island
+    witness: list[str] | None = None
+    # (u, v, edge type, traversed forward) along the witness, moves inside
+    # an island have no edge type
+    steps: list[tuple[str, str, str | None, bool | None]] | None = None
+    _clock: float = field(default=0.0, repr=False)
 
+    def start(self):
+        self._clock = perf_counter()
 
-def can_share(graph: nx.MultiDiGraph, a: str, x: str, y: str) -> bool | None:
+    def lap(self, condition: int):
+        now = perf_counter()
+        self.timings[f'condition_{condition}'] = now - self._clock
+        self.condition = condition
+        self._clock = now
+
+
+def can_share(graph: nx.MultiDiGraph, a: str, x: str, y: str,
+              enumerate_paths: bool = False, executor=None, trace=None,
+              timeout: float | None = None, max_states: int | None = None) -> bool | None | CanShareExceeded:
+    # trace is a CanShareTrace to fill or a hook called with a new one, the
+    # witness and search counters come from the single process search only.
+    # timeout (seconds) and max_states bound condition 4, in workers as
+    # well, CanShareExceeded is returned once one of them runs out.
+    if trace is not None and (executor is not None or enumerate_paths):
+        raise ValueError('trace is not supported with executor or enumerate_paths')
+    budget = None
+    if timeout is not None or max_states is not None:
+        budget = Budget(None if timeout is None else monotonic() + timeout, max_states)
+    if trace is None:
+        return conditions(graph, a, x, y, enumerate_paths, executor, None, budget)
+
+    hook = None
+    if not isinstance(trace, CanShareTrace):
+        hook, trace = trace, CanShareTrace()
+    trace.start()
+    trace.result = conditions(graph, a, x, y, enumerate_paths, executor, trace, budget)
+    if hook is not None:
+        hook(trace)
+    return trace.result
+
+
+def conditions(graph: nx.MultiDiGraph, a: str, x: str, y: str, enumerate_paths: bool, executor,
+               trace: CanShareTrace | None, budget: Budget | None = None) -> bool | None | CanShareExceeded:
     if x == y:
         return None
 
     # condition 0
     if x_y_a_edge_exist(graph, a, x, y):
+        if trace is not None:
+            trace.lap(0)
         log.info('[can_share:condition #0] true')
         return True
+    if trace is not None:
+        trace.lap(0)
 
     # condition 1
     s_ids = s_y_a_nodes(graph, a, y)
+    if trace is not None:
+        trace.s_ids = s_ids
+        trace.lap(1)
     log.info('[can_share:condition #1] s_ids=%s', s_ids)
     if not s_ids:
         return False
 
     # condition 2
     xi_ids = initially_spans(graph, x)
+    if trace is not None:
+        trace.xi_ids = xi_ids
+        trace.lap(2)
     log.info('[can_share:condition #2] xi_ids=%s', xi_ids)
     if not xi_ids:
         return False
 
     # condition 3
     si_ids = terminally_spans(graph, s_ids)
+    if trace is not None:
+        trace.si_ids = si_ids
+        trace.lap(3)
     log.info('[can_share:condition #3] si_ids=%s', si_ids)
     if not si_ids:
         return False
 
     # condition 4
-    undirected_graph_view = graph.to_undirected(as_view=True)
-    args = ((graph, undirected_graph_view, xi_si)
-            for xi_si in product(xi_ids, si_ids))
-    with mp.Pool() as pool:
-        for res in pool.imap_unordered(island_bridge_paths_exist, args):
-            if res:
+    try:
+        if budget is not None:
+            budget.check()
+        if executor is not None or enumerate_paths:
+            res = condition_4_pool(graph, xi_ids, si_ids, enumerate_paths, executor, budget)
+        else:
+            res = island_bridge_reachable(graph, xi_ids, si_ids, trace=trace, budget=budget)
+    except BudgetExceeded as e:
+        res = budget.exceeded(e.reason)
+        log.info('[can_share:condition #4] %s', res)
+    if trace is not None:
+        trace.lap(4)
+    return res
+
+
+def reachable_islands(graph: nx.MultiDiGraph, xi_islands: set[int], island_ids: dict[str, int] | None = None,
+                      parents: dict | None = None, trace: 'CanShareTrace | None' = None,
+                      budget: Budget | None = None):
+    # islands joined to the x' islands by bridges, yielded in bfs order with
+    # the subject each is entered at, so that the caller can stop early.
+    # Single bfs over (node, bridge state) pairs, every subject resets the
+    # automaton because islands are joined by tg edges anyway. Predecessors
+    # go to parents and the search counters to trace when given.
+    if isinstance(graph, CompactTGGraph):
+        yield from graph._reachable_islands(xi_islands, parents, trace, budget)
+        return
+    if island_ids is None:
+        island_ids = tg_islands(graph)
+
+    members = island_members(island_ids)
+    seen_islands = set(xi_islands)
+    visited = set()
+    to_visit = deque((v, BRIDGE_START) for island in xi_islands for v in members[island])
+    if parents is not None:
+        parents.update(dict.fromkeys(to_visit))
+    nodes_visited = edges_visited = pruned = 0
+    try:
+        while to_visit:
+            v, state = to_visit.popleft()
+            nodes_visited += 1
+            if budget is not None:
+                budget.spend()
+            for w, e_type, forward in tg_neighbours(graph, v):
+                edges_visited += 1
+                next_state = BRIDGE_TRANSITIONS.get((state, e_type, forward))
+                if next_state is None:
+                    pruned += 1
+                    continue
+                if graph.nodes[w][NODE_TYPE] == SUBJECT:
+                    island = island_ids[w]
+                    if island in seen_islands:
+                        pruned += 1
+                        continue
+                    seen_islands.add(island)
+                    if parents is not None:
+                        parents[(w, BRIDGE_START)] = ((v, state), e_type, forward)
+                    yield island, w
+                    to_visit.extend((u, BRIDGE_START) for u in members[island])
+                    if parents is not None:
+                        for u in members[island]:
+                            parents.setdefault((u, BRIDGE_START), ((w, BRIDGE_START), None, None))
+                elif (w, next_state) not in visited:
+                    visited.add((w, next_state))
+                    to_visit.append((w, next_state))
+                    if parents is not None:
+                        parents[(w, next_state)] = ((v, state), e_type, forward)
+                else:
+                    pruned += 1
+    finally:
+        if trace is not None:
+            trace.nodes_visited += nodes_visited
+            trace.edges_visited += edges_visited
+            trace.pruned += pruned
+
+
+def can_share_rights(graph: nx.MultiDiGraph, rights: set[str] | None, x: str, y: str,
+                     index=None) -> set[str] | None:
+    # the rights over y that x can obtain, out of rights or out of every
+    # right held over y when rights is None. x' and the island search are
+    # shared by all rights, only the s and s' sets are per right.
+    if x == y:
+        return None
+    if index is not None:
+        return index.can_share_rights(rights, x, y)
+
+    s_by_right = in_rights(graph, y)
+    if rights is not None:
+        s_by_right = {a: s_ids for a, s_ids in s_by_right.items() if a in rights}
+
+    # condition 0
+    obtainable = {a for a, s_ids in s_by_right.items() if x in s_ids}
+    pending = {a: s_ids for a, s_ids in s_by_right.items() if a not in obtainable}
+    log.info('[can_share_rights:condition #0] obtainable=%s', obtainable)
+    if not pending:
+        return obtainable
+
+    # condition 2
+    xi_ids = initially_spans(graph, x)
+    log.info('[can_share_rights:condition #2] xi_ids=%s', xi_ids)
+    if not xi_ids:
+        return obtainable
+
+    # conditions 1 and 3, s' islands -> rights they lead to. A compact
+    # graph keeps its cached island array.
+    island_ids = None if isinstance(graph, CompactTGGraph) else tg_islands(graph)
+    island_of = graph.island_of if island_ids is None else island_ids.__getitem__
+    si_rights = dict[int, set[str]]()
+    for a, s_ids in pending.items():
+        for si in terminally_spans(graph, s_ids):
+            si_rights.setdefault(island_of(si), set()).add(a)
+
+    # condition 4, one search until every right is decided
+    remaining = set(pending)
+    xi_islands = {island_of(v) for v in xi_ids}
+    for island in chain(xi_islands, (island for island, _ in reachable_islands(graph, xi_islands, island_ids))):
+        found = si_rights.get(island)
+        if found:
+            remaining -= found
+            if not remaining:
+                break
+    obtainable |= pending.keys() - remaining
+    log.info('[can_share_rights:condition #4] obtainable=%s', obtainable)
+    return obtainable
+
+
+def condition_4_pool(graph: nx.MultiDiGraph, xi_ids: set[str], si_ids: set[str],
+                     enumerate_paths: bool, executor, budget: Budget | None = None) -> bool:
+    if executor is not None:
+        return executor.island_bridge_reachable(xi_ids, si_ids, budget)
+    if isinstance(graph, CompactTGGraph):
+        raise TypeError('path enumeration needs a nx.MultiDiGraph')
+
+    # legacy path enumeration, kept for cross-checking. Members of an
+    # island reach each other, so same-island pairs are true and one pair
+    # per island pair is enumerated.
+    island_ids = tg_islands(graph)
+    pairs = dict[tuple[int, int], tuple[str, str]]()
+    for xi, si in product(xi_ids, si_ids):
+        if island_ids[xi] == island_ids[si]:
+            return True
+        pairs.setdefault((island_ids[xi], island_ids[si]), (xi, si))
+
+    import multiprocessing as mp
+    table = edge_table(graph)
+    limits = None if budget is None else budget.limits()
+    args = ((graph, xi_si, table, limits) for xi_si in pairs.values())
+    states = mp.Value('q', 0)
+    # leaving the pool terminates workers that are still searching
+    with mp.Pool(initializer=init_pool_budget, initargs=(states,)) as pool:
+        results = pool.imap_unordered(island_bridge_paths_exist, args)
+        try:
+            while True:
+                if next_result(results, budget):
+                    return True
+        except StopIteration:
+            return False
+        finally:
+            if budget is not None:
+                budget.states += states.value
+
+
+def next_result(results, budget: Budget | None):
+    # next imap result, waits no longer than the deadline
+    import multiprocessing as mp
+    try:
+        return results.next(None if budget is None else budget.remaining_time())
+    except mp.TimeoutError:
+        raise BudgetExceeded('deadline')
+
+
+def init_pool_budget(states):
+    global _pool_states
+    _pool_states = states
+
+
+@dataclass
+class CanShareCertificate:
+    # evidence for can_share(a, x, y), checked by verify_certificate
+    a: str
+    x: str
+    y: str
+    condition: int
+    # s has the a edge to y, x' initially spans to x, s' terminally spans to s
+    s: str | None = None
+    xi: str | None = None
+    si: str | None = None
+    # x' t→* g→ x and s' t→* s as (source, target, edge type)
+    initial_span: list[tuple[str, str, str]] = field(default_factory=list)
+    terminal_span: list[tuple[str, str, str]] = field(default_factory=list)
+    # x' to s' over tg edges as (u, v, edge type, traversed forward)
+    path: list[tuple[str, str, str, bool]] = field(default_factory=list)
+    # subjects of the islands on the path and the bridges joining them,
+    # bridges[i] leads from islands[i] to islands[i + 1]
+    islands: list[list[str]] = field(default_factory=list)
+    bridges: list[list[str]] = field(default_factory=list)
+
+
+def can_share_certificate(graph: nx.MultiDiGraph, a: str, x: str, y: str) -> CanShareCertificate | None:
+    # None unless can_share holds, the path comes from the traced search
+    trace = CanShareTrace()
+    if not can_share(graph, a, x, y, trace=trace):
+        return None
+    if trace.condition == 0:
+        return CanShareCertificate(a, x, y, 0)
+
+    xi, si = trace.witness[0], trace.witness[-1]
+    s, terminal_span = take_chain(graph, si, trace.s_ids)
+    initial_span = []
+    if xi != x:
+        p, initial_span = take_chain(graph, xi, s_y_a_nodes(graph, GRANT, x))
+        initial_span.append((p, x, GRANT))
+
+    island_ids = tg_islands(graph)
+    path = []
+    for u, v, e_type, forward in trace.steps:
+        if e_type is None:
+            path += island_path(graph, u, v, island_ids)
+        else:
+            path.append((u, v, e_type, forward))
+
+    islands, bridges = path_islands(graph, xi, path)
+    return CanShareCertificate(a, x, y, 4, s, xi, si, initial_span, terminal_span, path, islands, bridges)
+
+
+def path_islands(graph: nx.MultiDiGraph, xi: str, path: list) -> tuple[list[list[str]], list[list[str]]]:
+    # subjects of the islands on a tg path from xi and the bridges between them
+    # members keeps the subjects of the last island for constant time lookups
+    islands, bridges = [[xi]], []
+    members = {xi}
+    for u, v, _, _ in path:
+        if not is_subject_node(graph, v):
+            if is_subject_node(graph, u):
+                bridges.append([u])
+            bridges[-1].append(v)
+        elif not is_subject_node(graph, u):
+            bridges[-1].append(v)
+            islands.append([v])
+            members = {v}
+        elif v not in members:
+            islands[-1].append(v)
+            members.add(v)
+    return islands, bridges
+
+
+def take_chain(graph: nx.MultiDiGraph, start: str, targets: set[str]) -> tuple[str, list[tuple[str, str, str]]]:
+    # bfs backwards over take edges from the targets, returns the target
+    # reached from start and the start t→* target edges
+    parents = dict.fromkeys(targets)
+    to_visit = deque(targets)
+    while start not in parents:
+        v = to_visit.popleft()
+        for u in s_y_a_nodes(graph, TAKE, v):
+            if u not in parents:
+                parents[u] = v
+                to_visit.append(u)
+    edges = []
+    v = start
+    while parents[v] is not None:
+        edges.append((v, parents[v], TAKE))
+        v = parents[v]
+    return v, edges
+
+
+def island_path(graph: nx.MultiDiGraph, u: str, v: str, island_ids: dict[str, int]) -> list[tuple]:
+    # tg edges between two subjects of one island
+    parents = {u: None}
+    to_visit = deque([u])
+    while v not in parents:
+        w = to_visit.popleft()
+        for z, e_type, forward in tg_neighbours(graph, w):
+            if z not in parents and island_ids.get(z) == island_ids[u]:
+                parents[z] = (w, e_type, forward)
+                to_visit.append(z)
+    steps = []
+    while parents[v] is not None:
+        w, e_type, forward = parents[v]
+        steps.append((w, v, e_type, forward))
+        v = w
+    steps.reverse()
+    return steps
+
+
+def verify_certificate(graph: nx.MultiDiGraph, certificate: CanShareCertificate) -> bool:
+    # linear in the size of the certificate, edges may be lists after a
+    # json round trip
+    c = certificate
+    if c.x == c.y or c.x not in graph or c.y not in graph:
+        return False
+    if c.condition == 0:
+        return x_y_a_edge_exist(graph, c.a, c.x, c.y)
+    if c.condition != 4 or c.s not in graph or c.xi not in graph or c.si not in graph:
+        return False
+    if not (is_subject_node(graph, c.xi) and is_subject_node(graph, c.si)):
+        return False
+    if not x_y_a_edge_exist(graph, c.a, c.s, c.y):
+        return False
+    if not verify_chain(graph, c.initial_span, c.xi, c.x, GRANT):
+        return False
+    if not verify_chain(graph, c.terminal_span, c.si, c.s, TAKE):
+        return False
+
+    v, state = c.xi, BRIDGE_START
+    for u, w, e_type, forward in c.path:
+        if u != v or w not in graph:
+            return False
+        if not x_y_a_edge_exist(graph, e_type, u, w) if forward else not x_y_a_edge_exist(graph, e_type, w, u):
+            return False
+        state = BRIDGE_TRANSITIONS.get((state, e_type, forward))
+        if state is None:
+            return False
+        if is_subject_node(graph, w):
+            state = BRIDGE_START
+        v = w
+    if v != c.si or state != BRIDGE_START:
+        return False
+    # islands and bridges are a summary of the path and have to match it
+    islands, bridges = path_islands(graph, c.xi, c.path)
+    return [list(i) for i in c.islands] == islands and [list(b) for b in c.bridges] == bridges
+
+
+def verify_chain(graph: nx.MultiDiGraph, edges: list, start: str, end: str, last: str) -> bool:
+    # start t→* ... last→ end, empty when start is end
+    if not edges:
+        return start == end
+    v = start
+    for k, (u, w, e_type) in enumerate(edges):
+        expected = last if k == len(edges) - 1 else TAKE
+        if u != v or e_type != expected or w not in graph or not x_y_a_edge_exist(graph, e_type, u, w):
+            return False
+        v = w
+    return v == end
+
+
+def can_steal(graph: nx.MultiDiGraph, a: str, x: str, y: str, index=None) -> bool | None:
+    # x obtains a over y without the cooperation of any owner of it.
+    # index is an optional CanShareIndex of the same graph.
+    if x == y:
+        return None
+    if x_y_a_edge_exist(graph, a, x, y):
+        return False
+    return steal_conditions(graph, s_y_a_nodes(graph, a, y), initially_spans(graph, x), index)
+
+
+def steal_conditions(graph: nx.MultiDiGraph, s_ids: set[str], xi_ids: set[str], index) -> bool:
+    # some x' takes from an owner s, can_share(t, x', s) with x' != s
+    island_ids = None
+    for xi in xi_ids:
+        owners = s_ids - {xi}
+        if not owners:
+            continue
+        if index is not None:
+            if any(index.can_share(TAKE, xi, s) for s in owners):
                 return True
+            continue
+        takers = set()
+        for s in owners:
+            takers |= s_y_a_nodes(graph, TAKE, s)
+        if xi in takers:
+            return True
+        si_ids = terminally_spans(graph, takers)
+        if not si_ids:
+            continue
+        if island_ids is None and not isinstance(graph, CompactTGGraph):
+            island_ids = tg_islands(graph)
+        if island_bridge_reachable(graph, initially_spans(graph, xi), si_ids, island_ids):
+            return True
     return False
 
 
+def can_know(graph: nx.MultiDiGraph, x: str, y: str, index=None) -> bool | None:
+    # de facto: information in y can flow to x
+    if x == y:
+        return None
+    if index is not None:
+        graph = index.graph
+    if x not in graph or y not in graph:
+        return False
+    return flow_reachable(graph, initially_spans(graph, x, WRITE),
+                         initially_spans(graph, y, READ), index)
+
+
+def flow_reachable(graph: nx.MultiDiGraph, xi_ids: set[str], yi_ids: set[str], index=None) -> bool:
+    # x' writes to x (or is x), y' reads y (or is y), bfs from x' to y'
+    # over bridges and connections. Every subject resets the automaton,
+    # with an index whole bridge components are entered at once.
+    if not xi_ids or not yi_ids:
+        return False
+    if not xi_ids.isdisjoint(yi_ids):
+        return True
+
+    components = members = None
+    if index is not None:
+        graph_index = index.graph.index
+        components = index.components
+        members = index.component_members()
+        yi_components = {components[graph_index[v]] for v in yi_ids}
+        seen_components = {components[graph_index[v]] for v in xi_ids}
+        if not seen_components.isdisjoint(yi_components):
+            return True
+        xi_ids = {index.graph.node_ids[u] for c in seen_components for u in members[c]}
+
+    visited = {(v, BRIDGE_START) for v in xi_ids}
+    to_visit = deque(visited)
+    while to_visit:
+        v, state = to_visit.popleft()
+        for w, e_type, forward in rwtg_neighbours(graph, v):
+            next_state = FLOW_TRANSITIONS.get((state, e_type, forward))
+            if next_state is None:
+                continue
+            if is_subject_node(graph, w):
+                if w in yi_ids:
+                    return True
+                next_state = BRIDGE_START
+                if components is not None:
+                    component = components[graph_index[w]]
+                    if component in yi_components:
+                        return True
+                    if component not in seen_components:
+                        seen_components.add(component)
+                        for u in members[component]:
+                            u = index.graph.node_ids[u]
+                            visited.add((u, BRIDGE_START))
+                            to_visit.append((u, BRIDGE_START))
+                    continue
+            if (w, next_state) not in visited:
+                visited.add((w, next_state))
+                to_visit.append((w, next_state))
+    return False
+
+
+@dataclass
+class AuditResult:
+    can_share: bool | None
+    can_steal: bool | None
+    can_know: bool | None
+
+
+def audit(graph: nx.MultiDiGraph, a: str, x: str, y: str, index=None) -> AuditResult:
+    # all predicates for one query, spans are computed once and shared
+    if x == y:
+        return AuditResult(None, None, None)
+    if index is not None:
+        graph = index.graph
+    if x not in graph or y not in graph:
+        return AuditResult(False, False, False)
+
+    know = flow_reachable(graph, initially_spans(graph, x, WRITE),
+                          initially_spans(graph, y, READ), index)
+    if x_y_a_edge_exist(graph, a, x, y):
+        return AuditResult(True, False, know)
+    s_ids = s_y_a_nodes(graph, a, y)
+    xi_ids = initially_spans(graph, x)
+    if not s_ids or not xi_ids:
+        return AuditResult(False, False, know)
+
+    if index is not None:
+        share = index.can_share(a, x, y)
+    else:
+        si_ids = terminally_spans(graph, s_ids)
+        share = bool(si_ids) and island_bridge_reachable(graph, xi_ids, si_ids)
+    # stealing is sharing without the owners, it needs sharing
+    steal = share and steal_conditions(graph, s_ids, xi_ids, index)
+    return AuditResult(share, steal, know)
+
+
 # g = read_graph('./test/random_graph_30_75.json')[0]
 # x = 'node22'
 # y = 'node9'
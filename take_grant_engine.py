@@ -0,0 +1,382 @@
+import networkx as nx
+
+from collections import deque, OrderedDict
+from take_grant import *
+
+# marks a cache miss, None is a valid can_share result
+MISSING = object()
+
+
+class DisjointSets:
+    # union-find over node ids that also keeps the members of every root,
+    # so a single set can be dissolved and rebuilt
+
+    def __init__(self):
+        self.parent = dict[str, str]()
+        self.members = dict[str, set[str]]()
+        # called with both roots before they are merged or with each
+        # dissolved root
+        self.listener = None
+
+    def add(self, v: str):
+        if v not in self.parent:
+            self.parent[v] = v
+            self.members[v] = {v}
+
+    def find(self, v: str) -> str:
+        parent = self.parent
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    def union(self, u: str, v: str):
+        u, v = self.find(u), self.find(v)
+        if u == v:
+            return
+        if self.listener is not None:
+            self.listener(u)
+            self.listener(v)
+        if len(self.members[u]) < len(self.members[v]):
+            u, v = v, u
+        self.parent[v] = u
+        self.members[u] |= self.members.pop(v)
+
+    def dissolve(self, roots: set[str]) -> set[str]:
+        vs = set()
+        for root in roots:
+            if self.listener is not None:
+                self.listener(root)
+            vs |= self.members.pop(root)
+        for v in vs:
+            self.parent[v] = v
+            self.members[v] = {v}
+        return vs
+
+
+def is_subject(graph: nx.MultiDiGraph, v: str) -> bool:
+    return graph.nodes[v][NODE_TYPE] == SUBJECT
+
+
+def object_pocket(graph: nx.MultiDiGraph, objects: set[str]) -> tuple[set[str], set[str]]:
+    # objects tg-connected to the given ones through objects only, and the
+    # subjects on the pocket border. Every bridge touching the pocket stays
+    # inside it.
+    pocket = set(objects)
+    border = set()
+    to_visit = list(objects)
+    while to_visit:
+        v = to_visit.pop()
+        for w, _, _ in tg_neighbours(graph, v):
+            if is_subject(graph, w):
+                border.add(w)
+            elif w not in pocket:
+                pocket.add(w)
+                to_visit.append(w)
+    return pocket, border
+
+
+def pocket_connections(graph: nx.MultiDiGraph, pocket: set[str], border: set[str]):
+    # pairs of border subjects joined by a bridge through the pocket, same
+    # reachable/exit/union passes as can_share_index.bridge_components
+    reachable = set()
+    to_visit = deque((s, BRIDGE_START) for s in border)
+    while to_visit:
+        v, state = to_visit.popleft()
+        for w, e_type, forward in tg_neighbours(graph, v):
+            next_state = BRIDGE_TRANSITIONS.get((state, e_type, forward))
+            if next_state is not None and w in pocket and (w, next_state) not in reachable:
+                reachable.add((w, next_state))
+                to_visit.append((w, next_state))
+
+    exit_subject = {(s, BRIDGE_START): s for s in border}
+    to_visit = deque(exit_subject)
+    while to_visit:
+        w, w_state = to_visit.popleft()
+        for v, e_type, forward in tg_neighbours(graph, w):
+            if v not in pocket:
+                continue
+            for state in (BRIDGE_TAKE_FWD, BRIDGE_TAKE_BWD):
+                next_state = BRIDGE_TRANSITIONS.get((state, e_type, not forward))
+                if next_state is None or (w_state != BRIDGE_START and next_state != w_state):
+                    continue
+                if (v, state) not in exit_subject:
+                    exit_subject[(v, state)] = exit_subject[(w, w_state)]
+                    to_visit.append((v, state))
+
+    sources = [((s, BRIDGE_START), s) for s in border]
+    sources += [(sv, exit_subject[sv]) for sv in reachable if sv in exit_subject]
+    for (v, state), source in sources:
+        for w, e_type, forward in tg_neighbours(graph, v):
+            next_state = BRIDGE_TRANSITIONS.get((state, e_type, forward))
+            if next_state is None:
+                continue
+            if w in border:
+                yield source, w
+            elif (w, next_state) in exit_subject:
+                yield source, exit_subject[(w, next_state)]
+
+
+class CanShareCache:
+    # bounded LRU of query results. Every entry carries the tags it depends
+    # on and invalidate drops only the entries of the given tags.
+
+    def __init__(self, maxsize: int = 1 << 16):
+        self.maxsize = maxsize
+        self.entries = OrderedDict[tuple, tuple]()
+        self.tagged = dict[tuple, set[tuple]]()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key: tuple):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: tuple, value, tags: list[tuple]):
+        if self.maxsize <= 0:
+            return
+        self._drop(key)
+        tags = set(tags)
+        self.entries[key] = (value, tags)
+        for tag in tags:
+            self.tagged.setdefault(tag, set()).add(key)
+        while len(self.entries) > self.maxsize:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _drop(self, key: tuple) -> bool:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        for tag in entry[1]:
+            keys = self.tagged[tag]
+            keys.discard(key)
+            if not keys:
+                del self.tagged[tag]
+        return True
+
+    def invalidate(self, tag: tuple):
+        for key in list(self.tagged.get(tag, ())):
+            if self._drop(key):
+                self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.tagged.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations}
+
+
+class TakeGrantEngine:
+    # applies the de jure rules to a graph and keeps islands, bridge
+    # components and span caches up to date after every mutation
+
+    def __init__(self, graph: nx.MultiDiGraph, cache_size: int = 1 << 16):
+        self.graph = graph
+        self.version = 0
+        self.islands = DisjointSets()
+        self.components = DisjointSets()
+        self.initial_spans = dict[str, set[str]]()
+        self.terminal_spans = dict[str, set[str]]()
+        # can_share results, tagged with the rights into y, the spans and
+        # the bridge components they were computed from
+        self.cache = CanShareCache(cache_size)
+        self.components.listener = lambda root: self.cache.invalidate(('component', root))
+
+        subjects = {v for v in graph if is_subject(graph, v)}
+        for s in subjects:
+            self.islands.add(s)
+            self.components.add(s)
+        self._connect(subjects, {v for v in graph if v not in subjects})
+
+    def _connect(self, subjects: set[str], objects: set[str]):
+        # union islands and components around the given nodes
+        for s in subjects:
+            for w, _, _ in tg_neighbours(self.graph, s):
+                if w in self.islands.parent:
+                    self.islands.union(s, w)
+                    self.components.union(s, w)
+        seen = set()
+        for o in objects:
+            if o in seen:
+                continue
+            pocket, border = object_pocket(self.graph, {o})
+            seen |= pocket
+            for u, v in pocket_connections(self.graph, pocket, border):
+                self.components.union(u, v)
+
+    def _invalidate_spans(self, src: str, dst: str, e_type: str):
+        if e_type == GRANT:
+            self._invalidate_initial(dst)
+            return
+        # takers of everything t→* reachable from dst changed
+        to_visit, visited = [dst], {dst}
+        while to_visit:
+            v = to_visit.pop()
+            self.terminal_spans.pop(v, None)
+            self.cache.invalidate(('terminal', v))
+            self._invalidate_initial(v)
+            for _, w, d in self.graph.out_edges(nbunch=v, data=True):
+                if d[EDGE_TYPE] == GRANT:
+                    self._invalidate_initial(w)
+                elif d[EDGE_TYPE] == TAKE and w not in visited:
+                    visited.add(w)
+                    to_visit.append(w)
+
+    def _invalidate_initial(self, v: str):
+        self.initial_spans.pop(v, None)
+        self.cache.invalidate(('initial', v))
+
+    def _affected(self, src: str, dst: str) -> tuple[set[str], set[str]]:
+        subjects = {v for v in (src, dst) if is_subject(self.graph, v)}
+        objects = {v for v in (src, dst) if v not in subjects}
+        if objects:
+            _, border = object_pocket(self.graph, objects)
+            subjects |= border
+        return subjects, objects
+
+    def add_edge(self, src: str, dst: str, right: str) -> bool:
+        if x_y_a_edge_exist(self.graph, right, src, dst):
+            return False
+        edge_id = f'{src}_{dst}_{right}'
+        self.graph.add_edge(src, dst, key=edge_id, **{
+            ID: edge_id, SOURCE: src, TARGET: dst, EDGE_TYPE: right})
+        self.version += 1
+        self.cache.invalidate(('right', right, dst))
+        if right in TG_PATH_TYPES:
+            # components only merge when edges are added
+            subjects, objects = self._affected(src, dst)
+            self._connect(subjects & {src, dst}, objects)
+            self._invalidate_spans(src, dst, right)
+        return True
+
+    def remove_edge(self, src: str, dst: str, right: str) -> bool:
+        keys = [k for k, d in (self.graph.get_edge_data(src, dst) or {}).items()
+                if d[EDGE_TYPE] == right]
+        if not keys:
+            return False
+        if right in TG_PATH_TYPES:
+            subjects, _ = self._affected(src, dst)
+            self._invalidate_spans(src, dst, right)
+        for k in keys:
+            self.graph.remove_edge(src, dst, key=k)
+        self.version += 1
+        self.cache.invalidate(('right', right, dst))
+        if right not in TG_PATH_TYPES:
+            return True
+
+        # rebuild the islands and components the edge took part in
+        islands = self.islands.dissolve({self.islands.find(s) for s in subjects})
+        components = self.components.dissolve(
+            {self.components.find(s) for s in subjects})
+        for s in islands:
+            for w, _, _ in tg_neighbours(self.graph, s):
+                if w in islands:
+                    self.islands.union(s, w)
+        objects = set()
+        for s in components:
+            for w, _, _ in tg_neighbours(self.graph, s):
+                if w in self.components.parent:
+                    self.components.union(s, w)
+                else:
+                    objects.add(w)
+        self._connect(set(), objects)
+        return True
+
+    def add_node(self, v: str, node_type: str):
+        self.graph.add_node(v, **{ID: v, LABEL: v, NODE_TYPE: node_type})
+        self.version += 1
+        if node_type == SUBJECT:
+            self.islands.add(v)
+            self.components.add(v)
+
+    def _check_subject(self, x: str):
+        if x not in self.graph:
+            raise nx.NodeNotFound("node %s not in graph" % x)
+        if not is_subject(self.graph, x):
+            raise ValueError("node %s is not a subject" % x)
+
+    def take(self, x: str, y: str, z: str, rights: set[str]):
+        # x takes (rights to z) from y
+        self._check_subject(x)
+        if not x_y_a_edge_exist(self.graph, TAKE, x, y):
+            raise ValueError("%s has no take right over %s" % (x, y))
+        for right in rights:
+            if not x_y_a_edge_exist(self.graph, right, y, z):
+                raise ValueError("%s has no %s right over %s" % (y, right, z))
+        for right in rights:
+            self.add_edge(x, z, right)
+
+    def grant(self, x: str, y: str, z: str, rights: set[str]):
+        # x grants (rights to z) to y
+        self._check_subject(x)
+        if not x_y_a_edge_exist(self.graph, GRANT, x, y):
+            raise ValueError("%s has no grant right over %s" % (x, y))
+        for right in rights:
+            if not x_y_a_edge_exist(self.graph, right, x, z):
+                raise ValueError("%s has no %s right over %s" % (x, right, z))
+        for right in rights:
+            self.add_edge(y, z, right)
+
+    def create(self, x: str, y: str, node_type: str, rights: set[str]):
+        # x creates a new subject or object y with rights over it
+        self._check_subject(x)
+        if y in self.graph:
+            raise ValueError("node %s already in graph" % y)
+        self.add_node(y, node_type)
+        for right in rights:
+            self.add_edge(x, y, right)
+
+    def remove(self, x: str, y: str, rights: set[str]):
+        # x removes rights from its own edge to y
+        self._check_subject(x)
+        for right in rights:
+            self.remove_edge(x, y, right)
+
+    def _spans(self, cache: dict[str, set[str]], v: str, compute) -> set[str]:
+        spans = cache.get(v)
+        if spans is None:
+            spans = cache[v] = compute()
+        return spans
+
+    def can_share(self, a: str, x: str, y: str) -> bool | None:
+        key = (a, x, y)
+        res = self.cache.get(key)
+        if res is MISSING:
+            tags = [('right', a, y)]
+            res = self._can_share(a, x, y, tags)
+            self.cache.put(key, res, tags)
+        return res
+
+    def _can_share(self, a: str, x: str, y: str, tags: list[tuple]) -> bool | None:
+        # tags collects what the result depends on
+        if x == y:
+            return None
+        graph = self.graph
+        if x_y_a_edge_exist(graph, a, x, y):
+            return True
+        s_ids = s_y_a_nodes(graph, a, y)
+        if not s_ids:
+            return False
+        tags.append(('initial', x))
+        xi_ids = self._spans(self.initial_spans, x,
+                             lambda: initially_spans(graph, x))
+        if not xi_ids:
+            return False
+        xi_components = {self.components.find(v) for v in xi_ids}
+        tags += [('component', c) for c in xi_components]
+        for s in s_ids:
+            tags.append(('terminal', s))
+            si_ids = self._spans(self.terminal_spans, s,
+                                 lambda: terminally_spans(graph, {s}))
+            si_components = {self.components.find(v) for v in si_ids}
+            tags += [('component', c) for c in si_components - xi_components]
+            if not xi_components.isdisjoint(si_components):
+                return True
+        return False
@@ -1,6 +1,7 @@
 import json
+import os
+import re
 import networkx as nx
-from matplotlib import pyplot as plt
 
 GRAPH = 'graph'
 NODES = 'nodes'
@@ -16,32 +17,173 @@ OBJECT = 'OBJECT'
 TAKE = 'TAKE'
 GRANT = 'GRANT'
 TG_PATH_TYPES = [TAKE, GRANT]
+READ = 'READ'
+WRITE = 'WRITE'
+RWTG_PATH_TYPES = [TAKE, GRANT, READ, WRITE]
 
+# bridge paths are { t→* , t←*, t→* g→ t←*, t→* g← t←* }
+BRIDGE_START = 0
+BRIDGE_TAKE_FWD = 1
+BRIDGE_TAKE_BWD = 2
+
+# (state, edge type, edge traversed forward) -> next state
+BRIDGE_TRANSITIONS = {
+    (BRIDGE_START, TAKE, True): BRIDGE_TAKE_FWD,
+    (BRIDGE_START, TAKE, False): BRIDGE_TAKE_BWD,
+    (BRIDGE_START, GRANT, True): BRIDGE_TAKE_BWD,
+    (BRIDGE_START, GRANT, False): BRIDGE_TAKE_BWD,
+    (BRIDGE_TAKE_FWD, TAKE, True): BRIDGE_TAKE_FWD,
+    (BRIDGE_TAKE_FWD, GRANT, True): BRIDGE_TAKE_BWD,
+    (BRIDGE_TAKE_FWD, GRANT, False): BRIDGE_TAKE_BWD,
+    (BRIDGE_TAKE_BWD, TAKE, False): BRIDGE_TAKE_BWD,
+}
+
+# json graphs smaller than this are parsed with json.load, which is
+# faster, larger ones are streamed element by element
+STREAM_MIN_SIZE = 64 << 20
+
+# characters a json number split between two chunks may continue with
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+
+class JSONStream:
+    # incremental reader for the graph schema, nodes and edges are decoded
+    # one element at a time instead of loading the whole document
+
+    def __init__(self, file, chunk_size: int):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, ch: str):
+        if self.peek() != ch:
+            raise ValueError("expected '%s' at offset %d" % (ch, self.pos))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number may continue in the next chunk
+                if self.eof or not isinstance(value, (int, float)) or \
+                        NUMBER_TAIL.match(self.buf, end).end() < len(self.buf):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                # only an element cut off by the end of the buffer is
+                # worth another chunk, anything else is malformed
+                if self.eof or not self.cut_off(e):
+                    raise
+            self.fill()
+
+    def cut_off(self, e: json.JSONDecodeError) -> bool:
+        # literals and escapes are short, strings and numbers can run up
+        # to the end of the buffer from far before it
+        return len(self.buf) - e.pos <= 6 or e.msg.startswith('Unterminated string') or \
+            NUMBER_TAIL.match(self.buf, e.pos).end() == len(self.buf)
+
+    def object_items(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+    def array_items(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+
+def iter_graph(filename: str, chunk_size: int = 1 << 20, stream_min_size: int = STREAM_MIN_SIZE):
+    # yields (NODES, node) and (EDGES, edge) pairs in file order
+    if os.path.getsize(filename) < stream_min_size:
+        with open(filename, 'r') as file:
+            json_graph = json.load(file).get(GRAPH, {})
+        for graph_key, elements in json_graph.items():
+            if graph_key in (NODES, EDGES):
+                for element in elements:
+                    yield graph_key, element
+        return
 
-def read_graph(filename: str) -> tuple[nx.MultiDiGraph, dict[str, str], dict[str, str]]:
     with open(filename, 'r') as file:
-        json_graph = json.load(file)
-        nodes = json_graph[GRAPH][NODES]
-        edges = json_graph[GRAPH][EDGES]
+        stream = JSONStream(file, chunk_size)
+        for key in stream.object_items():
+            if key != GRAPH:
+                stream.value()
+                continue
+            for graph_key in stream.object_items():
+                if graph_key in (NODES, EDGES):
+                    for element in stream.array_items():
+                        yield graph_key, element
+                else:
+                    stream.value()
 
-    graph = nx.MultiDiGraph()
-    id_attrs = ((node[ID], node) for node in nodes)
-    nodes_to_labels = {node[ID]: node[LABEL] for node in nodes}
-    graph.add_nodes_from(id_attrs)
 
-    id_attrs = ((edge[SOURCE], edge[TARGET], edge[ID], edge) for edge in edges)
-    edges_to_labels = {(edge[SOURCE], edge[TARGET])
-                        : edge[EDGE_TYPE] for edge in edges}
-    graph.add_edges_from(id_attrs)
+def read_graph(filename: str, labels: bool = True) -> tuple[nx.MultiDiGraph, dict[str, str] | None, dict[str, str] | None]:
+    graph = nx.MultiDiGraph()
+    nodes_to_labels = dict[str, str]() if labels else None
+    edges_to_labels = dict[tuple, str]() if labels else None
 
-    return graph, nodes_to_labels, edges_to_labels
+    if os.path.getsize(filename) < STREAM_MIN_SIZE:
+        with open(filename, 'r') as file:
+            json_graph = json.load(file)[GRAPH]
+        nodes, edges = json_graph[NODES], json_graph[EDGES]
+        graph.add_nodes_from((node[ID], node) for node in nodes)
+        graph.add_edges_from((edge[SOURCE], edge[TARGET], edge[ID], edge) for edge in edges)
+        if labels:
+            nodes_to_labels = {node[ID]: node[LABEL] for node in nodes}
+            edges_to_labels = {(edge[SOURCE], edge[TARGET]): edge[EDGE_TYPE] for edge in edges}
+        return graph, nodes_to_labels, edges_to_labels
 
+    for kind, element in iter_graph(filename, stream_min_size=0):
+        if kind == NODES:
+            graph.add_node(element[ID], **element)
+            if labels:
+                nodes_to_labels[element[ID]] = element[LABEL]
+        else:
+            graph.add_edge(element[SOURCE], element[TARGET],
+                           key=element[ID], **element)
+            if labels:
+                edges_to_labels[(element[SOURCE], element[TARGET])
+                                ] = element[EDGE_TYPE]
 
-def print_graph(graph: nx.MultiDiGraph, filename: str, nodes_to_labels: dict[str, str], edges_to_labels: dict[tuple, str]):
-    f = plt.figure(figsize=(20, 20))
-    f.tight_layout()
-    plt.subplot(111)
-    pos = nx.spring_layout(graph)
-    nx.draw(graph, pos=pos, with_labels=True, labels=nodes_to_labels)
-    nx.draw_networkx_edge_labels(graph, pos=pos, edge_labels=edges_to_labels)
-    plt.savefig(filename)
+    return graph, nodes_to_labels, edges_to_labels
@@ -0,0 +1,14 @@
+import networkx as nx
+
+from matplotlib import pyplot as plt
+from utils import *
+
+
+def print_graph(graph: nx.MultiDiGraph, filename: str, nodes_to_labels: dict[str, str], edges_to_labels: dict[tuple, str]):
+    f = plt.figure(figsize=(20, 20))
+    f.tight_layout()
+    plt.subplot(111)
+    pos = nx.spring_layout(graph)
+    nx.draw(graph, pos=pos, with_labels=True, labels=nodes_to_labels)
+    nx.draw_networkx_edge_labels(graph, pos=pos, edge_labels=edges_to_labels)
+    plt.savefig(filename)